@@ -0,0 +1,66 @@
+"""Compares programs translated ahead of time into Python functions with the stack and register interpreters"""
+import os
+import tempfile
+
+from cache import run
+from common import *
+from licm import calculator_loop
+from loading import library
+from tailcalls import countdown
+
+
+def recursive_sum(n: int) -> str:
+    return f"""
+function sum(n)
+    if n == 0 then
+        return 0
+    end
+    return n + sum(n - 1)
+end
+print(sum({n}))
+"""
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("calls 20k", call_loop(20000), ""),
+        ("calc 5k", calculator_loop(5000), "4\n3\n+\n"),
+        ("countdown 100k", countdown(100000), ""),
+        ("sum 10k", recursive_sum(10000), ""),
+    ]
+    print(f"{'program':<16}{'stack s':>10}{'reg s':>10}{'python s':>10}{'vs stack':>10}{'vs reg':>8}")
+    for name, source, stdin in programs:
+        results = {}
+        for backend in ["stack", "register", "python"]:
+            module = compile_source(source, backend=backend)
+            results[backend] = best_of(3, lambda: run_binary(module, stdin))
+        out = results["stack"][0]
+        for backend, (other, vm, elapsed) in results.items():
+            if other != out:
+                raise AssertionError(f"{name}: {backend} printed something else\n{out!r}\n{other!r}")
+        stack, register, python = (results[backend][-1] for backend in ["stack", "register", "python"])
+        print(f"{name:<16}{stack:>10.4f}{register:>10.4f}{python:>10.4f}"
+              f"{stack / python:>9.1f}x{register / python:>7.1f}x")
+
+    # a hit skips the front end and the translation, and for python the Python compiler as well
+    print()
+    print(f"{'functions':>10}{'backend':>10}{'no cache s':>12}{'hit s':>8}")
+    for functions in [50, 200, 1000]:
+        with tempfile.TemporaryDirectory() as cache_home:
+            with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+                f.write(library(functions, 20))
+                path = f.name
+            try:
+                for backend in ["stack", "python"]:
+                    cold = min(run(path, cache_home, "--no-cache", "--backend", backend) for _ in range(3))
+                    run(path, cache_home, "--backend", backend)
+                    hit = min(run(path, cache_home, "--backend", backend) for _ in range(3))
+                    print(f"{functions:>10}{backend:>10}{cold:>12.3f}{hit:>8.3f}")
+            finally:
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Checks that the stack and register backends print the same output and compares dispatch counts"""
+from common import *
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("calls 20k", call_loop(20000), ""),
+    ]
+    print(f"{'program':<16}{'stack instr':>12}{'reg instr':>12}{'ratio':>8}{'stack s':>10}{'reg s':>10}")
+    for name, source, stdin in programs:
+        results = {}
+        for backend in ["stack", "register"]:
+            binary = compile_source(source, backend=backend)
+            results[backend] = best_of(3, lambda: run_binary(binary, stdin, stats=True))
+        (stack_out, stack_vm, stack_time), (reg_out, reg_vm, reg_time) = results["stack"], results["register"]
+        if stack_out != reg_out:
+            raise AssertionError(f"{name}: backends disagree\n{stack_out!r}\n{reg_out!r}")
+        ratio = stack_vm.dispatched / max(reg_vm.dispatched, 1)
+        print(f"{name:<16}{stack_vm.dispatched:>12}{reg_vm.dispatched:>12}{ratio:>7.2f}x{stack_time:>10.4f}{reg_time:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
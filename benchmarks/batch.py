@@ -0,0 +1,55 @@
+"""Compares compiling a directory of scripts one by one with the parallel batch compiler"""
+import os
+import tempfile
+import time
+
+from common import *
+from loading import library
+from compiler.batch import compile_batch, collect
+
+
+def check_collisions(root: str):
+    """Two inputs holding a script of the same name would race on one binary, the batch must refuse them"""
+    for name in ["a", "b"]:
+        os.makedirs(os.path.join(root, name))
+        with open(os.path.join(root, name, "x.lua"), "w") as f:
+            f.write(f'print("{name}")\n')
+    a, b = os.path.join(root, "a"), os.path.join(root, "b")
+    try:
+        compile_batch([a, b], os.path.join(root, "clash"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("colliding binaries were not detected")
+    assert not os.path.exists(os.path.join(root, "clash")), "a colliding batch wrote output"
+    # the same script given twice is compiled once
+    manifest = compile_batch([a, os.path.join(a, "*.lua")], os.path.join(root, "twice"))
+    assert [entry["binary"] for entry in manifest["files"]] == ["x.bin"]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        check_collisions(root)
+        scripts = os.path.join(root, "scripts")
+        os.makedirs(scripts)
+        for i in range(200):
+            with open(os.path.join(scripts, f"script{i}.lua"), "w") as f:
+                f.write(library(5 + i % 10, 10))
+        files = [source for source, _ in collect([scripts])]
+        lines = sum(open(source).read().count("\n") for source in files)
+
+        start = time.perf_counter()
+        for source in files:
+            compile(source)
+        serial = time.perf_counter() - start
+        print(f"{'workers':>8}{'seconds':>10}{'files/s':>10}{'lines/s':>10}")
+        print(f"{'serial':>8}{serial:>10.2f}{len(files) / serial:>10.1f}{lines / serial:>10.0f}")
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            manifest = compile_batch([scripts], os.path.join(root, f"out{workers}"), workers=workers)
+            assert not any("error" in entry for entry in manifest["files"])
+            elapsed = manifest["seconds"]
+            print(f"{workers:>8}{elapsed:>10.2f}{len(files) / elapsed:>10.1f}{lines / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Times loops that spend their time calling builtins, on every backend and dispatch engine"""
+from common import *
+
+
+def conversion_loop(n: int) -> str:
+    """Numbers turned into strings and back on every iteration, the value a read would return"""
+    # tostring turns 0 and 1 into "false" and "true", so they are kept out
+    return f"""
+i = 2
+total = 0
+text = ""
+while i < {n} + 2 do
+    text = tostring(i)
+    total = total + tonumber(text) + tonumber(tostring(i % 7 + 2))
+    i = i + 1
+end
+print(total)
+print(text)
+"""
+
+
+def printing_loop(n: int) -> str:
+    return f"""
+i = 0
+while i < {n} do
+    print(i)
+    print(tostring(i) + "!")
+    i = i + 1
+end
+"""
+
+
+def unknown_builtin() -> str:
+    """Calls a builtin that does not exist from a function that never runs"""
+    return """
+function never(x)
+    return frobnicate(x)
+end
+print("started")
+"""
+
+
+def main():
+    n = 20000
+    # (name, source, builtin calls it makes)
+    programs = [
+        ("convert 20k", conversion_loop(n), 4 * n + 2),
+        ("print 20k", printing_loop(n), 3 * n),
+    ]
+    print(f"{'program':<16}{'backend':<10}{'engine':<8}{'calls':>8}{'time':>8}{'us/call':>9}")
+    for name, source, calls in programs:
+        expected = None
+        for backend, engine in [("stack", "table"), ("stack", "switch"), ("register", "table")]:
+            module = compile_source(source, backend=backend)
+            out, vm, elapsed = best_of(3, lambda: run_binary(module, engine=engine))
+            if expected is None:
+                expected = out
+            elif out != expected:
+                raise AssertionError(f"{name}: {backend} {engine} printed something else")
+            print(f"{name:<16}{backend:<10}{engine:<8}{calls:>8}{elapsed:>8.3f}{elapsed / calls * 1e6:>9.3f}")
+
+    print()
+    for backend in ["stack", "register"]:
+        module = compile_source(unknown_builtin(), backend=backend)
+        try:
+            run_binary(module)
+        except Exception as e:
+            print(f"{backend:<10}rejected before running: {e}")
+        else:
+            raise AssertionError("a program calling an unknown builtin was loaded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Measures vm.py start-up on a .lua file without the compile cache, on a cache miss and on a warm hit"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from loading import library
+
+
+def run(path: str, cache_home: str, *flags) -> float:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, XDG_CACHE_HOME=cache_home)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(root, "vm.py"), *flags, path],
+                   env=env, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{'functions':>10}{'source KB':>11}{'no cache s':>12}{'miss s':>9}{'hit s':>8}{'speedup':>9}")
+    for functions in [50, 200, 1000]:
+        with tempfile.TemporaryDirectory() as cache_home:
+            with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+                f.write(library(functions, 20))
+                path = f.name
+            try:
+                cold = min(run(path, cache_home, "--no-cache") for _ in range(3))
+                miss = run(path, cache_home)
+                hit = min(run(path, cache_home) for _ in range(3))
+                size = os.path.getsize(path) / 1024
+                print(f"{functions:>10}{size:>11.0f}{cold:>12.3f}{miss:>9.3f}{hit:>8.3f}{cold / hit:>8.1f}x")
+            finally:
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
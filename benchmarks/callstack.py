@@ -0,0 +1,139 @@
+"""Compares the frame store of the stack machine with one Frame object per call: call/return cost, bytes per frame and reachable depth"""
+import time
+import tracemalloc
+
+from common import *
+from vm import FrameStore
+
+
+class Frame:
+    """A frame as the stack machine kept it before the frame store: its own operand list and slot list"""
+    __slots__ = ("stack", "values")
+
+    def __init__(self, size: int = 0) -> None:
+        self.stack = []
+        self.values = [None] * size
+
+
+# the frame count the stack machine refused to exceed with Frame objects
+STACK_LIMIT = 999
+
+
+def frame_calls(depth: int, size: int, argc: int, rounds: int) -> float:
+    """Calls down to depth and returns back up, the way the old call and return handlers did"""
+    frames = [Frame(size)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in range(depth):
+            stack = frames[-1].stack
+            stack.extend(range(argc))
+            callee = Frame(size)
+            callee.stack.append(0)
+            values = callee.values
+            for i in reversed(range(argc)):
+                values[i] = stack.pop()
+            frames.append(callee)
+        for _ in range(depth):
+            stack = frames[-1].stack
+            stack.append(None)
+            value = stack.pop()
+            stack.pop()
+            frames.pop()
+            frames[-1].stack.append(value)
+            frames[-1].stack.pop()
+    return time.perf_counter() - start
+
+
+def store_calls(depth: int, size: int, argc: int, rounds: int) -> float:
+    store = FrameStore(size)
+    cells = store.cells
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in range(depth):
+            cells.extend(range(argc))
+            store.call(size, argc, 0, None)
+        for _ in range(depth):
+            cells.append(None)
+            store.ret(cells.pop())
+            cells.pop()
+    return time.perf_counter() - start
+
+
+def frame_bytes(depth: int, size: int) -> float:
+    tracemalloc.start()
+    frames = [Frame(size) for _ in range(depth)]
+    for frame in frames:
+        frame.stack.append(0)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / depth
+
+
+def store_bytes(depth: int, size: int) -> float:
+    store = FrameStore(size)
+    for _ in range(depth):
+        store.call(size, 0, 0, None)
+    return store.used() / depth
+
+
+def runaway() -> str:
+    return """
+function deeper(n)
+    return 1 + deeper(n + 1)
+end
+print(deeper(0))
+"""
+
+
+def reachable_depth(backend: str, memory: int) -> int:
+    module = compile_source(runaway(), backend=backend)
+    vm = (RegisterVM if backend == "register" else VM)(memory=memory)
+    vm.init(module)
+    try:
+        vm.run()
+    except Exception as e:
+        if str(e) != "Stack overflow":
+            raise
+    if backend == "register":
+        return len(vm.frames)
+    return vm.store.depth
+
+
+def main():
+    rounds = 20
+    print(f"{'depth':>7}{'slots':>7}{'Frame us':>10}{'store us':>10}{'Frame B':>9}{'store B':>9}")
+    for depth, size, argc in [(100, 4, 1), (900, 4, 1), (900, 16, 3)]:
+        calls = depth * rounds
+        old = min(frame_calls(depth, size, argc, rounds) for _ in range(3)) / calls * 1e6
+        new = min(store_calls(depth, size, argc, rounds) for _ in range(3)) / calls * 1e6
+        print(f"{depth:>7}{size:>7}{old:>10.3f}{new:>10.3f}"
+              f"{frame_bytes(depth, size):>9.0f}{store_bytes(depth, size):>9.0f}")
+
+    print()
+    print(f"{'memory MB':>10}{'Frame depth':>13}{'stack depth':>13}{'register depth':>16}")
+    for megabytes in [1, 16, 64]:
+        memory = megabytes * 2 ** 20
+        print(f"{megabytes:>10}{STACK_LIMIT:>13}{reachable_depth('stack', memory):>13}"
+              f"{reachable_depth('register', memory):>16}")
+
+    print()
+    print(f"{'program':<16}{'backend':<10}{'instr':>10}{'time':>8}")
+    programs = [("calls 20k", call_loop(20000))]
+    programs += [(f"sum {n}", f"""
+function sum(n)
+    if n == 0 then
+        return 0
+    end
+    return n + sum(n - 1)
+end
+print(sum({n}))
+""") for n in [900, 100000]]
+    for name, source in programs:
+        for backend in ["stack", "register"]:
+            module = compile_source(source, backend=backend)
+            out, vm, elapsed = best_of(3, lambda: run_binary(module, stats=True))
+            print(f"{name:<16}{backend:<10}{vm.dispatched:>10}{elapsed:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Times Program.codegen on generated programs of growing size, linear codegen keeps the time per statement flat"""
+import tracemalloc
+
+from common import *
+from tokens import best_time
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+
+
+def statements(n: int) -> str:
+    """n statements cycling through assignments, ifs, loops and function declarations and calls"""
+    lines = []
+    for i in range(n):
+        kind = i % 5
+        if kind == 0:
+            lines.append(f"x{i % 30} = x{(i + 1) % 30} * 2 + {i}")
+        elif kind == 1:
+            lines.append(f"if x{i % 30} > {i} then x{i % 7} = 1 else x{i % 7} = 2 end")
+        elif kind == 2:
+            lines.append(f"while x{i % 30} < {i} do x{i % 30} = x{i % 30} + 1 if x{i % 5} then break end end")
+        elif kind == 3:
+            lines.append(f"function f{i}(a, b) if a then return a + b end return b end")
+        else:
+            lines.append(f"x{i % 30} = f{i - 1}(x{i % 11}, {i})")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    print(f"{'statements':>11}{'instructions':>14}{'codegen s':>11}{'us/stmt':>9}{'peak MB':>9}")
+    for n in [10000, 100000]:
+        lexer = Lexer()
+        lexer.init(statements(n))
+        tree = Parser(lexer.buffers()).parse()
+        size = len(tree.codegen())
+        seconds = best_time(tree.codegen)
+        tracemalloc.start()
+        tree.codegen()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{n:>11}{size:>14}{seconds:>11.3f}{seconds / n * 1e6:>9.1f}{peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler.compiler import compile
+from compiler.src import binary, pycode
+from vm import VM, RegisterVM, PythonVM
+
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "tests")
+
+
+def counting_loop(n: int) -> str:
+    return f"""
+i = 0
+s = 0
+while i < {n} do
+    i = i + 1
+    if i % 3 == 0 then
+        s = s + i * 2
+    else
+        s = s - 1
+    end
+end
+print(s)
+"""
+
+
+def call_loop(n: int) -> str:
+    return f"""
+function step(x)
+    return x + 1
+end
+
+i = 0
+while i < {n} do
+    i = step(i)
+end
+print(i)
+"""
+
+
+def straight_line(n: int) -> str:
+    """n assignment statements mixing numbers, strings and calls"""
+    lines = []
+    for i in range(n):
+        if i % 10 == 9:
+            lines.append(f'x{i % 50} = "s" + tostring(x{(i + 7) % 50})')
+        else:
+            lines.append(f"x{i % 50} = x{(i + 1) % 50} + {i} * 2.5 - y{i % 13}")
+    return "\n".join(lines) + "\n"
+
+
+def compile_source(source: str, **options) -> bytearray:
+    with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+        f.write(source)
+        path = f.name
+    try:
+        return compile(path, **options)
+    finally:
+        os.remove(path)
+
+
+def run_binary(module: bytearray, stdin: str = "", **options):
+    """Runs a compiled program and returns (stdout, vm, seconds spent in VM.run)"""
+    if pycode.is_python_module(module):
+        options.pop("engine", None)
+        options.pop("hot", None)
+        vm = PythonVM(**options)
+    elif binary.is_module(module) and binary.read_header(memoryview(module))[0] == binary.KIND_REGISTER:
+        options.pop("engine", None)
+        options.pop("hot", None)
+        vm = RegisterVM(**options)
+    else:
+        # every instruction is interpreted and counted unless a benchmark asks for compiled loops
+        options.setdefault("hot", 0)
+        vm = VM(**options)
+    vm.init(module)
+    out = io.StringIO()
+    old_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
+    try:
+        with redirect_stdout(out):
+            start = time.perf_counter()
+            vm.run()
+            elapsed = time.perf_counter() - start
+    finally:
+        sys.stdin = old_stdin
+    return out.getvalue(), vm, elapsed
+
+
+def count_dispatched(module: bytearray, stdin: str = "", **options) -> int:
+    """Instructions a run dispatches, counted in a run of its own so timed runs go without stats"""
+    _, vm, _ = run_binary(module, stdin, stats=True, **options)
+    return vm.dispatched
+
+
+def best_of(repeat: int, fn):
+    best = None
+    for _ in range(repeat):
+        result = fn()
+        if best is None or result[-1] < best[-1]:
+            best = result
+    return best
+
+
+def read_test(name: str) -> str:
+    with open(os.path.join(TESTS_DIR, name), "r") as f:
+        return f.read()
+
+
+# stdin fed to the scripts in data/tests that read input
+TEST_INPUTS = {
+    "calculator.lua": "3\n4\n*\n",
+}
+
+
+def test_programs():
+    for name in sorted(os.listdir(TESTS_DIR)):
+        if name.endswith(".lua"):
+            yield name, read_test(name), TEST_INPUTS.get(name, "")
@@ -0,0 +1,57 @@
+"""
+Compares module size and executed instructions with and without copy propagation and dead store elimination,
+and times every pass on generated programs of growing size
+"""
+import time
+
+from common import *
+from codegen import statements
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+from compiler.src.optimize import PASSES
+
+
+def pass_times(n: int):
+    """Instructions of a statements(n) program and the seconds each pass takes on them, in pipeline order"""
+    lexer = Lexer()
+    lexer.init(statements(n))
+    code = Parser(lexer.buffers()).parse().codegen()
+    size = len(code)
+    seconds = []
+    for run in PASSES.values():
+        start = time.perf_counter()
+        code = run(code)
+        seconds.append(time.perf_counter() - start)
+    return size, seconds
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("calls 20k", call_loop(20000), ""),
+    ]
+    without = ("fold",)
+    with_copies = ("fold", "copies")
+    print(f"{'program':<16}{'backend':<10}{'bytes':>8}{'copies':>8}{'instr':>10}{'copies':>10}{'ratio':>8}{'time':>8}{'copies':>8}")
+    for name, source, stdin in programs:
+        for backend in ["stack", "register"]:
+            results = []
+            for passes in [without, with_copies]:
+                module = compile_source(source, backend=backend, passes=passes)
+                results.append((len(module), best_of(3, lambda: run_binary(module, stdin, stats=True))))
+            (size, (out, vm, elapsed)), (copies_size, (copies_out, copies_vm, copies_elapsed)) = results
+            if out != copies_out:
+                raise AssertionError(f"{name}: copy elimination changed the output\n{out!r}\n{copies_out!r}")
+            ratio = vm.dispatched / max(copies_vm.dispatched, 1)
+            print(f"{name:<16}{backend:<10}{size:>8}{copies_size:>8}{vm.dispatched:>10}{copies_vm.dispatched:>10}"
+                  f"{ratio:>7.2f}x{elapsed:>8.3f}{copies_elapsed:>8.3f}")
+
+    print(f"\n{'statements':>11}{'instr':>10}" + "".join(f"{name + ' s':>10}" for name in PASSES) + f"{'us/instr':>10}")
+    for n in [2000, 8000, 32000]:
+        size, seconds = pass_times(n)
+        print(f"{n:>11}{size:>10}" + "".join(f"{s:>10.3f}" for s in seconds) + f"{sum(seconds) / size * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Compares decode throughput of the unversioned (v0) and versioned (v1) binary formats"""
+import time
+
+from common import *
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+from compiler.src.bytecode import tac2bytecode, bytecode2binary, bytecode2binary_v0
+
+
+def decode_time(module: bytearray, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        vm = VM()
+        vm.bytecode = module
+        vm.pos = 0
+        start = time.perf_counter()
+        vm._decode_bytecode()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print(f"{'statements':>10}{'instr':>10}{'format':>8}{'bytes':>10}{'seconds':>10}{'Minstr/s':>10}{'MB/s':>8}")
+    for n in [1000, 10000, 50000]:
+        lexer = Lexer()
+        lexer.init(straight_line(n))
+        # the same instructions in both formats, v0 has no superinstructions
+        bytecode = tac2bytecode(Parser(lexer.buffers()).parse().codegen(), superinstructions=False)
+        times = {}
+        for name, encode in [("v0", bytecode2binary_v0), ("v1", bytecode2binary)]:
+            module = encode(bytecode)
+            times[name] = decode_time(module)
+            print(f"{n:>10}{len(bytecode):>10}{name:>8}{len(module):>10}{times[name]:>10.4f}"
+                  f"{len(bytecode) / times[name] / 1e6:>10.2f}{len(module) / times[name] / 1e6:>8.1f}")
+        print(f"{'':>10}v1 decodes {times['v0'] / times['v1']:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Compares instructions/sec of the switch and table dispatch engines"""
+from common import *
+
+
+def main():
+    programs = [
+        ("factorial.lua", read_test("factorial.lua")),
+        ("loop 20k", counting_loop(20000)),
+        ("loop 60k", counting_loop(60000)),
+        ("calls 50k", call_loop(50000)),
+    ]
+    print(f"{'program':<16}{'engine':<8}{'instr':>10}{'seconds':>10}{'instr/s':>12}")
+    for name, source in programs:
+        binary = compile_source(source)
+        rates = {}
+        for engine in VM.ENGINES:
+            dispatched = count_dispatched(binary, engine=engine)
+            _, _, elapsed = best_of(3, lambda: run_binary(binary, engine=engine))
+            rates[engine] = dispatched / elapsed
+            print(f"{name:<16}{engine:<8}{dispatched:>10}{elapsed:>10.4f}{rates[engine]:>12.0f}")
+        print(f"{'':<16}speedup {rates['table'] / rates['switch']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
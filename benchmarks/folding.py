@@ -0,0 +1,51 @@
+"""Runs programs with and without constant folding, checks the output is identical and compares work done"""
+from common import *
+
+
+def constant_loop(n: int) -> str:
+    """A loop whose body recomputes values that only depend on literals and constant variables"""
+    return f"""
+limit = {n}
+step = 2 - 1
+scale = 4 * 2 + 1
+debug = 1 > 2
+i = 0
+s = 0
+while i < limit do
+    i = i + step
+    s = s + scale * 3 - 10 / 2
+    if debug then
+        print("at " + tostring(i))
+    end
+    if "a" + "b" == "ab" then
+        s = s + 1
+    end
+end
+print(s)
+"""
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("calls 20k", call_loop(20000), ""),
+        ("constants 20k", constant_loop(20000), ""),
+    ]
+    print(f"{'program':<16}{'backend':<10}{'instr':>10}{'folded':>10}{'ratio':>8}{'time':>10}{'folded':>10}")
+    for name, source, stdin in programs:
+        for backend in ["stack", "register"]:
+            results = {}
+            for passes in [(), ("fold",)]:
+                module = compile_source(source, backend=backend, passes=passes)
+                results[passes] = best_of(3, lambda: run_binary(module, stdin, stats=True))
+            (out, vm, elapsed), (folded_out, folded_vm, folded_elapsed) = results[()], results[("fold",)]
+            if out != folded_out:
+                raise AssertionError(f"{name}: folding changed the output\n{out!r}\n{folded_out!r}")
+            ratio = vm.dispatched / max(folded_vm.dispatched, 1)
+            print(f"{name:<16}{backend:<10}{vm.dispatched:>10}{folded_vm.dispatched:>10}{ratio:>7.2f}x"
+                  f"{elapsed:>10.4f}{folded_elapsed:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
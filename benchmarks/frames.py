@@ -0,0 +1,54 @@
+"""Compares slot counts and frame memory with and without liveness-based temporary sharing"""
+import sys
+
+from common import *
+from loading import library
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+from compiler.src.bytecode import tac2bytecode, bytecode2binary, Enter
+
+
+def straight_numeric(n: int) -> str:
+    lines = [f"x{i} = {i}" for i in range(50)]
+    lines += [f"x{i % 50} = x{(i + 1) % 50} + {i} * 2.5 - x{i % 13}" for i in range(n)]
+    return "\n".join(lines) + "\nprint(x0)\n"
+
+
+def straight_numeric(n: int) -> str:
+    lines = [f"x{i} = {i}" for i in range(50)]
+    lines += [f"x{i % 50} = x{(i + 1) % 50} + {i} * 2.5 - x{i % 13}" for i in range(n)]
+    return "\n".join(lines) + "\nprint(x0)\n"
+
+
+def build(source: str, share_temps: bool):
+    lexer = Lexer()
+    lexer.init(source)
+    tac = Parser(lexer.buffers()).parse().codegen()
+    return tac2bytecode(tac, share_temps=share_temps)
+
+
+def main():
+    programs = [(name, source, stdin) for name, source, stdin in test_programs()]
+    programs += [
+        ("loop 1k", counting_loop(1000), ""),
+        ("library 200x20", library(200, 20), ""),
+        ("straight 5k", straight_numeric(5000), ""),
+        ("calls 1k", call_loop(1000), ""),
+    ]
+    print(f"{'program':>16}{'var ids':>9}{'shared':>8}{'top frame':>11}{'shared':>8}{'frame B':>9}{'shared':>8}")
+    for name, source, stdin in programs:
+        row = {}
+        outputs = []
+        for share in [False, True]:
+            bytecode = build(source, share)
+            ids = sum(line.size for line in bytecode if type(line) == Enter)
+            out, _, _ = run_binary(bytecode2binary(bytecode), stdin)
+            outputs.append(out)
+            row[share] = (ids, bytecode[0].size, sys.getsizeof([None] * bytecode[0].size))
+        assert outputs[0] == outputs[1], f"{name}: output differs"
+        (ids, top, size), (shared_ids, shared_top, shared_size) = row[False], row[True]
+        print(f"{name:>16}{ids:>9}{shared_ids:>8}{top:>11}{shared_top:>8}{size:>9}{shared_size:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measures tokenizer throughput of the master-regex lexer against the rule-by-rule one"""
+import os
+import tempfile
+import time
+
+from common import *
+from compiler.src.lexer import Lexer, LEXERS
+
+
+def lua_source(size: int) -> str:
+    """Generates roughly size bytes of code covering every token kind"""
+    chunks = []
+    total = 0
+    i = 0
+    while total < size:
+        chunk = f"""-- block {i}
+function f{i}(a, b)
+    if a >= b and not (a == {i}) then
+        return a * 2.5 - b / {i + 1}
+    else
+        x{i} = "str {i}" + tostring(a % 7)
+    end
+    while a <= b or a ~= nil do
+        a = a + .5
+    end
+    return true
+end
+print(f{i}({i}, -{i}) > 0, false)
+"""
+        chunks.append(chunk)
+        total += len(chunk)
+        i += 1
+    return "".join(chunks)
+
+
+def lex_time(mode: str, code: str, repeat: int = 3):
+    best = None
+    for _ in range(repeat):
+        lexer = Lexer(mode)
+        lexer.init(code)
+        start = time.perf_counter()
+        tokens = lexer.lex()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, tokens
+
+
+def main():
+    print(f"{'MB':>6}{'tokens':>10}{'lexer':>8}{'seconds':>10}{'MB/s':>8}")
+    for size in [1, 4, 8]:
+        with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+            f.write(lua_source(size * 2 ** 20))
+            path = f.name
+        try:
+            with open(path, "r") as f:
+                code = f.read()
+            times = {}
+            streams = {}
+            for mode in LEXERS:
+                times[mode], tokens = lex_time(mode, code)
+                streams[mode] = [(t.tag, t.line, t.pos, t.value) for t in tokens]
+                print(f"{size:>6}{len(tokens):>10}{mode:>8}{times[mode]:>10.3f}{len(code) / times[mode] / 2 ** 20:>8.2f}")
+            assert streams["master"] == streams["rules"], "token streams differ"
+            print(f"{'':>6}master lexes {times['rules'] / times['master']:.2f}x faster, identical tokens")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compares executed instructions with and without loop invariant code motion on calculator-style loops"""
+from common import *
+
+
+def calculator_loop(n: int) -> str:
+    """The calculator reading its operands once, then applying them over and over in tight loops"""
+    return f"""
+a = tonumber(read())
+b = tonumber(read())
+op = read()
+
+i = 0
+acc = 0
+while i < {n} do
+    if op == "+" then
+        acc = acc + (a + b) * 2
+    else
+        if op == "*" then
+            acc = acc + a * b - (a - b) * 3
+        end
+    end
+    j = 0
+    while j < a do
+        acc = acc + a * a + b * b + tonumber(a + b)
+        j = j + 1
+    end
+    i = i + 1
+end
+print("result: " + tostring(acc) + " for " + tostring(a) + " " + op + " " + tostring(b))
+"""
+
+
+def scaled_loop(n: int) -> str:
+    """A limit recomputed by the loop condition on every test"""
+    return f"""
+n = tonumber(read())
+i = 0
+total = 0
+while i < n * {n} do
+    total = total + i * n
+    i = i + 1
+end
+print(total)
+"""
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("calc 5k", calculator_loop(5000), "4\n3\n+\n"),
+        ("scaled 20k", scaled_loop(20000), "1\n"),
+    ]
+    without = ("fold", "lvn", "copies")
+    hoisted = ("fold", "lvn", "licm", "copies")
+    print(f"{'program':<16}{'backend':<10}{'instr':>10}{'licm':>10}{'ratio':>8}{'time':>8}{'licm':>8}")
+    for name, source, stdin in programs:
+        for backend in ["stack", "register"]:
+            results = []
+            for passes in [without, hoisted]:
+                module = compile_source(source, backend=backend, passes=passes)
+                results.append(best_of(3, lambda: run_binary(module, stdin, stats=True)))
+            (out, vm, elapsed), (licm_out, licm_vm, licm_elapsed) = results
+            if out != licm_out:
+                raise AssertionError(f"{name}: invariant code motion changed the output\n{out!r}\n{licm_out!r}")
+            ratio = vm.dispatched / max(licm_vm.dispatched, 1)
+            print(f"{name:<16}{backend:<10}{vm.dispatched:>10}{licm_vm.dispatched:>10}{ratio:>7.2f}x"
+                  f"{elapsed:>8.3f}{licm_elapsed:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares startup of a large module read into memory and decoded up front
+with one mapped from disk whose function bodies are decoded on first call
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import *
+
+
+def library(functions: int, body: int) -> str:
+    """Declares many functions, only the first few of which are ever called"""
+    lines = []
+    for f in range(functions):
+        lines.append(f"function f{f}(a, b)")
+        lines.append("    x = a")
+        for i in range(body):
+            lines.append(f"    x = x + b * {i} - {f}")
+        lines.append("    return x")
+        lines.append("end")
+    lines.append("s = 0")
+    for f in range(3):
+        lines.append(f"s = s + f{f}(1, 2)")
+    lines.append("print(s)")
+    return "\n".join(lines) + "\n"
+
+
+CHILD = """
+import mmap, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+from vm import VM
+with open(sys.argv[2], "rb") as f:
+    if sys.argv[3] == "lazy":
+        module = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        module = bytearray(f.read())
+vm = VM(lazy=sys.argv[3] == "lazy")
+vm.init(module)
+ready = time.perf_counter() - start
+vm.run()
+total = time.perf_counter() - start
+# ru_maxrss survives fork from the parent, the high-water mark of this address space does not
+with open("/proc/self/status") as f:
+    rss = next(line.split()[1] for line in f if line.startswith("VmHWM"))
+print(ready, total, rss, file=sys.stderr)
+"""
+
+
+def measure(path: str, mode: str):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", CHILD, root, path, mode],
+                            capture_output=True, text=True, check=True)
+    ready, total, rss = result.stderr.split()
+    return float(ready), float(total), int(rss)
+
+
+def main():
+    print(f"{'functions':>10}{'instr':>10}{'bytes':>10}{'mode':>7}{'ready s':>10}{'total s':>10}{'peak RSS KB':>13}")
+    for functions in [200, 1000, 2000]:
+        module = compile_source(library(functions, 20))
+        instructions = binary.read_header(memoryview(module))[2]
+        with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+            f.write(module)
+            path = f.name
+        try:
+            results = {}
+            for mode in ["eager", "lazy"]:
+                results[mode] = min(measure(path, mode) for _ in range(3))
+                ready, total, rss = results[mode]
+                print(f"{functions:>10}{instructions:>10}{len(module):>10}{mode:>7}{ready:>10.4f}{total:>10.4f}{rss:>13}")
+            print(f"{'':>10}lazy starts {results['eager'][0] / results['lazy'][0]:.2f}x faster, "
+                  f"peak RSS {results['eager'][2] - results['lazy'][2]} KB lower")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Counts the opcode sequences the stack machine dispatches while running a corpus of scripts,
+the profile the superinstructions of the compiler are picked from.
+Runs the given scripts, or the test scripts and the loops of the benchmarks without any
+"""
+import argparse
+from collections import Counter
+from typing import Dict, Tuple
+
+from common import *
+from licm import calculator_loop, scaled_loop
+from tailcalls import countdown
+from tiers import nested_loop
+
+
+def corpus():
+    programs = list(test_programs())
+    programs += [
+        ("loop 5k", counting_loop(5000), ""),
+        ("calls 5k", call_loop(5000), ""),
+        ("calc 1k", calculator_loop(1000), "4\n3\n+\n"),
+        ("scaled 5k", scaled_loop(5000), "1\n"),
+        ("nested 100", nested_loop(100), ""),
+        ("countdown 5k", countdown(5000), ""),
+    ]
+    return programs
+
+
+def mnemonic(line) -> str:
+    return str(line).split()[1]
+
+
+def ngrams(module: bytearray, stdin: str = "", longest: int = 5) -> Tuple[Dict[int, Counter], int]:
+    """
+    Counts, for every length from 2 to longest, the sequences executed one after another at
+    consecutive addresses, the only ones a superinstruction can stand for.
+    Returns the counts by length and the number of instructions dispatched
+    """
+    vm = VM(lazy=False, hot=0)
+    vm.init(module)
+    code = vm._build_table()
+    end = len(code)
+    trace = []
+    old_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
+    try:
+        with redirect_stdout(io.StringIO()):
+            pc = 0
+            while pc < end:
+                trace.append(pc)
+                pc = code[pc]()
+    finally:
+        sys.stdin = old_stdin
+    # counted by address first, every address has one instruction
+    starts = Counter()
+    run = 1
+    for i in range(len(trace) - 1, -1, -1):
+        # the instructions from trace[i] on that fall through to one another, up to longest
+        run = min(run + 1, longest) if i + 1 < len(trace) and trace[i + 1] == trace[i] + 1 else 1
+        for n in range(2, run + 1):
+            starts[trace[i], n] += 1
+    counts = {n: Counter() for n in range(2, longest + 1)}
+    for (start, n), count in starts.items():
+        counts[n][tuple(mnemonic(vm.bytecode[pc]) for pc in range(start, start + n))] += count
+    return counts, len(trace)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", help="scripts to run instead of the default corpus")
+    parser.add_argument("--top", type=int, default=8, help="sequences shown for every length")
+    parser.add_argument("--longest", type=int, default=5, help="longest sequence counted")
+    parser.add_argument("--no-super", dest="superinstructions", action="store_false",
+                        help="profile code compiled without superinstructions")
+    args = parser.parse_args()
+    programs = corpus()
+    if args.files:
+        programs = []
+        for path in args.files:
+            with open(path) as f:
+                programs.append((path, f.read(), ""))
+
+    totals = {n: Counter() for n in range(2, args.longest + 1)}
+    dispatched = 0
+    for name, source, stdin in programs:
+        module = compile_source(source, superinstructions=args.superinstructions)
+        counts, count = ngrams(module, stdin, args.longest)
+        dispatched += count
+        for n, sequences in counts.items():
+            totals[n].update(sequences)
+
+    print(f"{len(programs)} programs, {dispatched} instructions dispatched")
+    for n, sequences in totals.items():
+        print()
+        print(f"{'length ' + str(n):<10}{'count':>10}{'dispatch %':>12}  sequence")
+        for sequence, count in sequences.most_common(args.top):
+            print(f"{'':<10}{count:>10}{100 * count * n / dispatched:>11.1f}%  {'; '.join(sequence)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares executed instructions with and without local value numbering on arithmetic-heavy scripts,
+and times the pass on long straight-line programs, where it should grow linearly
+"""
+import time
+
+from common import *
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+from compiler.src.numbering import number_values
+
+
+def arithmetic_loop(n: int) -> str:
+    """Distance-like formulas that repeat their subexpressions, as hand-written numeric code does"""
+    return f"""
+function norm(x, y)
+    return x * x + y * y + x * y * 2 - x * x * y * y / (x * x + y * y + 1)
+end
+
+i = 0
+acc = 0
+while i < {n} do
+    a = i % 7
+    b = i % 5
+    d = (a - b) * (a - b) + (a + b) * (a + b)
+    if a * b > 6 then
+        if a * b > 12 then
+            acc = acc + d
+        end
+    end
+    acc = acc + norm(a, b) - (a - b) * (a - b)
+    i = i + 1
+end
+print(acc)
+"""
+
+
+def pass_time(n: int):
+    """Instructions of a straight_line(n) program and seconds number_values takes on them"""
+    lexer = Lexer()
+    lexer.init(straight_line(n))
+    code = Parser(lexer.buffers()).parse().codegen()
+    start = time.perf_counter()
+    number_values(code)
+    return len(code), time.perf_counter() - start
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("arith 10k", arithmetic_loop(10000), ""),
+    ]
+    without = ("fold", "copies")
+    numbered = ("fold", "lvn", "copies")
+    print(f"{'program':<16}{'backend':<10}{'instr':>10}{'lvn':>10}{'ratio':>8}{'time':>8}{'lvn':>8}")
+    for name, source, stdin in programs:
+        for backend in ["stack", "register"]:
+            results = []
+            for passes in [without, numbered]:
+                module = compile_source(source, backend=backend, passes=passes)
+                results.append(best_of(3, lambda: run_binary(module, stdin, stats=True)))
+            (out, vm, elapsed), (lvn_out, lvn_vm, lvn_elapsed) = results
+            if out != lvn_out:
+                raise AssertionError(f"{name}: value numbering changed the output\n{out!r}\n{lvn_out!r}")
+            ratio = vm.dispatched / max(lvn_vm.dispatched, 1)
+            print(f"{name:<16}{backend:<10}{vm.dispatched:>10}{lvn_vm.dispatched:>10}{ratio:>7.2f}x"
+                  f"{elapsed:>8.3f}{lvn_elapsed:>8.3f}")
+
+    print(f"\n{'statements':>11}{'instr':>10}{'lvn s':>8}{'us/instr':>10}")
+    for n in [2000, 8000, 32000]:
+        size, seconds = pass_time(n)
+        print(f"{n:>11}{size:>10}{seconds:>8.3f}{seconds / size * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
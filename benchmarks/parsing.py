@@ -0,0 +1,56 @@
+"""Compares AST size and parse time of the descent and pratt expression parsers"""
+import random
+
+from common import *
+from tokens import best_time
+from lexing import lua_source
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser, PARSERS
+
+
+def expressions(n: int, seed: int = 1) -> str:
+    """n assignments of random expressions mixing every operator level"""
+    rng = random.Random(seed)
+    ops = ["or", "and", "==", "~=", "<", "<=", ">", ">=", "+", "-", "*", "/", "%"]
+
+    def expr(depth: int) -> str:
+        if depth == 0 or rng.random() < 0.3:
+            leaf = rng.choice([f"x{rng.randrange(20)}", str(rng.randrange(100)), "2.5", '"s"', "nil", "true"])
+            return rng.choice(["", "", "", "-", "not "]) + leaf
+        if rng.random() < 0.2:
+            return f"({expr(depth - 1)})"
+        return f"{expr(depth - 1)} {rng.choice(ops)} {expr(depth - 1)}"
+
+    return "\n".join(f"x{i % 20} = {expr(4)}" for i in range(n)) + "\n"
+
+
+def count_nodes(node) -> int:
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        children = node.children()
+        stack.extend(child for child in children if child is not None)
+    return count
+
+
+def main():
+    inputs = [("expressions 20k", expressions(20000)), ("generated 1MB", lua_source(2 ** 20))]
+    print(f"{'input':>16}{'parser':>9}{'nodes':>10}{'parse s':>9}")
+    for name, source in inputs:
+        lexer = Lexer()
+        lexer.init(source)
+        buffers = list(lexer.buffers())
+        results = {}
+        for mode in PARSERS:
+            nodes = count_nodes(Parser(buffers, mode).parse())
+            seconds = best_time(lambda: Parser(buffers, mode).parse())
+            results[mode] = (nodes, seconds)
+            print(f"{name:>16}{mode:>9}{nodes:>10}{seconds:>9.3f}")
+        print(f"{'':>16}pratt: {results['descent'][0] / results['pratt'][0]:.2f}x fewer nodes, "
+              f"{results['descent'][1] / results['pratt'][1]:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Checks which calls and/or skip, then compares guard-heavy loops against eagerly evaluated operands"""
+from common import *
+
+
+SKIPPED_CALLS = """
+function noisy(name, value)
+    print(name)
+    return value
+end
+
+print(noisy("a", 1) or noisy("b", 2))
+print(noisy("c", nil) or noisy("d", 0) or noisy("e", 3))
+print(noisy("f", false) and noisy("g", 4))
+print(noisy("h", 1) and noisy("i", 0) and noisy("j", 5))
+print(noisy("k", 1 > 2) or noisy("l", 2 > 1) and noisy("m", 6))
+"""
+
+# or/and keep the truthiness they always had: 0 is false for them
+EXPECTED = "a 1 c d e 3 f False h i 0 k l m 6".split()
+
+
+def guard_loop(n: int, eager: bool) -> str:
+    """
+    Guards on cheap comparisons in front of a function call. The eager variant evaluates
+    every operand first, which is what or/and compiled to before they short circuited
+    """
+    if eager:
+        guard = """
+    a = i % 10 ~= 0
+    b = expensive(i)
+    c = i < 0
+    d = expensive(i + 1)
+    if (a or b) and (c or d) then
+        hits = hits + 1
+    end"""
+    else:
+        guard = """
+    if (i % 10 ~= 0 or expensive(i)) and (i < 0 or expensive(i + 1)) then
+        hits = hits + 1
+    end"""
+    return f"""
+function expensive(x)
+    y = x * 3 + 1
+    y = y % 7
+    return y > 2
+end
+
+i = 0
+hits = 0
+while i < {n} do{guard}
+    i = i + 1
+end
+print(hits)
+"""
+
+
+def main():
+    out, _, _ = run_binary(compile_source(SKIPPED_CALLS))
+    if out.split() != EXPECTED:
+        raise AssertionError(f"unexpected calls\n{out.split()}\n{EXPECTED}")
+    print("skipped calls: ok")
+
+    print(f"{'program':<16}{'backend':<10}{'eager':>10}{'short':>10}{'ratio':>8}{'eager s':>10}{'short s':>10}")
+    for n in [10000, 50000]:
+        for backend in ["stack", "register"]:
+            results = []
+            for eager in [True, False]:
+                module = compile_source(guard_loop(n, eager), backend=backend)
+                results.append(best_of(3, lambda: run_binary(module, stats=True)))
+            (eager_out, eager_vm, eager_time), (out, vm, elapsed) = results
+            if eager_out != out:
+                raise AssertionError(f"guard {n}: results differ\n{eager_out!r}\n{out!r}")
+            ratio = eager_vm.dispatched / max(vm.dispatched, 1)
+            print(f"{f'guard {n}':<16}{backend:<10}{eager_vm.dispatched:>10}{vm.dispatched:>10}{ratio:>7.2f}x"
+                  f"{eager_time:>10.4f}{elapsed:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
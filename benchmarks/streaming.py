@@ -0,0 +1,64 @@
+"""
+Compares peak memory of parsing a source read whole with parsing
+tokens streamed from a file read in chunks.
+Usage: streaming.py [MB ...]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from lexing import lua_source
+
+
+CHILD = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+start = time.perf_counter()
+lexer = Lexer()
+with open(sys.argv[2], "r") as f:
+    if sys.argv[3] == "stream":
+        lexer.init_file(f)
+        parser = Parser(lexer.buffers())
+    else:
+        lexer.init(f.read())
+        parser = Parser(lexer.buffers())
+    tree = parser.parse()
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    rss = next(line.split()[1] for line in f if line.startswith("VmHWM"))
+print(elapsed, rss, file=sys.stderr)
+"""
+
+
+def measure(path: str, mode: str):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", CHILD, root, path, mode],
+                            capture_output=True, text=True, check=True)
+    elapsed, rss = result.stderr.split()
+    return float(elapsed), int(rss)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [4, 16]
+    print(f"{'MB':>6}{'mode':>8}{'seconds':>10}{'peak RSS MB':>13}")
+    for size in sizes:
+        with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+            f.write(lua_source(size * 2 ** 20))
+            path = f.name
+        try:
+            results = {}
+            for mode in ["whole", "stream"]:
+                results[mode] = measure(path, mode)
+                elapsed, rss = results[mode]
+                print(f"{size:>6}{mode:>8}{elapsed:>10.2f}{rss / 1024:>13.1f}")
+            saved = (results["whole"][1] - results["stream"][1]) / 1024
+            print(f"{'':>6}streaming saves {saved:.1f} MB, {saved / size:.1f} MB per source MB")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
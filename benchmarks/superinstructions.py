@@ -0,0 +1,39 @@
+"""Compares instructions dispatched and run time of stack machine code compiled with and without superinstructions"""
+from common import *
+from ngrams import corpus
+
+
+def main():
+    programs = corpus()
+    programs += [
+        ("loop 60k", counting_loop(60000), ""),
+        ("calls 50k", call_loop(50000), ""),
+    ]
+    print(f"{'program':<16}{'engine':<8}{'instr':>10}{'fused':>10}{'ratio':>7}{'time':>8}{'fused':>8}{'speedup':>9}")
+    totals = {engine: [0, 0, 0.0, 0.0] for engine in VM.ENGINES}
+    for name, source, stdin in programs:
+        plain = compile_source(source, superinstructions=False)
+        fused = compile_source(source)
+        for engine in VM.ENGINES:
+            out, _, elapsed = best_of(3, lambda: run_binary(plain, stdin, engine=engine))
+            fused_out, _, fused_elapsed = best_of(3, lambda: run_binary(fused, stdin, engine=engine))
+            if out != fused_out:
+                raise AssertionError(f"{name}: superinstructions changed the output\n{out!r}\n{fused_out!r}")
+            dispatched = count_dispatched(plain, stdin, engine=engine)
+            fused_dispatched = count_dispatched(fused, stdin, engine=engine)
+            total = totals[engine]
+            total[0] += dispatched
+            total[1] += fused_dispatched
+            total[2] += elapsed
+            total[3] += fused_elapsed
+            print(f"{name:<16}{engine:<8}{dispatched:>10}{fused_dispatched:>10}"
+                  f"{dispatched / fused_dispatched:>6.2f}x{elapsed:>8.3f}{fused_elapsed:>8.3f}"
+                  f"{elapsed / fused_elapsed:>8.2f}x")
+    for engine, (dispatched, fused_dispatched, elapsed, fused_elapsed) in totals.items():
+        print(f"{'all':<16}{engine:<8}{dispatched:>10}{fused_dispatched:>10}"
+              f"{dispatched / fused_dispatched:>6.2f}x{elapsed:>8.3f}{fused_elapsed:>8.3f}"
+              f"{elapsed / fused_elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
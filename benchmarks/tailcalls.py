@@ -0,0 +1,77 @@
+"""Compares deep recursion through return f(...) with and without tail calls: frames, peak memory and time"""
+import tracemalloc
+
+from common import *
+from compiler.src.IR import AssignmentInstruction, CallInstruction
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+from compiler.src.optimize import optimize
+from compiler.src.bytecode import tac2bytecode, bytecode2binary
+from compiler.src.regcode import tac2regcode
+
+
+def countdown(n: int) -> str:
+    """A loop written as recursion, every call is the last thing its caller does"""
+    return f"""
+function count(n, acc)
+    if n == 0 then
+        return acc
+    end
+    return count(n - 1, acc + n)
+end
+
+print(count({n}, 0))
+"""
+
+
+def build(source: str, backend: str, tail: bool) -> bytearray:
+    lexer = Lexer()
+    lexer.init(source)
+    tac = optimize(Parser(lexer.buffers()).parse().codegen())
+    if not tail:
+        for ins in tac:
+            if type(ins) == AssignmentInstruction and type(ins.rhs) == CallInstruction:
+                ins.rhs.tail = False
+    if backend == "register":
+        return tac2regcode(tac).to_binary()
+    return bytecode2binary(tac2bytecode(tac))
+
+
+def measure(module: bytearray):
+    """Returns (output, seconds, peak traced bytes while running), or the error when the run fails"""
+    tracemalloc.start()
+    try:
+        out, vm, elapsed = run_binary(module)
+    except Exception as e:
+        return str(e), None, None
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    _, _, elapsed = best_of(3, lambda: run_binary(module))
+    return out, elapsed, peak
+
+
+def main():
+    print(f"{'depth':>9}{'backend':>10}{'calls s':>10}{'peak KB':>10}{'tail s':>10}{'peak KB':>10}")
+    for n in [900, 10000, 100000, 1000000]:
+        for backend in ["stack", "register"]:
+            row = []
+            for tail in [False, True]:
+                out, elapsed, peak = measure(build(countdown(n), backend, tail))
+                if elapsed is None:
+                    row.append((out, None, None))
+                    continue
+                if out != f"{n * (n + 1) // 2}\n":
+                    raise AssertionError(f"count({n}) printed {out!r}")
+                row.append((out, elapsed, peak))
+            cells = []
+            for out, elapsed, peak in row:
+                if elapsed is None:
+                    cells.append(f"{out[:18]:>20}")
+                else:
+                    cells.append(f"{elapsed:>10.3f}{peak / 1024:>10.0f}")
+            print(f"{n:>9}{backend:>10}" + "".join(cells))
+
+
+if __name__ == "__main__":
+    main()
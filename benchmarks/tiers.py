@@ -0,0 +1,52 @@
+"""Compares the table engine with and without compiling hot loops into closures, and splits run time by tier"""
+from common import *
+from licm import calculator_loop, scaled_loop
+from vm import HOT_LOOP
+
+
+def nested_loop(n: int) -> str:
+    """An inner loop entered again on every outer iteration, reading a slot that turns from number to string"""
+    return f"""
+i = 0
+total = 0
+scale = 1
+while i < {n} do
+    j = 0
+    while j < 50 do
+        total = total + i * j % 7 * scale
+        j = j + 1
+    end
+    if i == {n // 20} then
+        scale = "3"
+    end
+    i = i + 1
+end
+print(total)
+"""
+
+
+def main():
+    programs = list(test_programs())
+    programs += [
+        ("loop 20k", counting_loop(20000), ""),
+        ("calls 20k", call_loop(20000), ""),
+        ("calc 5k", calculator_loop(5000), "4\n3\n+\n"),
+        ("scaled 20k", scaled_loop(20000), "1\n"),
+        ("nested 1k", nested_loop(1000), ""),
+    ]
+    print(f"{'program':<16}{'instr':>10}{'tiered':>10}{'time':>8}{'tiered':>8}{'speedup':>9}"
+          f"{'loops':>7}{'again':>7}{'left':>6}{'interp s':>10}{'closure s':>10}{'compile s':>10}")
+    for name, source, stdin in programs:
+        module = compile_source(source)
+        out, vm, elapsed = best_of(3, lambda: run_binary(module, stdin, stats=True, hot=0))
+        hot_out, hot_vm, hot_elapsed = best_of(3, lambda: run_binary(module, stdin, stats=True, hot=HOT_LOOP))
+        if out != hot_out:
+            raise AssertionError(f"{name}: compiled loops changed the output\n{out!r}\n{hot_out!r}")
+        interpreted = hot_elapsed - hot_vm.compiled_time - hot_vm.compile_time
+        print(f"{name:<16}{vm.dispatched:>10}{hot_vm.dispatched:>10}{elapsed:>8.3f}{hot_elapsed:>8.3f}"
+              f"{elapsed / hot_elapsed:>8.1f}x{hot_vm.promoted:>7}{hot_vm.recompiled:>7}{hot_vm.rejected:>6}"
+              f"{interpreted:>10.4f}{hot_vm.compiled_time:>10.4f}{hot_vm.compile_time:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compares memory per token of Token objects and TokenBuffers, and times parsing from buffers"""
+import gc
+import time
+import tracemalloc
+
+from common import *
+from lexing import lua_source
+from compiler.src.lexer import Lexer
+from compiler.src.parser import Parser
+
+
+def allocated(build):
+    """Returns the result of build() and the bytes it still holds"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def best_time(run, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    print(f"{'MB':>6}{'tokens':>10}{'objects B/tok':>15}{'buffer B/tok':>14}{'lex s':>8}{'parse s':>9}")
+    for size in [1, 4]:
+        lexer = Lexer()
+        lexer.init(lua_source(size * 2 ** 20))
+        tokens, objects = allocated(lexer.lex)
+        buffers, packed = allocated(lambda: list(lexer.buffers()))
+        count = len(tokens)
+        assert count == sum(map(len, buffers)) - 1, "token counts differ"
+        del tokens
+        lex = best_time(lambda: list(lexer.buffers()))
+        parse = best_time(lambda: Parser(buffers).parse())
+        print(f"{size:>6}{count:>10}{objects / count:>15.1f}{packed / count:>14.1f}{lex:>8.3f}{parse:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
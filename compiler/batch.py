@@ -0,0 +1,127 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from typing import List, Tuple
+
+from .compiler import compile, BACKENDS
+
+
+def _glob_root(pattern: str) -> str:
+    """Leading directories of pattern without wildcards"""
+    parts = pattern.split(os.sep)
+    fixed = []
+    for part in parts[:-1]:
+        if any(c in part for c in "*?["):
+            break
+        fixed.append(part)
+    return os.sep.join(fixed) or "."
+
+
+def collect(inputs: List[str], pattern: str = "*.lua") -> List[Tuple[str, str]]:
+    """
+    Expands directories (recursively, files matching pattern) and globs into
+    (source path, path relative to the directory or glob root) pairs
+    """
+    files = []
+    for spec in inputs:
+        if os.path.isdir(spec):
+            paths = glob.glob(os.path.join(spec, "**", pattern), recursive=True)
+            root = spec
+        else:
+            paths = glob.glob(spec, recursive=True)
+            root = _glob_root(spec)
+        files.extend((path, os.path.relpath(path, root)) for path in sorted(paths) if os.path.isfile(path))
+    return files
+
+
+def compile_one(job: Tuple[str, str, str, str]) -> dict:
+    """Compiles one file in a worker process, errors are returned instead of raised"""
+    source, binary, backend, root = job
+    entry = {"source": source, "binary": os.path.relpath(binary, root)}
+    start = time.perf_counter()
+    try:
+        with open(source, "rb") as f:
+            entry["lines"] = f.read().count(b"\n")
+        module = compile(source, backend=backend)
+        os.makedirs(os.path.dirname(binary), exist_ok=True)
+        with open(binary, "wb") as f:
+            f.write(module)
+        entry["bytes"] = len(module)
+        entry["sha256"] = sha256(module).hexdigest()
+    except Exception as e:
+        entry["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+        entry["binary"] = None
+    entry["seconds"] = time.perf_counter() - start
+    return entry
+
+
+def _jobs(files: List[Tuple[str, str]], output: str, backend: str) -> List[Tuple[str, str, str, str]]:
+    """
+    One job per source file. A file listed more than once is compiled once, two different
+    files that would be written to the same binary fail the whole batch before anything runs
+    """
+    jobs = []
+    sources = {}
+    for source, rel in files:
+        binary = os.path.join(output, os.path.splitext(rel)[0] + ".bin")
+        key = os.path.normcase(os.path.abspath(binary))
+        if key in sources:
+            if os.path.realpath(sources[key]) != os.path.realpath(source):
+                raise ValueError(f"{sources[key]} and {source} would both be compiled to {binary}")
+            continue
+        sources[key] = source
+        jobs.append((source, binary, backend, output))
+    return jobs
+
+
+def compile_batch(inputs: List[str], output: str, backend: str = "stack", workers: int = None) -> dict:
+    """Compiles every input file across a process pool and writes output/manifest.json"""
+    jobs = _jobs(collect(inputs), output, backend)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        entries = list(pool.map(compile_one, jobs))
+    elapsed = time.perf_counter() - start
+    manifest = {
+        "backend": backend,
+        "seconds": elapsed,
+        "files": entries,
+    }
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compile every script in directories or globs in parallel")
+    parser.add_argument("inputs", nargs="+", help="directories (searched for *.lua) or glob patterns")
+    parser.add_argument("-o", dest="output", default="output/batch", help="directory for binaries and manifest.json")
+    parser.add_argument("-j", dest="workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    parser.add_argument("--backend", choices=BACKENDS, default="stack", help="target virtual machine")
+    args = parser.parse_args()
+    try:
+        manifest = compile_batch(args.inputs, args.output, backend=args.backend, workers=args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    files = manifest["files"]
+    failed = [entry for entry in files if "error" in entry]
+    for entry in failed:
+        print(f"{entry['source']}: {entry['error']}", file=sys.stderr)
+    lines = sum(entry.get("lines", 0) for entry in files)
+    elapsed = max(manifest["seconds"], 1e-9)
+    print(f"{len(files) - len(failed)}/{len(files)} files compiled in {elapsed:.2f}s "
+          f"({len(files) / elapsed:.1f} files/s, {lines / elapsed:.0f} lines/s)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
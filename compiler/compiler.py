@@ -1,30 +1,77 @@
-from numpy import source
-from .src.lexer import Lexer
-from .src.parser import Parser
+import argparse
+
+from typing import Iterable, Tuple
+
+from .src.lexer import Lexer, LEXERS
+from .src.parser import Parser, PARSERS
 from .src.graph_utils import node2Graphviz, buildCFG, basicBlock2Graphviz
 from .src.bytecode import tac2bytecode, bytecode2binary
+from .src.regcode import tac2regcode
+from .src.pycode import tac2python
+from .src.cache import CompileCache
+from .src.optimize import optimize, PASSES
+
 
+BACKENDS = ["stack", "register", "python"]
 
 
-def compile(file: str) -> bytearray:
-    lexer = Lexer()
-    code = ""
+def compile(file: str, backend: str = "stack", lexer: str = "master", parser: str = "pratt",
+            cache: CompileCache = None, passes: Iterable[str] = tuple(PASSES),
+            superinstructions: bool = True) -> bytearray:
+    """
+    With a cache, an unchanged source compiled by the same compiler is returned without running the front end.
+    passes names the TAC optimisations to run, see optimize.PASSES.
+    superinstructions fuses the most frequent stack machine sequences into single instructions
+    """
+    passes = tuple(name for name in PASSES if name in passes)
+    if cache is not None:
+        key = cache.key(file, backend=backend, lexer=lexer, parser=parser, passes=passes,
+                        superinstructions=superinstructions)
+        module = cache.get(key)
+        if module is not None:
+            return module
+        module = compile(file, backend=backend, lexer=lexer, parser=parser, passes=passes,
+                         superinstructions=superinstructions)
+        cache.put(key, module)
+        return module
+    lexer = Lexer(lexer)
     with open(file, "r") as f:
-        code = f.read()
-    lexer.init(code)
-    parser = Parser(lexer.lex())
-    tree = parser.parse()
-    tac = tree.codegen()
-    bytecode = tac2bytecode(tac)
+        lexer.init_file(f)
+        parser = Parser(lexer.buffers(), parser)
+        tree = parser.parse()
+    tac = optimize(tree.codegen(), passes)
+    if backend == "register":
+        return tac2regcode(tac).to_binary()
+    elif backend == "python":
+        return bytearray(tac2python(tac).encode())
+    elif backend != "stack":
+        raise ValueError(f"Unknown backend: {backend}")
+    bytecode = tac2bytecode(tac, superinstructions=superinstructions)
     binary = bytecode2binary(bytecode)
     return binary
 
 
+def enabled_passes(disabled: Iterable[str]) -> Tuple[str, ...]:
+    if "all" in disabled:
+        return ()
+    return tuple(name for name in PASSES if name not in disabled)
+
+
 def main():
-    file = "data/tests/test1.txt"
-    result = "output/binary"
-    binary = compile(file)
-    with open(result, "wb") as f:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", nargs="?", default="data/tests/test1.txt")
+    parser.add_argument("-o", dest="result", default="output/binary", help="output binary")
+    parser.add_argument("--backend", choices=BACKENDS, default="stack", help="target virtual machine")
+    parser.add_argument("--lexer", choices=LEXERS, default="master", help="tokenizer implementation")
+    parser.add_argument("--parser", choices=PARSERS, default="pratt", help="expression parsing strategy")
+    parser.add_argument("--no-opt", dest="disabled", action="append", default=[], choices=list(PASSES) + ["all"],
+                        help="skip an optimisation pass, repeatable")
+    parser.add_argument("--no-super", dest="superinstructions", action="store_false",
+                        help="emit stack machine code without superinstructions")
+    args = parser.parse_args()
+    binary = compile(args.file, backend=args.backend, lexer=args.lexer, parser=args.parser,
+                     passes=enabled_passes(args.disabled), superinstructions=args.superinstructions)
+    with open(args.result, "wb") as f:
         f.write(binary)
    
 
@@ -1,7 +1,6 @@
 from sys import prefix
 from typing import Union
 from typing import List
-from copy import deepcopy
 
 
 
@@ -85,18 +84,20 @@ class ParameterInstruction(Instruction):
 
 
 class CallInstruction(Instruction, IRValue):
-    def __init__(self, name: str, argc: int = 0, target: Instruction = None) -> None:
+    def __init__(self, name: str, argc: int = 0, target: Instruction = None, tail: bool = False) -> None:
         super().__init__()
         self.name = name
         self.argc = argc
         self.target = target
+        self.tail = tail
         
 
     def __str__(self) -> str:
         prefix = f"{self.id}: " if self.id >=0 else ""
+        call = "tail call" if self.tail else "call"
         if self.target:
-            return f"{prefix}call {self.name} {self.argc} {self.target.id}"
-        return f"{prefix}call {self.name} {self.argc}"
+            return f"{prefix}{call} {self.name} {self.argc} {self.target.id}"
+        return f"{prefix}{call} {self.name} {self.argc}"
 
 
 class IfGotoInstruction(Instruction):
@@ -116,6 +117,16 @@ class EndInstruction(Instruction):
     def __str__(self) -> str:
         return f"{self.id}: end"
 
+class FunctionInstruction(Instruction):
+    def __init__(self, name: str, args: List[str], end: Instruction = None) -> None:
+        super().__init__()
+        self.name = name
+        self.args = args
+        self.end = end
+
+    def __str__(self) -> str:
+        return f"{self.id}: function {self.name}({', '.join(self.args)})"
+
 class BlankInstruction(Instruction):
     def __init__(self) -> None:
         super().__init__()
@@ -127,32 +138,71 @@ def enumerate_instructions(code: List[Instruction]) -> None:
     for i, instruction in enumerate(code):
         instruction.id = i
 
+def retarget(code: List[Instruction]) -> None:
+    """Points jumps, calls and function ends at the instructions that now hold their ids"""
+    for ins in code:
+        t = type(ins)
+        if t in [GotoInstruction, IfGotoInstruction, CallInstruction] and ins.target:
+            ins.target = code[ins.target.id]
+        elif t == AssignmentInstruction and type(ins.rhs) == CallInstruction and ins.rhs.target:
+            ins.rhs.target = code[ins.rhs.target.id]
+        elif t == FunctionInstruction:
+            ins.end = code[ins.end.id]
+
+
 def remove_blanks(code: List[Instruction]) -> List[Instruction]:
-    mapping = dict()
-    code = deepcopy(code)
-    for instruction in code:
-        if type(instruction) == BlankInstruction:
-            old_id = instruction.id
-            new_id = old_id
-            while type(code[new_id]) == BlankInstruction:
-                new_id += 1
-            mapping[old_id] = new_id
+    """
+    Drops every BlankInstruction and points jumps, calls and function ends that target one
+    at the next instruction that is not blank. Expects enumerated code, the instructions
+    are reused, returns the filtered list enumerated again
+    """
+    # one backward pass finds the first real instruction at or after every position
+    resolved = [None] * len(code)
+    following = None
+    for i in range(len(code) - 1, -1, -1):
+        if type(code[i]) != BlankInstruction:
+            following = code[i]
+        resolved[i] = following
 
     for instruction in code:
         t = type(instruction)
-    
         if t in [GotoInstruction, IfGotoInstruction, CallInstruction] and instruction.target:
-            old_id = instruction.target.id
-            if old_id in mapping:
-                instruction.target = code[mapping[old_id]]
+            instruction.target = resolved[instruction.target.id]
         elif t == AssignmentInstruction and type(instruction.rhs) == CallInstruction and instruction.rhs.target:
-            old_id = instruction.rhs.target.id
-            if old_id in mapping:
-                instruction.rhs.target = code[mapping[old_id]]
+            instruction.rhs.target = resolved[instruction.rhs.target.id]
+        elif t == FunctionInstruction:
+            instruction.end = resolved[instruction.end.id]
 
-
-    code = list(filter(lambda i: type(i) != BlankInstruction, code))
-    
+    code = [instruction for instruction in code if type(instruction) != BlankInstruction]
     enumerate_instructions(code)
     return code
-    
\ No newline at end of file
+
+
+def is_tail_call(code: List[Instruction], ins: Instruction) -> bool:
+    """
+    True when ins assigns the result of a user call marked as a tail call and the next
+    instruction returns it, so the callee can take over the frame. Expects enumerated code
+    """
+    if type(ins) != AssignmentInstruction or type(ins.rhs) != CallInstruction:
+        return False
+    rhs = ins.rhs
+    if not rhs.tail or rhs.target is None or ins.id + 1 >= len(code):
+        return False
+    ret = code[ins.id + 1]
+    return type(ret) == ReturnInstruction and ret.value.value == ins.lhs
+
+
+def function_owners(code: List[Instruction]) -> List[int]:
+    """
+    For every instruction returns the id of the FunctionInstruction whose body
+    contains it, or -1 for the top level. Expects enumerated code
+    """
+    owners = []
+    scopes = []
+    for instruction in code:
+        while scopes and scopes[-1].end.id == instruction.id:
+            scopes.pop()
+        if type(instruction) == FunctionInstruction:
+            scopes.append(instruction)
+        owners.append(scopes[-1].id if scopes else -1)
+    return owners
@@ -133,6 +133,10 @@ class UnaryExpr(Expr):
     def codegen(self, context: CodegenContext) -> List[Instruction]:
         pass
 
+class BinaryExpr(Expr):
+    def codegen(self, context: CodegenContext) -> List[Instruction]:
+        pass
+
 class ValueExpr(Expr): 
     def codegen(self, context: CodegenContext) -> List[Instruction]:
         pass
@@ -158,15 +162,9 @@ class OrExpr(Expr):
         return "OrExpr"
     
     def codegen(self, context: CodegenContext) -> List[Instruction]:
-        code = self.exprs[0].codegen(context)
-        for i in range(1, len(self.exprs)):
-            andExpr = self.exprs[i]
-            last = code[-1]
-            code.extend(andExpr.codegen(context))
-            tmp = BinaryOpValue("or", last.lhs, code[-1].lhs)
-            tmp_name = context.tmpName()
-            code.append(AssignmentInstruction(tmp_name, tmp))
-        return code
+        if len(self.exprs) == 1:
+            return self.exprs[0].codegen(context)
+        return shortCircuit("or", self.exprs, context)
 
         
 class AndExpr(Expr):
@@ -180,15 +178,9 @@ class AndExpr(Expr):
         return "AndExpr"
     
     def codegen(self, context: CodegenContext) -> List[Instruction]:
-        code = self.exprs[0].codegen(context)
-        for i in range(1, len(self.exprs)):
-            eqExpr = self.exprs[i]
-            last = code[-1]
-            code.extend(eqExpr.codegen(context))
-            tmp = BinaryOpValue("and", last.lhs, code[-1].lhs)
-            tmp_name = context.tmpName()
-            code.append(AssignmentInstruction(tmp_name, tmp))
-        return code
+        if len(self.exprs) == 1:
+            return self.exprs[0].codegen(context)
+        return shortCircuit("and", self.exprs, context)
 
 class EqExpr(Expr):
     def __init__(self, exprs: List[CmpExpr], ops: List[str]) -> None:
@@ -302,6 +294,95 @@ class UnaryExpr(Expr):
         return code
 
 
+class BinaryExpr(Expr):
+    """Single operator node built by the precedence climbing parser, chains are nested to the left"""
+    def __init__(self, op: str, left: Expr, right: Expr) -> None:
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def children(self) -> List:
+        return [self.left, self.right]
+
+    def __str__(self) -> str:
+        return f"BinaryExpr(op: {self.op})"
+    
+    def codegen(self, context: CodegenContext) -> List[Instruction]:
+        if self.op in ["or", "and"]:
+            # a left nested chain of the same operator short circuits as one
+            operands = [self.right]
+            left = self.left
+            while type(left) == BinaryExpr and left.op == self.op:
+                operands.append(left.right)
+                left = left.left
+            operands.append(left)
+            return shortCircuit(self.op, operands[::-1], context)
+        code = self.left.codegen(context)
+        last = code[-1]
+        code.extend(self.right.codegen(context))
+        tmp = BinaryOpValue(self.op, last.lhs, code[-1].lhs)
+        tmp_name = context.tmpName()
+        code.append(AssignmentInstruction(tmp_name, tmp))
+        return code
+
+
+COMPARISON_OPS = ["==", "~=", "<", "<=", ">", ">="]
+
+
+def isBoolean(expr: Expr) -> bool:
+    """True when expr always evaluates to true, false or nil"""
+    t = type(expr)
+    if t in [OrExpr, AndExpr]:
+        return all(isBoolean(e) for e in expr.exprs)
+    elif t in [EqExpr, CmpExpr]:
+        return bool(expr.ops) or isBoolean(expr.exprs[0])
+    elif t in [AddExpr, MulExpr]:
+        return not expr.ops and isBoolean(expr.exprs[0])
+    elif t == UnaryExpr:
+        if expr.ops:
+            return expr.ops[-1] == "not"
+        return isBoolean(expr.value)
+    elif t == BinaryExpr:
+        if expr.op in ["or", "and"]:
+            return isBoolean(expr.left) and isBoolean(expr.right)
+        return expr.op in COMPARISON_OPS
+    elif t == ValueExpr:
+        if expr.type == "expr":
+            return isBoolean(expr.value)
+        return expr.type == "value" and expr.value.value in ["true", "false", "nil"]
+    return False
+
+
+def shortCircuit(op: str, operands: List[Expr], context: CodegenContext) -> List[Instruction]:
+    """
+    Lowers a chain of or/and operands to jumps, the first operand that decides the result
+    skips the rest. The operators test Python truthiness, where 0 and "" are false unlike
+    in if conditions, so an operand that is not a boolean is tested as `operand or false`
+    """
+    result = context.tmpName()
+    end = AssignmentInstruction(context.tmpName(), SingleValue(result))
+    code = []
+    for i, operand in enumerate(operands):
+        code.extend(operand.codegen(context))
+        value = code[-1].lhs
+        code.append(AssignmentInstruction(result, SingleValue(value)))
+        if i == len(operands) - 1:
+            break
+        cond = value
+        if not isBoolean(operand):
+            cond = context.tmpName()
+            code.append(AssignmentInstruction(cond, BinaryOpValue("or", value, "false")))
+        if op == "or":
+            code.append(IfGotoInstruction(SingleValue(cond), end))
+        else:
+            nextBlank = BlankInstruction()
+            code.append(IfGotoInstruction(SingleValue(cond), nextBlank))
+            code.append(GotoInstruction(end))
+            code.append(nextBlank)
+    code.append(end)
+    return code
+
+
 class ValueExpr(Expr):
     def __init__(self, value: Union[str, Value, Expr, CallExpr], type:str) -> None:
         self.value = value
@@ -367,8 +448,8 @@ class CallExpr(Expr):
         else:
             for i, arg in enumerate(self.argList):
                 code.extend(arg.codegen(context))
-                name = finfo.args[i] if i < len(finfo.args) else None
-                code.append(ParameterInstruction(SingleValue(code[-1].lhs), name))
+                if i < len(finfo.args):
+                    code.append(ParameterInstruction(SingleValue(code[-1].lhs), finfo.args[i]))
             calllen = len(self.argList)
             arglen = len(finfo.args)
             if calllen < arglen:
@@ -456,6 +537,10 @@ class ReturnStatement(Statement):
             return [ReturnInstruction(SingleValue("nil"))]
         code = []
         code.extend(self.result.codegen(context))
+        rhs = code[-1].rhs
+        if type(rhs) == CallInstruction and rhs.target is not None:
+            # nothing is left to do in this frame once the callee returns, the callee can reuse it
+            rhs.tail = True
         code.append(ReturnInstruction(SingleValue(code[-1].lhs)))
         return code
 
@@ -508,8 +593,8 @@ class FunctionDeclaration(Declaration):
 
     def codegen(self, context: CodegenContext) -> List[Instruction]:
         code = []
-        start = BlankInstruction()
         end = BlankInstruction()
+        start = FunctionInstruction(self.name, self.argList, end)
         finfo = FunctionInfo(self.name, self.argList, start)
         context.top().funcs[self.name] = finfo
         context.create()
@@ -0,0 +1,164 @@
+import struct
+
+from typing import List, Tuple, Union
+
+
+# Versioned on-disk module:
+#   header     magic, format version, program kind, flags, constant count, instruction count
+#   constants  tag byte followed by a little-endian payload
+#   code       fixed-width records: opcode and three signed 32-bit operands,
+#              so record i always starts at code offset i * INSTRUCTION.size
+# Version 2: stack machine ENTER records carry the end address of the function body
+# Version 3: TAILCALL records in both machines
+# Version 4: stack machine superinstructions
+MAGIC = b"SLUA"
+VERSION = 4
+
+KIND_STACK = 0
+KIND_REGISTER = 1
+
+HEADER = struct.Struct("<4sHBBII")
+INSTRUCTION = struct.Struct("<Biii")
+
+TAG_NIL = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_BIGINT = 6
+
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+SIZE = struct.Struct("<I")
+
+Constant = Union[int, float, str, bool, None]
+
+
+class BinaryFormatError(Exception):
+    pass
+
+
+class ConstantPool:
+    def __init__(self) -> None:
+        self.values: List[Constant] = []
+        self._ids = {}
+
+    def add(self, value: Constant) -> int:
+        # 1, 1.0 and True are equal dict keys, so the type is part of the key
+        key = (type(value), value)
+        if key not in self._ids:
+            self._ids[key] = len(self.values)
+            self.values.append(value)
+        return self._ids[key]
+
+    def to_binary(self) -> bytearray:
+        binary = bytearray()
+        for value in self.values:
+            if value is None:
+                binary.append(TAG_NIL)
+            elif value is False:
+                binary.append(TAG_FALSE)
+            elif value is True:
+                binary.append(TAG_TRUE)
+            elif type(value) == int and -2 ** 63 <= value < 2 ** 63:
+                binary.append(TAG_INT)
+                binary += INT.pack(value)
+            elif type(value) == int:
+                binary.append(TAG_BIGINT)
+                binary += encode_string(str(value))
+            elif type(value) == float:
+                binary.append(TAG_FLOAT)
+                binary += FLOAT.pack(value)
+            elif type(value) == str:
+                binary.append(TAG_STR)
+                binary += encode_string(value)
+            else:
+                raise BinaryFormatError(f"Unsupported constant: {value!r}")
+        return binary
+
+
+def encode_string(value: str) -> bytes:
+    value = value.encode("utf-8")
+    return SIZE.pack(len(value)) + value
+
+
+def is_module(binary) -> bool:
+    return bytes(binary[:len(MAGIC)]) == MAGIC
+
+
+def write_module(kind: int, pool: ConstantPool, records: List[Tuple[int, int, int, int]]) -> bytearray:
+    binary = bytearray(HEADER.pack(MAGIC, VERSION, kind, 0, len(pool.values), len(records)))
+    binary += pool.to_binary()
+    for record in records:
+        binary += INSTRUCTION.pack(*record)
+    return binary
+
+
+def _check_size(view: memoryview, pos: int, size: int, section: str):
+    if pos + size > len(view):
+        raise BinaryFormatError(f"Truncated {section}")
+
+
+def read_header(view: memoryview) -> Tuple[int, int, int]:
+    """Returns the program kind, constant count and instruction count"""
+    _check_size(view, 0, HEADER.size, "module header")
+    magic, version, kind, flags, constants, instructions = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise BinaryFormatError("Not a module: bad magic")
+    if version != VERSION:
+        raise BinaryFormatError(f"Unsupported module version {version}, expected {VERSION}")
+    return kind, constants, instructions
+
+
+def read_constants(view: memoryview, pos: int, count: int) -> Tuple[List[Constant], int]:
+    """Decodes the constant pool starting at pos, returns the constants and the offset of the code"""
+    constants = []
+    for i in range(count):
+        _check_size(view, pos, 1, "constant pool")
+        tag = view[pos]
+        pos += 1
+        if tag == TAG_NIL:
+            constants.append(None)
+        elif tag == TAG_FALSE:
+            constants.append(False)
+        elif tag == TAG_TRUE:
+            constants.append(True)
+        elif tag == TAG_INT:
+            _check_size(view, pos, INT.size, "constant pool")
+            constants.append(INT.unpack_from(view, pos)[0])
+            pos += INT.size
+        elif tag == TAG_FLOAT:
+            _check_size(view, pos, FLOAT.size, "constant pool")
+            constants.append(FLOAT.unpack_from(view, pos)[0])
+            pos += FLOAT.size
+        elif tag in [TAG_STR, TAG_BIGINT]:
+            _check_size(view, pos, SIZE.size, "constant pool")
+            size, = SIZE.unpack_from(view, pos)
+            pos += SIZE.size
+            _check_size(view, pos, size, "constant pool")
+            value = str(view[pos: pos + size], "utf-8")
+            pos += size
+            constants.append(int(value) if tag == TAG_BIGINT else value)
+        else:
+            raise BinaryFormatError(f"Unknown constant tag {tag}")
+    return constants, pos
+
+
+def read_sections(binary) -> Tuple[int, List[Constant], memoryview]:
+    """
+    Returns the program kind, the constant pool and a view of the code section.
+    Works on any buffer, including a read-only mmap, without copying the code
+    """
+    view = memoryview(binary)
+    kind, count, instructions = read_header(view)
+    constants, pos = read_constants(view, HEADER.size, count)
+    size = instructions * INSTRUCTION.size
+    _check_size(view, pos, size, "code section")
+    return kind, constants, view[pos: pos + size]
+
+
+def read_module(binary) -> Tuple[int, List[Constant], List[Tuple[int, int, int, int]]]:
+    """Returns the program kind, the constant pool and the (opcode, a, b, c) records"""
+    kind, constants, code = read_sections(binary)
+    return kind, constants, list(INSTRUCTION.iter_unpack(code))
@@ -1,8 +1,17 @@
-from ast import UnaryOp
-from numpy import var
 from .IR import *
+from .values import parse_literal, format_literal
+from .binary import ConstantPool, write_module, KIND_STACK
+from .liveness import share_temporaries
 
 from collections import defaultdict
+from typing import Dict, List, Tuple
+
+def encode_operand(value) -> bytearray:
+    value = str(value)
+    size1 = len(value) // 256
+    size2 = len(value) % 256
+    return bytearray([size1, size2]) + bytearray(value, encoding="ASCII")
+
 
 class Bytecode:
     def __init__(self) -> None:
@@ -13,6 +22,12 @@ class Bytecode:
     def to_binary(self) -> bytearray:
         pass
 
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return 0, 0, 0
+
+    def opcode(self) -> int:
+        return cls2opcode[type(self)]
+
 
 
 #Operations
@@ -184,11 +199,10 @@ class Pushv(Bytecode):
         return f"{self.id}: PUSHV {self.name}"
 
     def to_binary(self) -> bytearray:
-        name = str(self.name)
-        size1 = len(name) // 256
-        size2 = len(name) % 256
-        name = bytearray(name, encoding="ASCII")
-        return bytearray([16]) + bytearray([size1, size2]) + name
+        return bytearray([16]) + encode_operand(self.name)
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.name, 0, 0
 
 class Pushl(Bytecode):
     def __init__(self, value) -> None:
@@ -199,11 +213,10 @@ class Pushl(Bytecode):
         return f"{self.id}: PUSHL {self.value}"
 
     def to_binary(self) -> bytearray:
-        value = str(self.value)
-        size1 = len(value) // 256
-        size2 = len(value) % 256
-        value = bytearray(value, encoding="ASCII")
-        return bytearray([17]) + bytearray([size1, size2]) + value
+        return bytearray([17]) + encode_operand(format_literal(self.value))
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return pool.add(self.value), 0, 0
     
 
 class Pop(Bytecode):
@@ -227,44 +240,66 @@ class Load(Bytecode):
         return bytearray([19])
 
 class Jmp(Bytecode):
-    def __init__(self) -> None:
+    def __init__(self, target: int = None) -> None:
         super().__init__()
+        self.target = target
         
     def __str__(self) -> str:
-        return f"{self.id}: JMP"
+        return f"{self.id}: JMP {self.target}"
 
     def to_binary(self) -> bytearray:
-        return bytearray([20])
+        return bytearray([20]) + encode_operand(self.target)
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.target, 0, 0
 
 class CJmp(Bytecode):
-    def __init__(self) -> None:
+    def __init__(self, target: int = None) -> None:
         super().__init__()
+        self.target = target
 
     def __str__(self) -> str:
-        return f"{self.id}: CJMP"
+        return f"{self.id}: CJMP {self.target}"
 
     def to_binary(self) -> bytearray:
-        return bytearray([21])
+        return bytearray([21]) + encode_operand(self.target)
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.target, 0, 0
 
 class Call(Bytecode):
-    def __init__(self) -> None:
+    def __init__(self, target: int = None, argc: int = 0, is_assigned: bool = False) -> None:
         super().__init__()
+        self.target = target
+        self.argc = argc
+        self.is_assigned = is_assigned
 
     def __str__(self) -> str:
-        return f"{self.id}: CALL"
+        return f"{self.id}: CALL {self.target} {self.argc} {int(self.is_assigned)}"
 
     def to_binary(self) -> bytearray:
-        return bytearray([22])
+        return bytearray([22]) + encode_operand(self.target) + encode_operand(self.argc) + encode_operand(int(self.is_assigned))
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.target, self.argc, int(self.is_assigned)
 
 class Callb(Bytecode):
-    def __init__(self) -> None:
+    def __init__(self, name: str, argc: int = 0, is_assigned: bool = False) -> None:
         super().__init__()
+        self.name = name
+        self.argc = argc
+        self.is_assigned = is_assigned
+        # position of the builtin in the table of the VM, resolved when the program is loaded
+        self.index = -1
 
     def __str__(self) -> str:
-        return f"{self.id}: CALLB"
+        return f"{self.id}: CALLB {self.name} {self.argc} {int(self.is_assigned)}"
 
     def to_binary(self) -> bytearray:
-        return bytearray([23])
+        return bytearray([23]) + encode_operand(self.name) + encode_operand(self.argc) + encode_operand(int(self.is_assigned))
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return pool.add(self.name), self.argc, int(self.is_assigned)
 
 class Return(Bytecode):
     def __init__(self) -> None:
@@ -286,111 +321,258 @@ class Hault(Bytecode):
     def to_binary(self) -> bytearray:
         return bytearray([25])
 
+class TailCall(Bytecode):
+    """Call whose result the caller returns at once, the callee takes over the caller's frame"""
+    def __init__(self, target: int = None, argc: int = 0) -> None:
+        super().__init__()
+        self.target = target
+        self.argc = argc
+
+    def __str__(self) -> str:
+        return f"{self.id}: TAILCALL {self.target} {self.argc}"
+
+    def to_binary(self) -> bytearray:
+        return bytearray([27]) + encode_operand(self.target) + encode_operand(self.argc)
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.target, self.argc, 0
+
+class Enter(Bytecode):
+    def __init__(self, size, end: int = None) -> None:
+        super().__init__()
+        self.size = size
+        self.end = end
+
+    def __str__(self) -> str:
+        return f"{self.id}: ENTER {self.size} {self.end}"
+
+    def to_binary(self) -> bytearray:
+        return bytearray([26]) + encode_operand(self.size)
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.size, self.end, 0
+
+
+# Superinstructions: the sequences that dominate the instruction stream, each executed in one dispatch.
+# A pushed value is a single operand, a slot (>= 0) or a constant as -(index + 1) into the pool
+def value_operand(push: Bytecode, pool: ConstantPool) -> int:
+    if type(push) == Pushv:
+        return push.name
+    return -pool.add(push.value) - 1
+
+
+def format_value(push: Bytecode) -> str:
+    if type(push) == Pushv:
+        return f"v{push.name}"
+    return format_literal(push.value)
+
 
-def tac2bytecode(tac: List[Instruction]) -> List[Bytecode]:
-    var_ids = defaultdict(lambda: -1)
-    for line in tac:
-        if type(line) == AssignmentInstruction:
-            var_ids[line.lhs] = len(var_ids)
-        elif type(line) == ParameterInstruction and line.name:
-            var_ids[line.name] = len(var_ids)
+class Superinstruction(Bytecode):
+    def parts(self) -> List[Bytecode]:
+        """The instructions it stands for"""
+        pass
+
+class Move(Superinstruction):
+    """PUSHL dst; PUSHV or PUSHL value; LOAD"""
+    def __init__(self, dst: int, value: Bytecode) -> None:
+        super().__init__()
+        self.dst = dst
+        self.value = value
+
+    def __str__(self) -> str:
+        return f"{self.id}: MOVE {self.dst} {format_value(self.value)}"
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.dst, value_operand(self.value, pool), 0
+
+    def parts(self) -> List[Bytecode]:
+        return [Pushl(self.dst), self.value, Load()]
+
+class CJmpv(Superinstruction):
+    """PUSHV cond; CJMP target"""
+    def __init__(self, cond: int, target: int = None) -> None:
+        super().__init__()
+        self.cond = cond
+        self.target = target
+
+    def __str__(self) -> str:
+        return f"{self.id}: CJMPV {self.cond} {self.target}"
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.cond, self.target, 0
+
+    def parts(self) -> List[Bytecode]:
+        return [Pushv(self.cond), CJmp(self.target)]
+
+class Compute(Superinstruction):
+    """PUSHL dst; value2; value1; binary operation; LOAD, with an opcode for every operation"""
+    def __init__(self, op: type, dst: int, value1: Bytecode, value2: Bytecode) -> None:
+        super().__init__()
+        self.op = op
+        self.dst = dst
+        self.value1 = value1
+        self.value2 = value2
+
+    def __str__(self) -> str:
+        name = str(self.op()).split()[-1]
+        return f"{self.id}: {name}LOAD {self.dst} {format_value(self.value1)} {format_value(self.value2)}"
+
+    def operands(self, pool: ConstantPool) -> Tuple[int, int, int]:
+        return self.dst, value_operand(self.value1, pool), value_operand(self.value2, pool)
+
+    def opcode(self) -> int:
+        return cls2opcode[Compute] + cls2opcode[self.op]
+
+    def parts(self) -> List[Bytecode]:
+        return [Pushl(self.dst), self.value2, self.value1, self.op(), Load()]
+
+
+cls2opcode = {cls: opcode for opcode, cls in opcode2cls.items()}
+cls2opcode.update({
+    Pushv: 16,
+    Pushl: 17,
+    Pop: 18,
+    Load: 19,
+    Jmp: 20,
+    CJmp: 21,
+    Call: 22,
+    Callb: 23,
+    Return: 24,
+    Hault: 25,
+    Enter: 26,
+    TailCall: 27,
+    Move: 28,
+    CJmpv: 29,
+    # the first of the 13 opcodes of Compute, one for every binary operation in opcode order
+    Compute: 30
+})
+
+
+def determine(value: str) -> str:
+    if value.startswith('"'):
+        return "str"
+    elif value.isidentifier() and value not in ["true", "false"]:
+        return "id"
+    else:
+        return "other"
+
+
+def assign_slots(tac: List[Instruction], share_temps: bool = True) -> Tuple[List[int], Dict[int, Dict[str, int]]]:
+    """
+    Every function (and the top level, keyed by -1) gets its own slot table:
+    parameters come first, then every other assigned variable.
+    With share_temps, temporaries that are never live at the same time share a slot.
+    Returns the owner of every instruction and the slot tables
+    """
+    owners = function_owners(tac)
+    slots = defaultdict(dict)
+    for line, owner in zip(tac, owners):
+        if type(line) == FunctionInstruction:
+            slots[line.id] = {arg: i for i, arg in enumerate(line.args)}
+        elif type(line) == AssignmentInstruction:
+            scope = slots[owner]
+            if line.lhs not in scope:
+                scope[line.lhs] = len(scope)
+    if share_temps:
+        share_temporaries(tac, owners, slots)
+    return owners, slots
+
+
+def frame_size(scope: Dict[str, int]) -> int:
+    """Slots a frame needs for a slot table, shared temporaries make it smaller than the table"""
+    return max(scope.values(), default=-1) + 1
+
+
+def fuse(bytecode: List[Bytecode]) -> List[Bytecode]:
+    """The code of an assignment as one superinstruction, unchanged when there is none for it"""
+    types = [type(line) for line in bytecode]
+    if len(bytecode) == 3 and types[1] in [Pushv, Pushl]:
+        return [Move(bytecode[0].value, bytecode[1])]
+    if len(bytecode) == 5 and types[1] in [Pushv, Pushl] and types[2] in [Pushv, Pushl] \
+            and types[3] in biOp2cls.values():
+        return [Compute(types[3], bytecode[0].value, bytecode[2], bytecode[1])]
+    return bytecode
+
+
+def tac2bytecode(tac: List[Instruction], share_temps: bool = True, superinstructions: bool = True) -> List[Bytecode]:
+    """superinstructions fuses moves, binary operations into a slot and conditional jumps on a slot"""
+    owners, slots = assign_slots(tac, share_temps)
+    var_ids = slots[-1]
     mapping = {}
     toresolve = []
 
-    def determine(value: str) -> str:
-        if value.startswith('"'):
-            return "str"
-        elif value.isidentifier() and value not in ["true", "false"]:
-            return "id"
+    def push_value(bytecode: List[Bytecode], value: str) -> None:
+        kind = determine(value)
+        if kind == "id":
+            if value in var_ids:
+                bytecode.append(Pushv(var_ids[value]))
+            else:
+                # never assigned in this frame, so it is always nil
+                bytecode.append(Pushl(None))
+        elif kind == "str":
+            bytecode.append(Pushl(value[1: -1]))
+        else:
+            bytecode.append(Pushl(parse_literal(value)))
+
+    def call(bytecode: List[Bytecode], ins: CallInstruction, is_assigned: bool) -> None:
+        if ins.target is None:
+            bytecode.append(Callb(ins.name, ins.argc, is_assigned))
         else:
-            return "other" 
-    
+            bytecode.append(Call(None, ins.argc, is_assigned))
+            toresolve.append((bytecode[-1], "target", ins.target.id))
+
     def ins2byte(ins: Instruction) -> List[Bytecode]:
+        nonlocal var_ids
         t = type(ins)
         bytecode = []
+        var_ids = slots[owners[ins.id]]
         if t == GotoInstruction:
-            target_id = ins.target.id
-            bytecode.append(Pushl(None))
-            toresolve.append((bytecode[-1], target_id))
             bytecode.append(Jmp())
+            toresolve.append((bytecode[-1], "target", ins.target.id))
+        elif t == IfGotoInstruction and superinstructions and ins.cond.value in var_ids:
+            bytecode.append(CJmpv(var_ids[ins.cond.value]))
+            toresolve.append((bytecode[-1], "target", ins.target.id))
         elif t == IfGotoInstruction:
-            cond_var = ins.cond.value
-            cond_id = var_ids[cond_var]
-            target_id = ins.target.id
-            bytecode.append(Pushl(None))
-            toresolve.append((bytecode[-1], target_id))
-            bytecode.append(Pushv(cond_id))
+            push_value(bytecode, ins.cond.value)
             bytecode.append(CJmp())
+            toresolve.append((bytecode[-1], "target", ins.target.id))
+        elif t == AssignmentInstruction and owners[ins.id] >= 0 and is_tail_call(tac, ins):
+            # the arguments are on the stack already, the return after it is never reached
+            bytecode.append(TailCall(None, ins.rhs.argc))
+            toresolve.append((bytecode[-1], "target", ins.rhs.target.id))
         elif t == AssignmentInstruction:
             var_id = var_ids[ins.lhs]
             bytecode.append(Pushl(var_id))
             rhs = ins.rhs
             rhst = type(rhs)
             if rhst in [SingleValue, UnaryOpValue]:
-                kind = determine(rhs.value)
-                value = rhs.value
-                if kind == "id":
-                    bytecode.append(Pushv(var_ids[value]))
-                elif kind == "str":
-                    bytecode.append(Pushl(value[1: -1]))
-                else:
-                    bytecode.append(Pushl(value))
+                push_value(bytecode, rhs.value)
                 if rhst == UnaryOpValue:
                     bytecode.append(unOp2cls[rhs.op]())
 
             elif rhst == BinaryOpValue:
                 value1 = rhs.value1
                 value2 = rhs.value2
-                for kind, value in zip([determine(value2), determine(value1)], [value2, value1]):
-                    if kind == "id":
-                        bytecode.append(Pushv(var_ids[value]))
-                    elif kind == "str":
-                        bytecode.append(Pushl(value[1: -1]))
-                    else:
-                        bytecode.append(Pushl(value))
+                push_value(bytecode, value2)
+                push_value(bytecode, value1)
                 bytecode.append(biOp2cls[rhs.op]())
                 
             elif rhst == CallInstruction:
-                bytecode.append(Pushl(1))
-                if rhs.target is None:
-                    bytecode.append(Pushl(rhs.name))
-                    bytecode.append(Pushl(rhs.argc))
-                    bytecode.append(Callb())
-                else:
-                    target_id = rhs.target.id
-                    bytecode.append(Pushl(None))
-                    toresolve.append((bytecode[-1], target_id))
-                    bytecode.append(Pushl(rhs.argc))
-                    bytecode.append(Call())         
+                call(bytecode, rhs, True)
             bytecode.append(Load())
+            if superinstructions:
+                bytecode = fuse(bytecode)
         elif t == ReturnInstruction:
-            kind = determine(ins.value.value)
-            value = ins.value.value
-            if kind == "id":
-                bytecode.append(Pushv(var_ids[value]))
-            elif kind == "str":
-                bytecode.append(Pushl(value[1: -1]))
-            else:
-                bytecode.append(Pushl(value))
+            push_value(bytecode, ins.value.value)
             bytecode.append(Return())
         elif t == ParameterInstruction:
-            if ins.name is None:
-                bytecode.append(Pushl(-1))
-            else:
-                bytecode.append(Pushl(var_ids[ins.name]))
-            bytecode.append(Pushv(var_ids[ins.value.value]))
+            # arguments are passed by position into the callee's first slots
+            push_value(bytecode, ins.value.value)
+        elif t == FunctionInstruction:
+            bytecode.append(Enter(frame_size(var_ids)))
+            toresolve.append((bytecode[-1], "end", ins.end.id))
         elif t == CallInstruction:
-            bytecode.append(Pushl(0))
-            if ins.target is None:
-                bytecode.append(Pushl(ins.name))
-                bytecode.append(Pushl(ins.argc))
-                bytecode.append(Callb())
-            else:
-                target_id = ins.target.id
-                bytecode.append(Pushl(None))
-                toresolve.append((bytecode[-1], target_id))
-                bytecode.append(Pushl(ins.argc))
-                bytecode.append(Call())
+            call(bytecode, ins, False)
             bytecode.append(Pop())
         elif t == EndInstruction:
             bytecode.append(Hault())
@@ -398,21 +580,28 @@ def tac2bytecode(tac: List[Instruction]) -> List[Bytecode]:
         mapping[ins.id] = bytecode
         return bytecode
 
-    bytecode = []
+    bytecode = [Enter(frame_size(slots[-1]))]
     for ins in tac:
         bytecode.extend(ins2byte(ins))
     
     for i in range(len(bytecode)):
         bytecode[i].id = i
     
-    for jmp in toresolve:
-        code, ins_id = jmp[0], jmp[1]
-        code.value = mapping[ins_id][0].id
+    bytecode[0].end = len(bytecode)
+    for code, field, ins_id in toresolve:
+        setattr(code, field, mapping[ins_id][0].id)
 
     
     return bytecode 
 
 def bytecode2binary(bytecode: List[Bytecode]) -> bytearray:
+    pool = ConstantPool()
+    records = [(line.opcode(), *line.operands(pool)) for line in bytecode]
+    return write_module(KIND_STACK, pool, records)
+
+
+def bytecode2binary_v0(bytecode: List[Bytecode]) -> bytearray:
+    """Unversioned format: opcode bytes followed by length-prefixed decimal operands, it has no superinstructions"""
     binary = bytearray()
     for line in bytecode:
         binary += line.to_binary()
@@ -0,0 +1,102 @@
+import hashlib
+import mmap
+import os
+import tempfile
+
+from typing import Optional
+
+
+# Content-addressed store of compiled modules:
+#   key     sha256 of the compiler version, the compile options and the source bytes
+#   entry   <key>.bin holding the module exactly as compile() produced it
+# Hits refresh the entry mtime, which is the recency order for LRU eviction
+DEFAULT_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "sublua")
+DEFAULT_LIMIT = 64 << 20
+
+_version = None
+
+
+def compiler_version() -> str:
+    """Digest of every compiler source file, so any change to the compiler invalidates old entries"""
+    global _version
+    if _version is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = hashlib.sha256()
+        for directory, dirs, files in sorted(os.walk(root)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode())
+                    with open(path, "rb") as f:
+                        digest.update(f.read())
+        _version = digest.hexdigest()
+    return _version
+
+
+class CompileCache:
+    def __init__(self, directory: str = DEFAULT_DIR, limit: int = DEFAULT_LIMIT) -> None:
+        self.directory = directory
+        self.limit = limit
+
+    def key(self, file: str, **options) -> str:
+        digest = hashlib.sha256(compiler_version().encode())
+        digest.update(repr(sorted(options.items())).encode())
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key: str) -> Optional[mmap.mmap]:
+        """Maps the cached module read-only, None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                module = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # refreshing the entry only keeps eviction order, a read-only cache still serves hits
+            pass
+        return module
+
+    def put(self, key: str, module: bytes) -> None:
+        # readers only ever see complete entries: write a temporary file, then rename it over the entry
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(module)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits in limit bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".bin"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,406 @@
+from .bytecode import *
+
+from typing import Dict, List, Optional, Tuple
+
+
+# Compilation of a hot loop of stack machine bytecode into a Python closure, the second tier of
+# the stack machine. The closure covers the instructions from the target of a backward jump up to
+# the jump, it is entered at the target with the base of the running frame and returns the
+# address the interpreter goes on from, None when the guard fails.
+# The operand stack is simulated while compiling, so values go straight from slot to slot, and
+# the slots the loop touches are Python locals written back on the way out. The closure is
+# specialised for the types the slots hold when it is compiled: a guard on entry sends the
+# interpreter back to the loop when they no longer do. Instructions the closure does not do,
+# calls and returns, end it after the operands they take are pushed back, as every exit does
+NUM = "number"
+STR = "string"
+BOOL = "boolean"
+NIL = "nil"
+# None is any type
+
+Type = Optional[str]
+
+
+def value_type(value) -> Type:
+    t = type(value)
+    if t in [int, float]:
+        return NUM
+    elif t == str:
+        return STR
+    elif t == bool:
+        return BOOL
+    elif value is None:
+        return NIL
+    return None
+
+
+def join(a: Type, b: Type) -> Type:
+    return a if a == b else None
+
+
+# result types of builtins that always return the same type, by name and argument count
+BUILTIN_TYPES = {
+    ("print", 1): NIL,
+    ("tostring", 1): STR,
+    ("tonumber", 1): NUM,
+    ("read", 0): STR,
+}
+
+COMPARISONS = {LessOp: "<", LessEqOp: "<=", GreaterOp: ">", GreaterEqOp: ">="}
+ARITHMETIC = {SubOp: "-", MulOp: "*", DivOp: "/", DivRemOp: "%"}
+# instructions the closure hands back to the interpreter
+DEOPT = (Call, TailCall, Return, Hault, Enter)
+JUMPS = (Jmp, CJmp, CJmpv)
+
+
+class NotCompilable(Exception):
+    """The loop uses the operand stack in a way the closure does not follow, or never completes an iteration"""
+
+
+class LoopCompiler:
+    """
+    Writes the closure of the loop from start up to the backward jump at stop,
+    calling builtins from the tables of the VM
+    """
+    def __init__(self, bytecode: list, start: int, stop: int, builtins: list, fixed_builtins: dict) -> None:
+        self.bytecode = bytecode
+        self.start = start
+        self.stop = stop
+        self.builtins = builtins
+        self.fixed_builtins = fixed_builtins
+        self.assumed: Dict[int, Type] = dict()
+        for i in range(start, stop + 1):
+            if not isinstance(bytecode[i], Bytecode):
+                raise NotCompilable()
+        self.written = set()
+        leaders = {start}
+        for i, line in enumerate(bytecode[start: stop + 1], start):
+            if type(line) in JUMPS:
+                if start <= line.target <= stop:
+                    leaders.add(line.target)
+                leaders.add(i + 1)
+            elif type(line) in DEOPT:
+                leaders.add(i + 1)
+        leaders.discard(stop + 1)
+        # the address after the last instruction of every block
+        self.ends = dict()
+        leaders = sorted(leaders)
+        for leader, nxt in zip(leaders, leaders[1:] + [stop + 1]):
+            self.ends[leader] = nxt
+        self.succs = {leader: self.successors(leader) for leader in leaders}
+        # the closure is only ever entered at start, where the interpreter goes on after
+        # an instruction it hands back is its own business
+        reached = {start}
+        work = [start]
+        while work:
+            for succ in self.succs[work.pop()]:
+                if succ in self.ends and succ not in reached:
+                    reached.add(succ)
+                    work.append(succ)
+        if not any(start in self.succs[leader] for leader in reached):
+            # every iteration hands back to the interpreter before it is done, entering would only cost
+            raise NotCompilable()
+        leaders = sorted(reached)
+        self.ends = {leader: self.ends[leader] for leader in leaders}
+        self.succs = {leader: self.succs[leader] for leader in leaders}
+        self.read = sorted({line.name for leader in leaders for line in expand(bytecode[leader: self.ends[leader]])
+                            if type(line) == Pushv})
+        preds = {leader: 0 for leader in leaders}
+        for leader, succs in self.succs.items():
+            for succ in succs:
+                if succ in preds:
+                    preds[succ] += 1
+        # a block entered from one block only is written inside it, the others are cases of a dispatch loop
+        self.inlined = {leader for leader, count in preds.items()
+                        if count == 1 and leader != start and leader not in self.succs[leader]}
+        self.temps = 0
+        self.namespace = dict()
+        # slots every block reads before writing them, and slots it writes
+        self.uses: Dict[int, set] = {leader: set() for leader in leaders}
+        self.defs: Dict[int, set] = {leader: set() for leader in leaders}
+        for leader in leaders:
+            self.block(leader, dict(), [])
+        self.live = self.live_slots()
+
+    def successors(self, leader: int) -> List[int]:
+        last = self.bytecode[self.ends[leader] - 1]
+        t = type(last)
+        if t == Jmp:
+            return [last.target]
+        elif t in [CJmp, CJmpv]:
+            return [last.target, self.ends[leader]]
+        elif t in DEOPT:
+            return []
+        return [self.ends[leader]]
+
+    def live_slots(self) -> set:
+        """The slots read on entry to the loop before it writes them, the only ones its guard checks"""
+        live = {leader: set() for leader in self.ends}
+        changed = True
+        while changed:
+            changed = False
+            for leader in sorted(self.ends, reverse=True):
+                out = set()
+                for succ in self.succs[leader]:
+                    out |= live.get(succ, set())
+                new = self.uses[leader] | (out - self.defs[leader])
+                if new != live[leader]:
+                    live[leader] = new
+                    changed = True
+        return live[self.start]
+
+    # types
+
+    def infer(self) -> Dict[int, Dict[int, Type]]:
+        """The types of the slots on entry to every block, from the assumptions on entry to the loop"""
+        states = {self.start: dict(self.assumed)}
+        work = [self.start]
+        while work:
+            leader = work.pop()
+            state = dict(states[leader])
+            self.block(leader, state, [])
+            for succ in self.succs[leader]:
+                if succ not in self.ends:
+                    continue
+                old = states.get(succ)
+                new = dict(state) if old is None else {slot: join(old.get(slot), state.get(slot))
+                                                       for slot in set(old) | set(state)}
+                if new != old:
+                    states[succ] = new
+                    work.append(succ)
+        return states
+
+    # code
+
+    def compile(self, assumed: Dict[int, Type]) -> Tuple[str, Dict[int, Type]]:
+        """
+        The source of the closure and the slot types its guard checks, given the types of the
+        slots in read that the closure may take for granted on entry
+        """
+        self.assumed = {slot: t for slot, t in assumed.items() if slot in self.live}
+        states = self.infer()
+        self.temps = 0
+        self.namespace = dict()
+        guarded = {slot: t for slot, t in states[self.start].items() if t is not None and slot in self.live}
+        cases = []
+        for leader in sorted(self.ends):
+            if leader in states and leader not in self.inlined:
+                cases.append(f"if pc == {leader}:")
+                cases.extend(indent(self.emit(leader, dict(states[leader]))))
+        slots = sorted(set(self.read) | self.written)
+        lines = [f"def loop(base):"]
+        body = [f"s{slot} = cells[base + {slot}]" for slot in slots]
+        checks = []
+        for slot, t in sorted(guarded.items()):
+            if t == NUM:
+                checks.append(f"type(s{slot}) not in _NUM")
+            else:
+                checks.append(f"type(s{slot}) is not {TYPE_NAMES[t]}")
+        if checks:
+            body.append(f"if {' or '.join(checks)}:")
+            body.append("    return None")
+        body.append(f"pc = {self.start}")
+        body.append("while True:")
+        body.extend(indent(cases))
+        return "\n".join(lines + indent(body)) + "\n", guarded
+
+    def emit(self, leader: int, state: Dict[int, Type]) -> List[str]:
+        lines = []
+        stack = self.block(leader, state, lines)
+        last = self.bytecode[self.ends[leader] - 1]
+        if type(last) in [CJmp, CJmpv]:
+            cond, t = stack.pop()
+            self.balanced(stack)
+            taken = self.goto(last.target, dict(state))
+            fallen = self.goto(self.ends[leader], state)
+            if t in [NUM, STR]:
+                # numbers and strings are always true
+                lines.extend(taken)
+            elif t in [BOOL, NIL]:
+                lines.append(f"if {cond}:")
+                lines.extend(indent(taken))
+                lines.append("else:")
+                lines.extend(indent(fallen))
+            else:
+                lines.append(f"if _truth({cond}):")
+                lines.extend(indent(taken))
+                lines.append("else:")
+                lines.extend(indent(fallen))
+        elif type(last) == Jmp:
+            self.balanced(stack)
+            lines.extend(self.goto(last.target, state))
+        elif type(last) in DEOPT:
+            lines.extend(self.leave(self.ends[leader] - 1, stack))
+        else:
+            self.balanced(stack)
+            lines.extend(self.goto(self.ends[leader], state))
+        return lines
+
+    def goto(self, target: int, state: Dict[int, Type]) -> List[str]:
+        if target not in self.ends:
+            return self.leave(target, [])
+        elif target in self.inlined:
+            return self.emit(target, state)
+        return [f"pc = {target}"]
+
+    def leave(self, address: int, stack: list) -> List[str]:
+        """Writes the slots and the operands back for the interpreter to go on at address"""
+        lines = [f"cells[base + {slot}] = s{slot}" for slot in sorted(self.written)]
+        lines.extend(f"cells.append({value})" for value, _ in stack)
+        lines.append(f"return {address}")
+        return lines
+
+    def balanced(self, stack: list) -> None:
+        # statements leave nothing on the stack between blocks
+        if stack:
+            raise NotCompilable()
+
+    def temp(self) -> str:
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def constant(self, value) -> str:
+        if type(value) in [int, float, str, bool] or value is None:
+            return repr(value)
+        name = f"_k{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def block(self, leader: int, state: Dict[int, Type], lines: List[str]) -> list:
+        """
+        Appends the code of the block to lines and updates the slot types in state.
+        Returns the simulated operand stack before its last instruction if that one jumps
+        or leaves, as (expression, type) pairs
+        """
+        stack = []
+        code = expand(self.bytecode[leader: self.ends[leader]])
+        if type(code[-1]) in JUMPS or type(code[-1]) in DEOPT:
+            code.pop()
+        try:
+            self.instructions(leader, code, state, stack, lines)
+        except IndexError:
+            # the block takes operands pushed before the loop was entered
+            raise NotCompilable()
+        return stack
+
+    def instructions(self, leader: int, code: list, state: Dict[int, Type], stack: list, lines: List[str]) -> None:
+        for line in code:
+            t = type(line)
+            if t == Pushl:
+                stack.append((self.constant(line.value), value_type(line.value)))
+            elif t == Pushv:
+                stack.append((f"s{line.name}", state.get(line.name)))
+                if line.name not in self.defs[leader]:
+                    self.uses[leader].add(line.name)
+            elif t == Pop:
+                stack.pop()
+            elif t == Load:
+                value, value_t = stack.pop()
+                slot, _ = stack.pop()
+                if not slot.isdigit():
+                    raise NotCompilable()
+                slot = int(slot)
+                name = f"s{slot}"
+                for j, (other, other_t) in enumerate(stack):
+                    if other == name:
+                        # an operand still to be used keeps the value it was pushed with
+                        temp = self.temp()
+                        lines.append(f"{temp} = {name}")
+                        stack[j] = (temp, other_t)
+                if lines and value[0] == "t" and lines[-1].startswith(f"{value} = "):
+                    # the value was computed for this slot only
+                    lines[-1] = name + lines[-1][len(value):]
+                elif value != name:
+                    lines.append(f"{name} = {value}")
+                state[slot] = value_t
+                self.written.add(slot)
+                self.defs[leader].add(slot)
+            elif t == Callb:
+                stack.append(self.callb(line, stack, lines))
+            elif t in [UnaryPlus, UnaryMinus, UnaryNot]:
+                stack.append(self.unary(t, stack.pop(), lines))
+            else:
+                arg1 = stack.pop()
+                arg2 = stack.pop()
+                stack.append(self.binary(t, arg1, arg2, lines))
+
+    def result(self, expression: str, t: Type, lines: List[str]) -> Tuple[str, Type]:
+        temp = self.temp()
+        lines.append(f"{temp} = {expression}")
+        return temp, t
+
+    def number(self, operand: Tuple[str, Type]) -> str:
+        value, t = operand
+        return value if t == NUM else f"_number({value})"
+
+    def truth(self, operand: Tuple[str, Type]) -> str:
+        value, t = operand
+        if t in [BOOL, NIL]:
+            return value
+        elif t in [NUM, STR]:
+            return "True"
+        return f"_truth({value})"
+
+    def unary(self, t: type, arg: Tuple[str, Type], lines: List[str]) -> Tuple[str, Type]:
+        if t == UnaryNot:
+            return self.result(f"not {self.truth(arg)}", BOOL, lines)
+        elif t == UnaryMinus:
+            return self.result(f"-{self.number(arg)}", NUM, lines)
+        return self.result(self.number(arg), NUM, lines)
+
+    def binary(self, t: type, arg1: Tuple[str, Type], arg2: Tuple[str, Type], lines: List[str]) -> Tuple[str, Type]:
+        (value1, t1), (value2, t2) = arg1, arg2
+        if t == OrOp:
+            return self.result(f"{value1} or {value2}", join(t1, t2), lines)
+        elif t == AndOp:
+            return self.result(f"{value1} and {value2}", join(t1, t2), lines)
+        elif t == EqOp:
+            return self.result(f"{value1} == {value2}", BOOL, lines)
+        elif t == NeqOp:
+            return self.result(f"{value1} != {value2}", BOOL, lines)
+        elif t in COMPARISONS:
+            return self.result(f"{self.number(arg1)} {COMPARISONS[t]} {self.number(arg2)}", BOOL, lines)
+        elif t in ARITHMETIC:
+            return self.result(f"{self.number(arg1)} {ARITHMETIC[t]} {self.number(arg2)}", NUM, lines)
+        elif t == AddOp:
+            if (t1 == NUM and t2 == NUM) or (t1 == STR and t2 == STR):
+                return self.result(f"{value1} + {value2}", t1, lines)
+            # strings are only concatenated with strings, anything else adds as numbers
+            known = NUM if STR not in [t1, t2] and None not in [t1, t2] else None
+            return self.result(f"_add({value1}, {value2})", known, lines)
+        raise NotCompilable()
+
+    def callb(self, line: Callb, stack: list, lines: List[str]) -> Tuple[str, Type]:
+        slot = stack.pop() if line.is_assigned else None
+        if len(stack) < line.argc:
+            raise NotCompilable()
+        args = stack[len(stack) - line.argc:]
+        del stack[len(stack) - line.argc:]
+        fn = self.fixed_builtins.get((line.name, line.argc))
+        name = f"_b{line.id}"
+        if fn is None:
+            fn = self.builtins[line.index]
+        self.namespace[name] = fn
+        value = self.result(f"{name}({', '.join(arg for arg, _ in args)})",
+                            BUILTIN_TYPES.get((line.name, line.argc)), lines)
+        if slot is not None:
+            stack.append(slot)
+        return value
+
+
+TYPE_NAMES = {STR: "str", BOOL: "bool", NIL: "type(None)"}
+
+
+def expand(code: list) -> list:
+    """The instructions with every superinstruction replaced by the sequence it stands for"""
+    expanded = []
+    for line in code:
+        if isinstance(line, Superinstruction):
+            expanded.extend(line.parts())
+        else:
+            expanded.append(line)
+    return expanded
+
+
+def indent(lines: List[str]) -> List[str]:
+    return ["    " + line for line in lines]
@@ -0,0 +1,172 @@
+from .IR import *
+from .bytecode import determine
+from .graph_utils import buildCFG, localEdges
+from .liveness import dead_temporaries, dead_stores
+
+import heapq
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+# Copy propagation over the basic blocks of buildCFG. A copy d = s, with s a variable or a
+# literal, is available where every path from the function entry assigns it and neither
+# d nor s changes afterwards. Available copies are kept as {d: s}, with s already resolved
+# through earlier copies, so a use of d can read s instead
+Copies = Dict[str, str]
+
+# operations that never raise, a store of their result can go when nobody reads it
+SAFE_BINARY_OPS = ["or", "and", "==", "~="]
+SAFE_UNARY_OPS = ["not"]
+
+
+def operands(ins: Instruction) -> List[IRValue]:
+    """The values an instruction reads, as objects whose fields can be rewritten"""
+    t = type(ins)
+    if t == AssignmentInstruction and type(ins.rhs) != CallInstruction:
+        return [ins.rhs]
+    elif t == IfGotoInstruction:
+        return [ins.cond]
+    elif t in [ReturnInstruction, ParameterInstruction]:
+        return [ins.value]
+    return []
+
+
+def substitute(copies: Copies, value: IRValue) -> None:
+    t = type(value)
+    if t in [SingleValue, UnaryOpValue]:
+        value.value = copies.get(value.value, value.value)
+    elif t == BinaryOpValue:
+        value.value1 = copies.get(value.value1, value.value1)
+        value.value2 = copies.get(value.value2, value.value2)
+
+
+def transfer(copies: Copies, sources: Dict[str, set], ins: Instruction) -> None:
+    """Kills the copies an assignment overwrites and records the one it makes"""
+    if type(ins) != AssignmentInstruction:
+        return
+    lhs = ins.lhs
+    rhs = ins.rhs
+    src = copies.get(rhs.value, rhs.value) if type(rhs) == SingleValue else None
+    old = copies.pop(lhs, None)
+    if old is not None:
+        sources[old].discard(lhs)
+    for dst in sources.pop(lhs, ()):
+        del copies[dst]
+    if src is not None:
+        if src != lhs:
+            copies[lhs] = src
+            if determine(src) == "id":
+                sources[src].add(lhs)
+
+
+def index(copies: Copies) -> Dict[str, set]:
+    sources = defaultdict(set)
+    for dst, src in copies.items():
+        if determine(src) == "id":
+            sources[src].add(dst)
+    return sources
+
+
+def intersect(states: List[Optional[Copies]]) -> Optional[Copies]:
+    """None stands for every copy, the state of a block no path has reached yet"""
+    result = None
+    for state in states:
+        if state is None:
+            continue
+        if result is None:
+            result = dict(state)
+        else:
+            result = {dst: src for dst, src in result.items() if state.get(dst) == src}
+    return result
+
+
+def propagate_copies(code: List[Instruction]) -> None:
+    cfg = buildCFG(code)
+    succs = localEdges(cfg)
+    preds = [[] for _ in cfg]
+    for block, targets in zip(cfg, succs):
+        for target in targets:
+            preds[target.id].append(block.id)
+    entries = {block.id for block in cfg if block.instructions[0].id == 0
+               or type(block.instructions[0]) == FunctionInstruction}
+
+    # copies into temporaries are dropped once the temporary is dead, which keeps states small
+    dead = dead_temporaries(code, cfg, succs)
+
+    def block_in(block) -> Optional[Copies]:
+        if block.id in entries or not preds[block.id]:
+            return {}
+        return intersect([outs[pred] for pred in preds[block.id]])
+
+    outs: List[Optional[Copies]] = [None] * len(cfg)
+    # blocks run in layout order, so straight code settles before the code after it runs
+    work = list(range(len(cfg)))
+    queued = [True] * len(cfg)
+    while work:
+        block = cfg[heapq.heappop(work)]
+        queued[block.id] = False
+        copies = block_in(block)
+        if copies is not None:
+            sources = index(copies)
+            for ins in block.instructions:
+                transfer(copies, sources, ins)
+            for dst in dead[block.id]:
+                copies.pop(dst, None)
+        if copies != outs[block.id]:
+            outs[block.id] = copies
+            for succ in succs[block.id]:
+                if not queued[succ.id]:
+                    queued[succ.id] = True
+                    heapq.heappush(work, succ.id)
+
+    for block in cfg:
+        copies = block_in(block) or {}
+        sources = index(copies)
+        for ins in block.instructions:
+            for value in operands(ins):
+                substitute(copies, value)
+            transfer(copies, sources, ins)
+    for ins in code:
+        ins.__dict__.pop("block", None)
+
+
+def removable(ins: Instruction) -> bool:
+    """An assignment that can be dropped, or turned into a bare call, when its result is dead"""
+    if type(ins) != AssignmentInstruction:
+        return False
+    rhs = ins.rhs
+    t = type(rhs)
+    if t in [SingleValue, CallInstruction]:
+        return True
+    elif t == UnaryOpValue:
+        return rhs.op in SAFE_UNARY_OPS
+    elif t == BinaryOpValue:
+        return rhs.op in SAFE_BINARY_OPS
+    return False
+
+
+def eliminate_dead_stores(code: List[Instruction]) -> List[Instruction]:
+    dead = dead_stores(code, [removable(ins) for ins in code])
+    code = list(code)
+    if not dead:
+        return code
+    for i in dead:
+        ins = code[i]
+        if type(ins.rhs) == CallInstruction:
+            replacement = ins.rhs
+        else:
+            replacement = BlankInstruction()
+        replacement.id = ins.id
+        code[i] = replacement
+    retarget(code)
+    return remove_blanks(code)
+
+
+def eliminate_copies(code: List[Instruction]) -> List[Instruction]:
+    """
+    Reads the source of a copy instead of the variable it was copied into, then drops
+    the stores whose values are never read. Expects enumerated code, returns new enumerated code
+    """
+    propagate_copies(code)
+    return eliminate_dead_stores(code)
@@ -0,0 +1,279 @@
+from .IR import *
+from .bytecode import determine
+from .graph_utils import buildCFG, localEdges, BasicBlock
+from .liveness import is_temporary, uses, dead_temporaries
+from .values import NUMBER, parse_literal, format_literal, value2bool, UNARY_OPS, BINARY_OPS, PURE_BUILTINS
+
+import heapq
+import math
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+
+# Sparse conditional constant propagation over the basic blocks of buildCFG.
+# A lattice value is (type, value) for a constant, the type keeps 1, 1.0 and true apart,
+# or OVERDEFINED. Frames are private to a call, so the analysis is intraprocedural:
+# calls fall through to the next block and every function entry is a root where
+# parameters are unknown and all other variables hold the nil of a fresh frame.
+# Temporaries are always assigned before they are read, they enter a state when assigned
+OVERDEFINED = None
+
+Constant = Optional[Tuple[type, object]]
+State = Dict[str, Constant]
+
+
+def literal(value) -> Optional[str]:
+    """TAC literal that the backends load as exactly value, None when there is none"""
+    t = type(value)
+    if t == str:
+        return f'"{value}"'
+    elif value is None or t == bool:
+        return format_literal(value)
+    elif t in [int, float]:
+        text = format_literal(value)
+        if NUMBER.fullmatch(text):
+            parsed = parse_literal(text)
+            if type(parsed) == t and parsed == value:
+                return text
+    return None
+
+
+def call_arguments(code: List[Instruction]) -> Dict[int, List[int]]:
+    """Ids of the parameter instructions of every call, parameters and calls nest like brackets"""
+    pending = []
+    arguments = {}
+    for ins in code:
+        t = type(ins)
+        if t == ParameterInstruction:
+            pending.append(ins.id)
+            continue
+        if t == CallInstruction:
+            call = ins
+        elif t == AssignmentInstruction and type(ins.rhs) == CallInstruction:
+            call = ins.rhs
+        else:
+            continue
+        start = len(pending) - call.argc
+        arguments[ins.id] = pending[start:]
+        del pending[start:]
+    return arguments
+
+
+def meet(states: List[State]) -> State:
+    result = dict(states[0])
+    for state in states[1:]:
+        for name, value in state.items():
+            if name not in result:
+                result[name] = value
+            elif result[name] != value:
+                result[name] = OVERDEFINED
+    return result
+
+
+class ConstantFolder:
+    def __init__(self, code: List[Instruction]) -> None:
+        self.code = code
+        self.cfg = buildCFG(code)
+        self.leaders = {block.instructions[0].id: block for block in self.cfg if block.instructions}
+        self.arguments = call_arguments(code)
+        self.params = dict()
+        owners = function_owners(code)
+        assigned = defaultdict(dict)
+        for ins, owner in zip(code, owners):
+            if type(ins) == AssignmentInstruction and not is_temporary(ins.lhs):
+                assigned[owner][ins.lhs] = (type(None), None)
+        self.entries = {0: assigned[-1]}
+        for ins in code:
+            if type(ins) == FunctionInstruction:
+                state = dict(assigned[ins.id])
+                for arg in ins.args:
+                    state[arg] = OVERDEFINED
+                self.entries[ins.id] = state
+        self.states = dict()
+        # temporaries are dropped from a state once they are dead, which keeps states small
+        self.dead = dead_temporaries(code, self.cfg, localEdges(self.cfg))
+
+    def operand(self, state: State, value: str) -> Constant:
+        kind = determine(value)
+        if kind == "str":
+            return (str, value[1: -1])
+        elif kind == "id":
+            if value in state:
+                return state[value]
+            elif is_temporary(value):
+                return OVERDEFINED
+            # a name this frame never assigns is always nil
+            return (type(None), None)
+        value = parse_literal(value)
+        return (type(value), value)
+
+    def evaluate(self, state: State, ins: AssignmentInstruction) -> Constant:
+        rhs = ins.rhs
+        rhst = type(rhs)
+        if rhst == SingleValue:
+            return self.operand(state, rhs.value)
+        if rhst == UnaryOpValue:
+            fn = UNARY_OPS[rhs.op]
+            args = [self.operand(state, rhs.value)]
+        elif rhst == BinaryOpValue:
+            fn = BINARY_OPS[rhs.op]
+            args = [self.operand(state, rhs.value1), self.operand(state, rhs.value2)]
+        elif rhst == CallInstruction and rhs.target is None and rhs.name in PURE_BUILTINS:
+            fn = PURE_BUILTINS[rhs.name]
+            args = [self.params.get(i, OVERDEFINED) for i in self.arguments[ins.id]]
+        else:
+            return OVERDEFINED
+        if OVERDEFINED in args:
+            return OVERDEFINED
+        try:
+            value = fn(*[arg[1] for arg in args])
+        except Exception:
+            # the program fails here at runtime, which is left for the VM to report
+            return OVERDEFINED
+        if value != value or (type(value) == float and value == 0 and math.copysign(1, value) < 0):
+            # nan never equals itself and -0.0 equals 0.0, neither can be told apart from other values
+            return OVERDEFINED
+        return (type(value), value)
+
+    def transfer(self, block: BasicBlock, state: State) -> List[BasicBlock]:
+        """Runs the block over state in place, returns the successors that can execute"""
+        for ins in block.instructions:
+            t = type(ins)
+            if t == AssignmentInstruction:
+                state[ins.lhs] = self.evaluate(state, ins)
+            elif t == ParameterInstruction:
+                self.params[ins.id] = self.operand(state, ins.value.value)
+        exit = block.instructions[-1]
+        t = type(exit)
+        if t == GotoInstruction:
+            return [self.leaders[exit.target.id]]
+        elif t in [ReturnInstruction, EndInstruction]:
+            return []
+        fallthrough = self.cfg[block.id + 1]
+        if t == IfGotoInstruction:
+            cond = self.operand(state, exit.cond.value)
+            if cond is OVERDEFINED:
+                return [fallthrough, self.leaders[exit.target.id]]
+            elif value2bool(cond[1]):
+                return [self.leaders[exit.target.id]]
+        return [fallthrough]
+
+    def analyse(self) -> None:
+        outs = dict()
+        preds = defaultdict(set)
+        # blocks run in layout order, so straight code settles before the code after it runs
+        work = sorted(self.leaders[entry].id for entry in self.entries)
+        queued = set(work)
+        while work:
+            block = self.cfg[heapq.heappop(work)]
+            queued.discard(block.id)
+            first = block.instructions[0]
+            states = [outs[pred] for pred in preds[block.id]]
+            if first.id in self.entries:
+                states.append(self.entries[first.id])
+            state = meet(states)
+            if self.states.get(block.id) == state:
+                continue
+            self.states[block.id] = state
+            state = dict(state)
+            succs = self.transfer(block, state)
+            for name in self.dead[block.id]:
+                state.pop(name, None)
+            outs[block.id] = state
+            for succ in succs:
+                preds[succ.id].add(block.id)
+                if succ.id not in queued:
+                    queued.add(succ.id)
+                    heapq.heappush(work, succ.id)
+
+    def rewrite_operand(self, state: State, value: str) -> str:
+        if determine(value) != "id":
+            return value
+        constant = self.operand(state, value)
+        if constant is OVERDEFINED:
+            return value
+        text = literal(constant[1])
+        return value if text is None else text
+
+    def rewrite(self) -> List[Instruction]:
+        code = list(self.code)
+        blanks = set()
+        for block in self.cfg:
+            if not block.instructions:
+                continue
+            if block.id not in self.states:
+                for ins in block.instructions:
+                    if type(ins) not in [FunctionInstruction, EndInstruction]:
+                        blanks.add(ins.id)
+                continue
+            state = dict(self.states[block.id])
+            for ins in block.instructions:
+                t = type(ins)
+                if t == AssignmentInstruction:
+                    value = self.evaluate(state, ins)
+                    text = None if value is OVERDEFINED else literal(value[1])
+                    rhs = ins.rhs
+                    if text is not None:
+                        if type(rhs) == CallInstruction:
+                            blanks.update(self.arguments[ins.id])
+                        ins.rhs = SingleValue(text)
+                    elif type(rhs) in [SingleValue, UnaryOpValue]:
+                        rhs.value = self.rewrite_operand(state, rhs.value)
+                    elif type(rhs) == BinaryOpValue:
+                        rhs.value1 = self.rewrite_operand(state, rhs.value1)
+                        rhs.value2 = self.rewrite_operand(state, rhs.value2)
+                    state[ins.lhs] = value
+                elif t == CallInstruction and ins.target is None and ins.name in PURE_BUILTINS:
+                    args = [self.params.get(i, OVERDEFINED) for i in self.arguments[ins.id]]
+                    if OVERDEFINED in args:
+                        continue
+                    try:
+                        PURE_BUILTINS[ins.name](*[arg[1] for arg in args])
+                    except Exception:
+                        continue
+                    # a result nobody reads from a call that cannot fail
+                    blanks.add(ins.id)
+                    blanks.update(self.arguments[ins.id])
+                elif t in [ParameterInstruction, ReturnInstruction]:
+                    ins.value = SingleValue(self.rewrite_operand(state, ins.value.value))
+                elif t == IfGotoInstruction:
+                    cond = self.operand(state, ins.cond.value)
+                    if cond is OVERDEFINED:
+                        continue
+                    if value2bool(cond[1]):
+                        goto = GotoInstruction(ins.target)
+                        goto.id = ins.id
+                        code[ins.id] = goto
+                    else:
+                        blanks.add(ins.id)
+
+        # temporaries whose every read was replaced by their literal are not needed any more
+        read = set()
+        for ins in code:
+            if ins.id not in blanks:
+                read.update(uses(ins))
+        for ins in code:
+            if (type(ins) == AssignmentInstruction and is_temporary(ins.lhs) and ins.lhs not in read
+                    and type(ins.rhs) == SingleValue and determine(ins.rhs.value) != "id"):
+                blanks.add(ins.id)
+
+        for i in blanks:
+            blank = BlankInstruction()
+            blank.id = i
+            code[i] = blank
+        for ins in code:
+            ins.__dict__.pop("block", None)
+        retarget(code)
+        return remove_blanks(code)
+
+
+def fold_constants(code: List[Instruction]) -> List[Instruction]:
+    """
+    Replaces computations whose value is known at compile time by literals, using the
+    coercion rules of the virtual machines, and removes branches that can never execute.
+    Expects enumerated code, returns new enumerated code
+    """
+    folder = ConstantFolder(code)
+    folder.analyse()
+    return folder.rewrite()
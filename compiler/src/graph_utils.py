@@ -25,7 +25,6 @@ def buildCFG(code: List[Instruction]) -> List[BasicBlock]:
     # code = deepcopy(code)
     cfg: list[BasicBlock] = []
     starts = {0}
-    funcs = set()
     calls = defaultdict(list)
 
     for instruction in code:
@@ -34,17 +33,17 @@ def buildCFG(code: List[Instruction]) -> List[BasicBlock]:
             if instruction.target:
                 starts.add(instruction.target.id)
                 if t == CallInstruction:
-                    funcs.add((instruction.target.id - 1, code[instruction.target.id - 1].target.id))
                     calls[instruction.target.id - 1].append(instruction.id)
             starts.add(instruction.id + 1)
         elif t == AssignmentInstruction and type(instruction.rhs) == CallInstruction:
             if instruction.rhs.target:
                 starts.add(instruction.rhs.target.id)
-                funcs.add((instruction.rhs.target.id - 1, code[instruction.rhs.target.id - 1].target.id))
                 calls[instruction.rhs.target.id - 1].append(instruction.id)
             starts.add(instruction.id + 1)
         elif t == ReturnInstruction:
             starts.add(instruction.id + 1)
+    # the end instruction always gets a block of its own, the last block is replaced by it below
+    starts.add(len(code) - 1)
     
     starts = sorted(list(starts))
     
@@ -62,6 +61,7 @@ def buildCFG(code: List[Instruction]) -> List[BasicBlock]:
     cfg[-1] = end
     for i, block in enumerate(cfg):
         block.id = i
+    owners = function_owners(code)
 
     
     for i, block in enumerate(cfg[:-1]):
@@ -77,26 +77,165 @@ def buildCFG(code: List[Instruction]) -> List[BasicBlock]:
                 block.children().append(exit.target.block)
                 #exit.target.block.children().append(cfg[block.id + 1])
         
-                block.children().append(cfg[block.id + 1])
+            block.children().append(cfg[block.id + 1])
         elif t == AssignmentInstruction and type(exit.rhs) == CallInstruction:
             rhs = exit.rhs
             if  rhs.target:
                 block.children().append(rhs.target.block)
                 #rhs.target.block.children().append(cfg[block.id + 1])
             
-                block.children().append(cfg[block.id + 1])
+            block.children().append(cfg[block.id + 1])
         elif t == ReturnInstruction:
-            pass
-            id = exit.id
-            contain = list(filter(lambda f: f[0]<id<f[1], funcs))
-            actual = min(contain, key=lambda f: f[1] - f[0])
-            for id in calls[actual[0]]:
+            owner = owners[exit.id]
+            if owner < 0:
+                # a return at the top level
+                continue
+            # the goto jumping over the innermost function body keys its call sites
+            for id in calls[owner - 1]:
                 block.children().append(code[id + 1].block)
         else:
             block.children().append(cfg[block.id + 1])
 
     return cfg
 
+def localEdges(cfg: List[BasicBlock]) -> List[List[BasicBlock]]:
+    """
+    Successors of every block within its own function: frames are private to a call,
+    so calls fall through to the next block and returns leave the function
+    """
+    edges = []
+    for i, block in enumerate(cfg):
+        exit = block.instructions[-1]
+        t = type(exit)
+        if t == GotoInstruction:
+            edges.append([exit.target.block])
+        elif t == IfGotoInstruction:
+            edges.append([cfg[i + 1], exit.target.block])
+        elif t in [ReturnInstruction, EndInstruction]:
+            edges.append([])
+        else:
+            edges.append([cfg[i + 1]])
+    return edges
+
+
+def dominators(cfg: List[BasicBlock], edges: List[List[BasicBlock]]) -> List[int]:
+    """
+    Immediate dominator of every block over the given edges, by the iterative algorithm of
+    Cooper, Harvey and Kennedy. Function entries dominate themselves, blocks no entry reaches get -1
+    """
+    entries = [block.id for block in cfg if block.instructions[0].id == 0
+               or type(block.instructions[0]) == FunctionInstruction]
+    # reverse postorder of every function, found without recursion
+    order = []
+    visited = [False] * len(cfg)
+    for entry in entries:
+        visited[entry] = True
+        stack = [(entry, iter(edges[entry]))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if not visited[succ.id]:
+                    visited[succ.id] = True
+                    stack.append((succ.id, iter(edges[succ.id])))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+    position = [-1] * len(cfg)
+    for i, block in enumerate(order):
+        position[block] = i
+    order.reverse()
+    preds = [[] for _ in cfg]
+    for block, succs in zip(cfg, edges):
+        if visited[block.id]:
+            for succ in succs:
+                preds[succ.id].append(block.id)
+
+    idom = [-1] * len(cfg)
+    roots = set(entries)
+    for entry in entries:
+        idom[entry] = entry
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            if block in roots:
+                continue
+            new = -1
+            for pred in preds[block]:
+                if idom[pred] < 0:
+                    continue
+                if new < 0:
+                    new = pred
+                    continue
+                # walk both up the tree until they meet, postorder positions grow towards the entry
+                a, b = pred, new
+                while a != b:
+                    while position[a] < position[b]:
+                        a = idom[a]
+                    while position[b] < position[a]:
+                        b = idom[b]
+                new = a
+            if idom[block] != new:
+                idom[block] = new
+                changed = True
+    return idom
+
+
+def naturalLoops(cfg: List[BasicBlock], edges: List[List[BasicBlock]]) -> List[tuple]:
+    """
+    Loops as (header, set of block ids), one per header with the bodies of all its back edges
+    merged. An edge is a back edge when its target dominates its source. Inner loops come first
+    """
+    idom = dominators(cfg, edges)
+    # a dominates b when b is numbered within the subtree of a in the dominator tree
+    children = [[] for _ in cfg]
+    for block, parent in enumerate(idom):
+        if parent >= 0 and parent != block:
+            children[parent].append(block)
+    enter = [-1] * len(cfg)
+    leave = [-1] * len(cfg)
+    clock = 0
+    for root in [block for block, parent in enumerate(idom) if parent == block]:
+        stack = [(root, iter(children[root]))]
+        enter[root] = clock
+        clock += 1
+        while stack:
+            block, rest = stack[-1]
+            child = next(rest, None)
+            if child is None:
+                stack.pop()
+                leave[block] = clock
+            else:
+                enter[child] = clock
+                clock += 1
+                stack.append((child, iter(children[child])))
+
+    def dominates(a: int, b: int) -> bool:
+        return enter[a] <= enter[b] < leave[a]
+
+    preds = [[] for _ in cfg]
+    for block, succs in zip(cfg, edges):
+        for succ in succs:
+            preds[succ.id].append(block.id)
+    bodies = dict()
+    for block, succs in zip(cfg, edges):
+        if idom[block.id] < 0:
+            continue
+        for succ in succs:
+            if not dominates(succ.id, block.id):
+                continue
+            body = bodies.setdefault(succ.id, {succ.id})
+            work = [block.id]
+            while work:
+                member = work.pop()
+                if member in body:
+                    continue
+                body.add(member)
+                work.extend(pred for pred in preds[member] if idom[pred] >= 0)
+    return sorted(bodies.items(), key=lambda loop: len(loop[1]))
+
+
 def dfs(node: Node):
     id = 0
     node.parent = None
@@ -1,4 +1,86 @@
+import bisect
 import re
+import sys
+from array import array
+from typing import Iterator, TextIO
+
+
+LEXERS = ["master", "rules"]
+
+
+# Token kinds. Keywords and operators get a kind of their own,
+# so the parser compares small ints instead of tag and value strings
+EOF = 0
+ID = 1
+NUMBER = 2
+STRING = 3
+BOOLEAN = 4
+END = 5
+FUNCTION = 6
+RETURN = 7
+WHILE = 8
+BREAK = 9
+DO = 10
+IF = 11
+THEN = 12
+ELSE = 13
+NIL = 14
+NOT = 15
+OR = 16
+AND = 17
+LPAREN = 18
+RPAREN = 19
+COMMA = 20
+PLUS = 21
+MINUS = 22
+MUL = 23
+DIV = 24
+DIVREM = 25
+LESSEQ = 26
+GREATEREQ = 27
+LESS = 28
+GREATER = 29
+EQ = 30
+NEQ = 31
+ASSIGN = 32
+
+# the tag each kind is lexed with and its fixed value, if it has one
+kindTags = [
+    "EOF", "id", "number", "string", "boolean",
+    "keyword", "keyword", "keyword", "keyword", "keyword", "keyword", "keyword",
+    "keyword", "keyword", "keyword", "keyword", "keyword", "keyword",
+    "lparen", "rparen", "comma", "plus", "minus", "mul", "div", "divrem",
+    "lesseq", "greatereq", "less", "greater", "eq", "neq", "assign"
+]
+
+kindValues = [
+    "EOF", None, None, None, None,
+    "end", "function", "return", "while", "break", "do", "if",
+    "then", "else", "nil", "not", "or", "and",
+    "(", ")", ",", "+", "-", "*", "/", "%",
+    "<=", ">=", "<", ">", "==", "~=", "="
+]
+
+keywordKinds = {value: kind for kind, value in enumerate(kindValues) if kindTags[kind] == "keyword"}
+tagKinds = {tag: kind for kind, tag in enumerate(kindTags) if tag != "keyword"}
+
+
+class LineIndex:
+    """
+    Maps offsets in code to (line, pos) pairs, the newline table is built on first use.
+    code must start at the beginning of source line first_line
+    """
+    def __init__(self, code: str, first_line: int = 1):
+        self.code = code
+        self.first_line = first_line
+        self._newlines = None
+
+    def position(self, offset: int):
+        if self._newlines is None:
+            self._newlines = [m.start() for m in re.finditer('\n', self.code)]
+        line = bisect.bisect_left(self._newlines, offset)
+        start = self._newlines[line - 1] + 1 if line else 0
+        return self.first_line + line, offset - start + 1
 
 
 class Token:
@@ -13,11 +95,67 @@ class Token:
                                         self.value)
 
 
+class OffsetToken(Token):
+    """Token that keeps its offset into index.code and resolves line and pos only when asked"""
+    def __init__(self, tag: str, offset: int, value: str, index: LineIndex):
+        self.tag = tag
+        self.offset = offset
+        self.value = value
+        self._index = index
+
+    @property
+    def line(self):
+        return self._index.position(self.offset)[0]
+
+    @property
+    def pos(self):
+        return self._index.position(self.offset)[1]
+
+
+class TokenBuffer:
+    """
+    Struct-of-arrays token storage: a kind, start and end offsets into code per token.
+    Identifiers keep their interned value, every other value is fixed by the kind or sliced from code
+    """
+    def __init__(self, code: str, index: LineIndex):
+        self.code = code
+        self.index = index
+        self.kinds = array('B')
+        self.starts = array('l')
+        self.ends = array('l')
+        self.names = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind: int, start: int, end: int) -> None:
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.names.append(sys.intern(self.code[start:end]) if kind == ID else None)
+
+    def value(self, i: int) -> str:
+        kind = self.kinds[i]
+        if kind == ID:
+            return self.names[i]
+        value = kindValues[kind]
+        if value is None:
+            return self.code[self.starts[i]:self.ends[i]]
+        return value
+
+    def token(self, i: int) -> Token:
+        return OffsetToken(kindTags[self.kinds[i]], self.starts[i], self.value(i), self.index)
+
+
 class Lexer:
-    def __init__(self):
+    def __init__(self, mode: str = "master"):
+        if mode not in LEXERS:
+            raise ValueError(f"Unknown lexer: {mode}")
+        self.mode = mode
         self._index = 0
         self._pos = self._line = 1
         self.code = ''
+        self.source = None
         rules = [
             (r'--.*', 'Comment'),
             (r'end|function|return|while|break|do|if|then|else|nil|not|or|and', 'keyword'),
@@ -45,11 +183,31 @@ class Lexer:
         for regex, tag in rules:
             self.rules.append((re.compile(regex), tag))
         self._redundant = ['Comment']
+        # alternatives are tried left to right, so the first rule that matches wins as before
+        self.master = re.compile(r'\s*(?:' + '|'.join(f'(?P<{tag}>{regex})' for regex, tag in rules) + ')')
+        self._space = re.compile(r'\s*')
+        # kind lexed by each master group, None for keywords whose kind depends on the value
+        self._group_kinds = [None] * (self.master.groups + 1)
+        for tag, group in self.master.groupindex.items():
+            self._group_kinds[group] = tagKinds.get(tag)
 
     def init(self, code: str):
         self._index = 0
         self._pos = self._line = 1
         self.code = code
+        self.source = None
+
+    def init_file(self, source: TextIO, chunk_size: int = 1 << 16):
+        """
+        Lexes straight from a text file. The master lexer reads it chunk by chunk,
+        the rules lexer needs the whole source in memory
+        """
+        if self.mode != "master":
+            self.init(source.read())
+            return
+        self.init('')
+        self.source = source
+        self.chunk_size = chunk_size
 
     def _cur(self):
         if self._index == len(self.code):
@@ -92,7 +250,109 @@ class Lexer:
                 raise SyntaxError(f"Lexical analysis error on ({self._line}, {self._pos})")
         return None
 
+    def _piece_tokens(self, code: str, index: LineIndex):
+        redundant = self._redundant
+        end = 0
+        for m in self.master.finditer(code):
+            if m.start() != end:
+                break
+            end = m.end()
+            tag = m.lastgroup
+            if tag in redundant:
+                continue
+            value = m.group(tag)
+            yield OffsetToken(tag, end - len(value), value, index)
+        end = self._space.match(code, end).end()
+        if end != len(code):
+            raise SyntaxError("Lexical analysis error on ({}, {})".format(*index.position(end)))
+
+    def _piece_buffer(self, code: str, index: LineIndex) -> TokenBuffer:
+        buffer = TokenBuffer(code, index)
+        kinds = buffer.kinds.append
+        starts = buffer.starts.append
+        ends = buffer.ends.append
+        names = buffer.names.append
+        group_kinds = self._group_kinds
+        comment = self.master.groupindex['Comment']
+        intern = sys.intern
+        end = 0
+        for m in self.master.finditer(code):
+            if m.start() != end:
+                break
+            end = m.end()
+            group = m.lastindex
+            if group == comment:
+                continue
+            kind = group_kinds[group]
+            start = m.start(group)
+            if kind == ID:
+                names(intern(code[start:end]))
+            else:
+                if kind is None:
+                    kind = keywordKinds[code[start:end]]
+                names(None)
+            kinds(kind)
+            starts(start)
+            ends(end)
+        end = self._space.match(code, end).end()
+        if end != len(code):
+            raise SyntaxError("Lexical analysis error on ({}, {})".format(*index.position(end)))
+        return buffer
+
+    def _rules_buffer(self) -> TokenBuffer:
+        buffer = TokenBuffer(self.code, LineIndex(self.code))
+        for token in self.tokens():
+            kind = keywordKinds[token.value] if token.tag == "keyword" else tagKinds[token.tag]
+            # the rules lexer has just moved past the token it yielded
+            buffer.append(kind, self._index - len(token.value), self._index)
+        return buffer
+
+    def buffers(self) -> Iterator[TokenBuffer]:
+        """
+        Yields the tokens as TokenBuffers, one per chunk read when lexing a file.
+        The stream always ends with an EOF token placed right after the last token
+        """
+        last = TokenBuffer('', LineIndex(''))
+        if self.mode != "master":
+            last = self._rules_buffer()
+            yield last
+        else:
+            pieces = self._pieces() if self.source is not None else [(self.code, 1)]
+            for piece, line in pieces:
+                buffer = self._piece_buffer(piece, LineIndex(piece, line))
+                if len(buffer):
+                    last = buffer
+                yield buffer
+        eof = TokenBuffer(last.code, last.index)
+        start = last.starts[-1] + 1 if len(last) else 0
+        eof.append(EOF, start, start)
+        yield eof
+
+    def _pieces(self):
+        # no token spans a newline, so everything up to the last newline read so far
+        # lexes the same as it would in the whole source
+        line = 1
+        rest = ''
+        while True:
+            chunk = self.source.read(self.chunk_size)
+            buffer = rest + chunk
+            cut = buffer.rfind('\n') + 1 if chunk else len(buffer)
+            if cut:
+                piece = buffer[:cut]
+                yield piece, line
+                line += piece.count('\n')
+            rest = buffer[cut:]
+            if not chunk:
+                break
+
     def tokens(self):
+        if self.mode == "master":
+            if self.source is not None:
+                for piece, line in self._pieces():
+                    yield from self._piece_tokens(piece, LineIndex(piece, line))
+            else:
+                yield from self._piece_tokens(self.code, LineIndex(self.code))
+            return
         while True:
             token = self._next()
             if token is None:
@@ -0,0 +1,208 @@
+from .IR import *
+
+from collections import defaultdict
+from typing import AbstractSet, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+
+def is_temporary(name: str) -> bool:
+    return name.startswith("_t")
+
+
+def successors(code: List[Instruction]) -> List[List[int]]:
+    """Intraprocedural control flow: calls fall through, returns and end leave the function"""
+    succs = []
+    for ins in code:
+        t = type(ins)
+        if t == GotoInstruction:
+            succs.append([ins.target.id])
+        elif t == IfGotoInstruction:
+            succs.append([ins.id + 1, ins.target.id])
+        elif t in [ReturnInstruction, EndInstruction]:
+            succs.append([])
+        else:
+            succs.append([ins.id + 1])
+    return succs
+
+
+def uses(ins: Instruction) -> List[str]:
+    t = type(ins)
+    if t == AssignmentInstruction:
+        rhs = ins.rhs
+        rhst = type(rhs)
+        if rhst in [SingleValue, UnaryOpValue]:
+            return [rhs.value]
+        elif rhst == BinaryOpValue:
+            return [rhs.value1, rhs.value2]
+    elif t == IfGotoInstruction:
+        return [ins.cond.value]
+    elif t in [ReturnInstruction, ParameterInstruction]:
+        return [ins.value.value]
+    return []
+
+
+def runs(code: List[Instruction]) -> Tuple[List[range], List[List[int]]]:
+    """
+    Splits enumerated TAC into runs that control only enters at the first instruction and
+    leaves at the last, returns them with the runs each one flows to
+    """
+    succs = successors(code)
+    starts = {0}
+    for i, targets in enumerate(succs):
+        if targets != [i + 1]:
+            starts.add(i + 1)
+            starts.update(targets)
+    starts = sorted(start for start in starts if start < len(code))
+    spans = [range(start, end) for start, end in zip(starts, starts[1:] + [len(code)])]
+    index = {span.start: i for i, span in enumerate(spans)}
+    edges = [[index[target] for target in succs[span[-1]] if target in index] for span in spans]
+    return spans, edges
+
+
+class Liveness:
+    """
+    Backward dataflow over runs of enumerated TAC, for the variables tracked accepts. Sets are
+    kept per run, the variables live after an instruction are found by walking its run backwards.
+    A removable instruction only makes its operands live when its own result is live
+    """
+    def __init__(self, code: List[Instruction], spans: List[range], edges: List[List[int]],
+                 tracked: Callable[[str], bool], removable: Optional[List[bool]] = None) -> None:
+        self.code = code
+        self.spans = spans
+        self.edges = edges
+        self.tracked = tracked
+        self.removable = removable
+        preds = [[] for _ in spans]
+        for run, targets in enumerate(edges):
+            for target in targets:
+                preds[target].append(run)
+
+        # runs nothing is live into share one empty set, only the others hold sets of their own
+        self.live_in: List[AbstractSet[str]] = [frozenset()] * len(spans)
+        work = list(range(len(spans)))
+        queued = [True] * len(spans)
+        while work:
+            run = work.pop()
+            queued[run] = False
+            live = self.live_out(run)
+            for _ in self.walk(run, live):
+                pass
+            if live != self.live_in[run]:
+                self.live_in[run] = live
+                for pred in preds[run]:
+                    if not queued[pred]:
+                        queued[pred] = True
+                        work.append(pred)
+
+    def live_out(self, run: int) -> Set[str]:
+        return set().union(*[self.live_in[target] for target in self.edges[run]])
+
+    def walk(self, run: int, live: Set[str]) -> Iterator[int]:
+        """Runs the run backwards over live in place, yields every instruction while live holds what is live after it"""
+        for i in reversed(self.spans[run]):
+            yield i
+            ins = self.code[i]
+            lhs = ins.lhs if type(ins) == AssignmentInstruction else None
+            if self.removable is None or not self.removable[i] or lhs in live:
+                live.discard(lhs)
+                live.update(name for name in uses(ins) if self.tracked(name))
+
+
+def live_temporaries(code: List[Instruction]) -> Dict[int, AbstractSet[str]]:
+    """The temporaries live on entry to every run, keyed by the id of its first instruction"""
+    liveness = Liveness(code, *runs(code), is_temporary)
+    return {span.start: live for span, live in zip(liveness.spans, liveness.live_in)}
+
+
+def dead_temporaries(code: List[Instruction], cfg: list, edges: list) -> List[Set[str]]:
+    """
+    For every basic block the temporaries that are dead when it exits: those it assigns or
+    receives that none of its successors reads. Forward analyses drop them from their states
+    """
+    spans = [range(block.instructions[0].id, block.instructions[-1].id + 1) for block in cfg]
+    liveness = Liveness(code, spans, [[succ.id for succ in succs] for succs in edges], is_temporary)
+    dead = []
+    for block, live_in in zip(cfg, liveness.live_in):
+        temps = {ins.lhs for ins in block.instructions if type(ins) == AssignmentInstruction and is_temporary(ins.lhs)}
+        dead.append((temps | live_in) - liveness.live_out(block.id))
+    return dead
+
+
+def dead_stores(code: List[Instruction], removable: List[bool]) -> Set[int]:
+    """
+    The removable instructions whose result is never read. Liveness runs on the strongly live
+    variables, so whole chains of stores nobody reads come out dead in one analysis
+    """
+    liveness = Liveness(code, *runs(code), str.isidentifier, removable)
+    dead = set()
+    for run in range(len(liveness.spans)):
+        live = liveness.live_out(run)
+        for i in liveness.walk(run, live):
+            if removable[i] and code[i].lhs not in live:
+                dead.add(i)
+    return dead
+
+
+def share_temporaries(code: List[Instruction], owners: List[int], slots: Dict[int, Dict[str, int]]) -> None:
+    """
+    Rewrites the temporary entries of every slot table so that temporaries that are never
+    live at the same time share a slot. Named variables keep their slots, temporaries are
+    packed after them
+    """
+    liveness = Liveness(code, *runs(code), is_temporary)
+    interference = defaultdict(set)
+    order = []
+    # a temporary read before any assignment expects the nil of a fresh slot, so it keeps its own
+    pinned = set(liveness.live_in[0]) if code else set()
+    for run, span in enumerate(liveness.spans):
+        live = liveness.live_out(run)
+        after = dict()
+        for i in liveness.walk(run, live):
+            ins = code[i]
+            if type(ins) == AssignmentInstruction and is_temporary(ins.lhs):
+                after[i] = set(live)
+            elif type(ins) == FunctionInstruction:
+                pinned |= live
+        for i in span:
+            if i not in after:
+                continue
+            lhs = code[i].lhs
+            if lhs not in interference:
+                order.append(lhs)
+            neighbours = interference[lhs]
+            neighbours |= after[i]
+            neighbours.discard(lhs)
+            for other in neighbours:
+                interference[other].add(lhs)
+
+    temporaries = defaultdict(list)
+    seen = set()
+    for ins, owner in zip(code, owners):
+        if type(ins) == AssignmentInstruction and is_temporary(ins.lhs) and ins.lhs not in seen:
+            seen.add(ins.lhs)
+            temporaries[owner].append(ins.lhs)
+
+    colors = {}
+    for name in order:
+        if name in pinned:
+            continue
+        taken = {colors[other] for other in interference[name] if other in colors}
+        color = 0
+        while color in taken:
+            color += 1
+        colors[name] = color
+
+    for owner, scope in slots.items():
+        named = [name for name in scope if not is_temporary(name)]
+        scope.clear()
+        for name in named:
+            scope[name] = len(scope)
+        base = len(named)
+        width = 0
+        for name in temporaries[owner]:
+            if name in colors:
+                scope[name] = base + colors[name]
+                width = max(width, colors[name] + 1)
+        for name in temporaries[owner]:
+            if name not in scope:
+                scope[name] = base + width
+                width += 1
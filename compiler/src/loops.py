@@ -0,0 +1,306 @@
+from .IR import *
+from .bytecode import determine
+from .folding import call_arguments
+from .graph_utils import buildCFG, localEdges, naturalLoops
+from .liveness import is_temporary, dead_temporaries
+from .values import parse_literal, PURE_BUILTINS
+
+import heapq
+
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional
+
+
+# Loop invariant code motion over the natural loops of buildCFG. A hoisted computation runs
+# once before the loop even when the loop body never does, so only computations that cannot
+# fail move: their operators are total on the types their operands can hold. Types come from
+# a forward analysis in the style of the folding pass, a variable maps to the set of types
+# it may hold, a fresh frame holds nil in every named variable
+Types = FrozenSet[str]
+State = Dict[str, Types]
+
+NUMBER: Types = frozenset(["number"])
+STRING: Types = frozenset(["string"])
+BOOLEAN: Types = frozenset(["boolean"])
+NIL: Types = frozenset(["nil"])
+ANY: Types = NUMBER | STRING | BOOLEAN | NIL
+
+# types of the values the builtins return, user functions may return anything
+BUILTIN_RESULTS: Dict[str, Types] = {
+    "print": NIL,
+    "read": STRING,
+    "tostring": STRING,
+    "tonumber": NUMBER,
+}
+
+# operators whose result is always a boolean
+COMPARISON_OPS = ["<", "<=", ">", ">=", "==", "~="]
+
+
+def literal_types(value: str) -> Types:
+    if determine(value) == "str":
+        return STRING
+    value = parse_literal(value)
+    if type(value) == bool:
+        return BOOLEAN
+    return NUMBER
+
+
+def operand(state: State, value: str) -> Types:
+    if determine(value) != "id":
+        return literal_types(value)
+    elif value in state:
+        return state[value]
+    elif is_temporary(value):
+        return ANY
+    # a name this frame never assigns is always nil
+    return NIL
+
+
+def result(rhs: IRValue, args: List[Types]) -> Types:
+    t = type(rhs)
+    if t == SingleValue:
+        return args[0]
+    elif t == UnaryOpValue:
+        return BOOLEAN if rhs.op == "not" else NUMBER
+    elif t == BinaryOpValue:
+        if rhs.op in COMPARISON_OPS:
+            return BOOLEAN
+        elif rhs.op in ["or", "and"]:
+            return args[0] | args[1]
+        elif rhs.op == "+":
+            # two strings concatenate, anything else is added as numbers
+            if args[0] == STRING and args[1] == STRING:
+                return STRING
+            elif "string" in args[0] and "string" in args[1]:
+                return NUMBER | STRING
+        return NUMBER
+    elif rhs.target is None:
+        return BUILTIN_RESULTS.get(rhs.name, ANY)
+    return ANY
+
+
+def total(rhs: IRValue, args: List[Types]) -> bool:
+    """True when the computation returns a value for every operand of the given types"""
+    t = type(rhs)
+    if t == SingleValue:
+        return True
+    elif t == UnaryOpValue:
+        return rhs.op == "not" or args[0] <= NUMBER
+    elif t == BinaryOpValue:
+        if rhs.op in ["or", "and", "==", "~="]:
+            return True
+        elif rhs.op == "+":
+            return (args[0] <= NUMBER and args[1] <= NUMBER) or (args[0] <= STRING and args[1] <= STRING)
+        elif rhs.op in ["/", "%"]:
+            # only a literal divisor is known not to be zero
+            divisor = parse_literal(rhs.value2) if determine(rhs.value2) == "other" else None
+            return args[0] <= NUMBER and type(divisor) in [int, float] and divisor != 0
+        return args[0] <= NUMBER and args[1] <= NUMBER
+    elif t == CallInstruction and rhs.target is None:
+        if rhs.name == "tostring":
+            return True
+        elif rhs.name == "tonumber":
+            return all(arg <= NUMBER for arg in args)
+    return False
+
+
+def meet(states: List[State]) -> State:
+    """
+    States only hold the variables assigned on the way, a named variable missing from
+    one of them still holds the nil of the fresh frame there
+    """
+    result = dict(states[0])
+    for state in states[1:]:
+        for name, types in state.items():
+            old = result.get(name)
+            if old is None:
+                result[name] = types if is_temporary(name) else types | NIL
+            elif old is not types and old != types:
+                result[name] = old | types
+        for name in result.keys() - state.keys():
+            if not is_temporary(name):
+                result[name] = result[name] | NIL
+    return result
+
+
+class InvariantHoister:
+    def __init__(self, code: List[Instruction]) -> None:
+        self.code = code
+        self.cfg = buildCFG(code)
+        self.edges = localEdges(self.cfg)
+        self.arguments = call_arguments(code)
+        self.preds = [[] for _ in self.cfg]
+        for block, succs in zip(self.cfg, self.edges):
+            for succ in succs:
+                self.preds[succ.id].append(block.id)
+        self.assignments = Counter(ins.lhs for ins in code if type(ins) == AssignmentInstruction)
+        # operand types of every assignment and parameter, filled in by infer
+        self.types: Dict[int, List[Types]] = dict()
+        # instructions to insert before an instruction, and the ones moved away from their place
+        self.inserts: Dict[int, List[Instruction]] = dict()
+        self.moved = set()
+        # gotos entering a loop, whoever jumped to one runs the code inserted before it first
+        self.entries = set()
+        # blocks that received hoisted code
+        self.landed = set()
+
+    def entry_state(self, block) -> Optional[State]:
+        first = block.instructions[0]
+        if first.id != 0 and type(first) != FunctionInstruction:
+            return None
+        if type(first) == FunctionInstruction:
+            return dict.fromkeys(first.args, ANY)
+        return {}
+
+    def transfer(self, block, state: State) -> None:
+        """Runs the block over state in place, recording the operand types of its instructions"""
+        for ins in block.instructions:
+            t = type(ins)
+            if t == ParameterInstruction:
+                self.types[ins.id] = [operand(state, ins.value.value)]
+            elif t == AssignmentInstruction:
+                rhs = ins.rhs
+                rhst = type(rhs)
+                if rhst in [SingleValue, UnaryOpValue]:
+                    args = [operand(state, rhs.value)]
+                elif rhst == BinaryOpValue:
+                    args = [operand(state, rhs.value1), operand(state, rhs.value2)]
+                else:
+                    args = [self.types[i][0] if i in self.types else ANY for i in self.arguments[ins.id]]
+                self.types[ins.id] = args
+                state[ins.lhs] = result(rhs, args)
+
+    def infer(self) -> None:
+        dead = dead_temporaries(self.code, self.cfg, self.edges)
+        entries = {block.id: self.entry_state(block) for block in self.cfg}
+        ins_states: Dict[int, State] = dict()
+        outs: Dict[int, State] = dict()
+        # blocks run in layout order, so straight code settles before the code after it runs
+        work = sorted(block for block, state in entries.items() if state is not None)
+        queued = set(work)
+        while work:
+            block = self.cfg[heapq.heappop(work)]
+            queued.discard(block.id)
+            states = [outs[pred] for pred in self.preds[block.id] if pred in outs]
+            if entries[block.id] is not None:
+                states.append(entries[block.id])
+            state = meet(states)
+            if ins_states.get(block.id) == state:
+                continue
+            ins_states[block.id] = state
+            state = dict(state)
+            self.transfer(block, state)
+            for name in dead[block.id]:
+                state.pop(name, None)
+            outs[block.id] = state
+            for succ in self.edges[block.id]:
+                if succ.id not in queued:
+                    queued.add(succ.id)
+                    heapq.heappush(work, succ.id)
+
+    def preheader(self, header: int, body: set) -> Optional[Instruction]:
+        """The instruction to insert hoisted code before, None when the loop has no single way in"""
+        outside = [pred for pred in self.preds[header] if pred not in body]
+        if len(outside) != 1 or len(self.edges[outside[0]]) != 1:
+            return None
+        exit = self.cfg[outside[0]].instructions[-1]
+        if type(exit) == GotoInstruction:
+            self.entries.add(exit.id)
+            return exit
+        elif type(exit) == IfGotoInstruction:
+            return None
+        return self.cfg[header].instructions[0]
+
+    def hoist(self, header: int, body: set) -> None:
+        before = self.preheader(header, body)
+        if before is None:
+            return
+        instructions = [ins for block in sorted(body) for ins in self.cfg[block].instructions]
+        assigned = Counter(ins.lhs for ins in instructions if type(ins) == AssignmentInstruction)
+        invariant = set()
+
+        def fixed(value: str) -> bool:
+            return determine(value) != "id" or assigned[value] == 0 or value in invariant
+
+        hoisted = []
+        for ins in instructions:
+            if (type(ins) != AssignmentInstruction or ins.id in self.moved or not is_temporary(ins.lhs)
+                    or self.assignments[ins.lhs] != 1 or ins.id not in self.types):
+                continue
+            rhs = ins.rhs
+            rhst = type(rhs)
+            group = [ins]
+            if rhst in [SingleValue, UnaryOpValue]:
+                values = [rhs.value]
+            elif rhst == BinaryOpValue:
+                values = [rhs.value1, rhs.value2]
+            elif rhs.target is None and rhs.name in PURE_BUILTINS:
+                # the parameters move along with the call, they must come right before it
+                params = self.arguments[ins.id]
+                if params != list(range(ins.id - len(params), ins.id)):
+                    continue
+                if any(i in self.moved or i not in self.types for i in params):
+                    continue
+                group = [self.code[i] for i in params] + group
+                values = [self.code[i].value.value for i in params]
+            else:
+                continue
+            if not all(fixed(value) for value in values) or not total(rhs, self.types[ins.id]):
+                continue
+            invariant.add(ins.lhs)
+            hoisted.extend(group)
+            self.moved.update(member.id for member in group)
+        if hoisted:
+            self.inserts.setdefault(before.id, []).extend(hoisted)
+            self.landed.update(pred for pred in self.preds[header] if pred not in body)
+
+    def rewrite(self) -> List[Instruction]:
+        code = []
+        redirect = dict()
+        for ins in self.code:
+            hoisted = self.inserts.get(ins.id)
+            if hoisted:
+                if ins.id in self.entries:
+                    redirect[ins.id] = hoisted[0]
+                code.extend(hoisted)
+            if ins.id in self.moved:
+                blank = BlankInstruction()
+                code.append(blank)
+                redirect[ins.id] = blank
+            else:
+                code.append(ins)
+        for ins in code:
+            ins.__dict__.pop("block", None)
+            t = type(ins)
+            if t in [GotoInstruction, IfGotoInstruction, CallInstruction] and ins.target:
+                ins.target = redirect.get(ins.target.id, ins.target)
+            elif t == AssignmentInstruction and type(ins.rhs) == CallInstruction and ins.rhs.target:
+                ins.rhs.target = redirect.get(ins.rhs.target.id, ins.rhs.target)
+            elif t == FunctionInstruction:
+                ins.end = redirect.get(ins.end.id, ins.end)
+        enumerate_instructions(code)
+        return remove_blanks(code)
+
+
+def hoist_invariants(code: List[Instruction]) -> List[Instruction]:
+    """
+    Moves computations whose operands do not change inside a loop, and that cannot fail, into
+    the block that enters the loop, so they run once instead of on every iteration. Code moved
+    out of an inner loop lands in the outer one, which is searched again until nothing moves.
+    Expects enumerated code, returns new enumerated code
+    """
+    while True:
+        hoister = InvariantHoister(code)
+        hoister.infer()
+        loops = naturalLoops(hoister.cfg, hoister.edges)
+        for header, body in loops:
+            hoister.hoist(header, body)
+        if not hoister.moved:
+            for ins in code:
+                ins.__dict__.pop("block", None)
+            return code
+        code = hoister.rewrite()
+        # only code that landed inside another loop can move further
+        if not hoister.landed & set().union(*[body for _, body in loops]):
+            return code
@@ -0,0 +1,129 @@
+from .IR import *
+from .graph_utils import buildCFG, localEdges
+
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+# operators whose operands can be swapped, + is not one of them because it also concatenates
+COMMUTATIVE_OPS = ["==", "~=", "*"]
+
+
+class ValueTable:
+    """
+    Value numbers for one run of blocks: variables and literals holding the same value share
+    a number, so do computations of the same operator on the same numbers
+    """
+    def __init__(self) -> None:
+        self.numbers: Dict[str, int] = dict()
+        self.exprs: Dict[tuple, int] = dict()
+        self.holders: Dict[int, str] = dict()
+        self.next = 0
+
+    def copy(self) -> "ValueTable":
+        table = ValueTable()
+        table.numbers = dict(self.numbers)
+        table.exprs = dict(self.exprs)
+        table.holders = dict(self.holders)
+        table.next = self.next
+        return table
+
+    def clear(self) -> None:
+        self.numbers.clear()
+        self.exprs.clear()
+        self.holders.clear()
+
+    def fresh(self) -> int:
+        self.next += 1
+        return self.next
+
+    def number(self, value: str) -> int:
+        if value not in self.numbers:
+            self.numbers[value] = self.fresh()
+        return self.numbers[value]
+
+    def holder(self, number: int) -> Optional[str]:
+        """A variable that still holds the value with this number"""
+        name = self.holders.get(number)
+        if name is not None and self.numbers.get(name) == number:
+            return name
+        return None
+
+    def assign(self, name: str, number: int) -> None:
+        self.numbers[name] = number
+        if self.holder(number) is None:
+            self.holders[number] = name
+
+
+def key(rhs: IRValue, table: ValueTable) -> tuple:
+    if type(rhs) == UnaryOpValue:
+        return (rhs.op, table.number(rhs.value))
+    operands = (table.number(rhs.value1), table.number(rhs.value2))
+    if rhs.op in COMMUTATIVE_OPS:
+        operands = tuple(sorted(operands))
+    return (rhs.op,) + operands
+
+
+def number_block(instructions: List[Instruction], table: ValueTable) -> None:
+    for ins in instructions:
+        t = type(ins)
+        if t == CallInstruction:
+            if ins.target is not None:
+                table.clear()
+        elif t == AssignmentInstruction:
+            rhs = ins.rhs
+            rhst = type(rhs)
+            if rhst == SingleValue:
+                table.assign(ins.lhs, table.number(rhs.value))
+            elif rhst in [UnaryOpValue, BinaryOpValue]:
+                k = key(rhs, table)
+                number = table.exprs.get(k)
+                holder = None if number is None else table.holder(number)
+                if holder is not None:
+                    ins.rhs = SingleValue(holder)
+                else:
+                    number = table.fresh()
+                    table.exprs[k] = number
+                table.assign(ins.lhs, number)
+            else:
+                # user calls are barriers, nothing computed before one is reused after it
+                if rhs.target is not None:
+                    table.clear()
+                table.assign(ins.lhs, table.fresh())
+
+
+def number_values(code: List[Instruction]) -> List[Instruction]:
+    """
+    Local value numbering: a computation repeating an operator on values an earlier one in
+    the same block already combined reads the earlier result instead. A block with a single
+    predecessor earlier in the code continues the table of that predecessor, so a condition
+    tested again in a nested if is reused too. Expects enumerated code, rewrites it in place
+    """
+    cfg = buildCFG(code)
+    preds = [[] for _ in cfg]
+    for block, succs in zip(cfg, localEdges(cfg)):
+        for succ in succs:
+            preds[succ.id].append(block)
+    singles = [preds[block.id][0] if len(preds[block.id]) == 1 and preds[block.id][0].id < block.id else None
+               for block in cfg]
+    # later blocks still to continue the table of each block, the last one takes the table itself
+    # and the others copy it, so a chain of blocks grows one table instead of a copy per block
+    waiting = defaultdict(int)
+    for single in singles:
+        if single is not None:
+            waiting[single.id] += 1
+    outs = dict()
+    for block, single in zip(cfg, singles):
+        if single is None:
+            table = ValueTable()
+        elif waiting[single.id] > 1:
+            waiting[single.id] -= 1
+            table = outs[single.id].copy()
+        else:
+            table = outs.pop(single.id)
+        number_block(block.instructions, table)
+        if waiting[block.id]:
+            outs[block.id] = table
+    for ins in code:
+        ins.__dict__.pop("block", None)
+    return code
@@ -0,0 +1,24 @@
+from .IR import Instruction
+from .folding import fold_constants
+from .numbering import number_values
+from .loops import hoist_invariants
+from .copies import eliminate_copies
+
+from typing import Callable, Dict, Iterable, List
+
+
+# TAC to TAC passes in the order they run, every one can be switched off by name
+PASSES: Dict[str, Callable[[List[Instruction]], List[Instruction]]] = {
+    "fold": fold_constants,
+    "lvn": number_values,
+    "licm": hoist_invariants,
+    "copies": eliminate_copies,
+}
+
+
+def optimize(tac: List[Instruction], passes: Iterable[str] = tuple(PASSES)) -> List[Instruction]:
+    passes = set(passes)
+    for name, run in PASSES.items():
+        if name in passes:
+            tac = run(tac)
+    return tac
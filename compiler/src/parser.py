@@ -1,4 +1,6 @@
-from .lexer import Token
+from typing import Iterable
+
+from .lexer import *
 from .ast import *
 
 
@@ -10,31 +12,91 @@ class ParsingError(Exception):
         return f'Unexpected symbol at ({self.token.line}, {self.token.pos}) with value: {self.token.value}'
 
 
+STATEMENT_KINDS = frozenset([IF, WHILE, RETURN, BREAK, FUNCTION, ID])
+LITERAL_KINDS = frozenset([BOOLEAN, NUMBER, STRING])
+RETURN_VALUE_KINDS = frozenset([PLUS, MINUS, NOT, LPAREN, NIL, ID, BOOLEAN, NUMBER, STRING])
+
+PARSERS = ["pratt", "descent"]
+
+# binding power of every binary operator kind, 0 ends an expression
+BINARY_PRECEDENCE = [0] * len(kindTags)
+for precedence, kinds in enumerate([[OR], [AND], [EQ, NEQ], [LESS, LESSEQ, GREATER, GREATEREQ],
+                                    [PLUS, MINUS], [MUL, DIV, DIVREM]], 1):
+    for kind in kinds:
+        BINARY_PRECEDENCE[kind] = precedence
+
+
 class Parser:
-    def __init__(self, tokens: List[Token]) -> None:
-        self.tokens = tokens
-        self.tokens.append(Token("EOF", tokens[-1].line, tokens[-1].pos + 1, "EOF"))
-        self.pos = 0
+    def __init__(self, buffers: Iterable[TokenBuffer], mode: str = "pratt") -> None:
+        """
+        buffers is pulled from only as far as the grammar needs to look ahead.
+        The pratt mode parses expressions by precedence climbing and creates nodes only for operators,
+        the descent mode builds one node per precedence level
+        """
+        if mode not in PARSERS:
+            raise ValueError(f"Unknown parser: {mode}")
+        self.mode = mode
+        self.buffers = iter(buffers)
+        self.following = None
+        self.__switch(self.__fetch())
     
 
-    def __next(self) -> Token:
-        cur =  self.tokens[self.pos] 
-        self.pos += 1
-        return cur
+    def __fetch(self) -> TokenBuffer:
+        for buffer in self.buffers:
+            if len(buffer):
+                return buffer
+        return None
+
+
+    def __switch(self, buffer: TokenBuffer) -> None:
+        self.buffer = buffer
+        self.kinds = buffer.kinds
+        self.count = len(buffer)
+        self.i = 0
+
+
+    def __kind(self) -> int:
+        return self.kinds[self.i]
+
+
+    def __peekKind(self) -> int:
+        if self.i + 1 < self.count:
+            return self.kinds[self.i + 1]
+        if self.following is None:
+            self.following = self.__fetch()
+            if self.following is None:
+                return EOF
+        return self.following.kinds[0]
 
 
-    def __lookup(self) -> Token:
-        return self.tokens[self.pos]
+    def __token(self) -> Token:
+        return self.buffer.token(self.i)
 
 
-    def __consume(self, symbol: str) -> None:
-        cur = self.tokens[self.pos]
-        if cur.value != symbol:
-            raise ParsingError(cur)
-        self.pos += 1
+    def __next(self) -> str:
+        value = self.buffer.value(self.i)
+        self.__advance()
+        return value
+
+
+    def __advance(self) -> None:
+        if self.i + 1 < self.count:
+            self.i += 1
+            return
+        buffer = self.following or self.__fetch()
+        self.following = None
+        # the stream ends with EOF, the parser stays on it
+        if buffer is not None:
+            self.__switch(buffer)
+
+
+    def __consume(self, kind: int) -> None:
+        if self.kinds[self.i] != kind:
+            raise ParsingError(self.__token())
+        self.__advance()
 
     def __isEOF(self):
-        return self.pos == len(self.tokens) - 1
+        return self.kinds[self.i] == EOF
     
 
     def parse(self) -> Program:
@@ -43,51 +105,78 @@ class Parser:
 
     def __program(self):
         statements = self.__statementList()
-        self.__consume("EOF")
+        self.__consume(EOF)
         return Program(statements=statements)
 
     def __statementList(self):
         statements = []
-        while self.__lookup().value in ["if", "while", "return", "break", "function"] or self.__lookup().tag == "id":
+        while self.__kind() in STATEMENT_KINDS:
             statements.append(self.__statement()) 
         return StatementList(statements)
 
     def __statement(self):
-        cur = self.__lookup()
-        if cur.value == "if":
+        kind = self.__kind()
+        if kind == IF:
             return self.__ifStatement()
-        elif cur.value == "while":
+        elif kind == WHILE:
             return self.__whileStatement()
-        elif cur.value == "return":
+        elif kind == RETURN:
             return self.__reutrnStatement()
-        elif cur.value == "break":
+        elif kind == BREAK:
             return self.__breakStatement()
-        elif cur.value == "function":
+        elif kind == FUNCTION:
             return self.__declaration()
-        elif  cur.tag == "id":
-            if self.tokens[self.pos + 1].value == "(":
+        elif kind == ID:
+            if self.__peekKind() == LPAREN:
                 return self.__callExpr()
             return self.__declaration()
         else:
-            raise ParsingError(token=cur)
+            raise ParsingError(token=self.__token())
 
 
     def __expr(self):
+        if self.mode == "pratt":
+            return self.__binaryExpr(1)
         return self.__orExpr()
 
 
+    def __binaryExpr(self, minPrecedence: int):
+        left = self.__prefixExpr()
+        while True:
+            precedence = BINARY_PRECEDENCE[self.__kind()]
+            if precedence < minPrecedence:
+                return left
+            op = self.__next()
+            left = BinaryExpr(op, left, self.__binaryExpr(precedence + 1))
+
+
+    def __prefixExpr(self):
+        ops = []
+        while self.__kind() in (PLUS, MINUS, NOT):
+            ops.append(self.__next())
+        if self.__kind() == LPAREN:
+            self.__advance()
+            value = self.__expr()
+            self.__consume(RPAREN)
+        else:
+            value = self.__valueExpr()
+        if ops:
+            return UnaryExpr(value, ops)
+        return value
+
+
     def __orExpr(self):
         andExprs = [self.__andExpr()]
-        while self.__lookup().value == "or":
-            self.__next()
+        while self.__kind() == OR:
+            self.__advance()
             andExprs.append(self.__andExpr())
         return OrExpr(andExprs)
 
 
     def __andExpr(self):
         eqExprs = [self.__eqExpr()]
-        while self.__lookup().value == "and":
-            self.__next()
+        while self.__kind() == AND:
+            self.__advance()
             eqExprs.append(self.__eqExpr())
         return AndExpr(eqExprs)
 
@@ -95,8 +184,8 @@ class Parser:
     def __eqExpr(self):
         cmpExprs = [self.__cmpExpr()]
         ops = []
-        while self.__lookup().value in ["==", "~="]:
-            ops.append(self.__next().value)
+        while self.__kind() in (EQ, NEQ):
+            ops.append(self.__next())
             cmpExprs.append(self.__cmpExpr())
         return EqExpr(cmpExprs, ops)
 
@@ -104,8 +193,8 @@ class Parser:
     def __cmpExpr(self):
         addExprs = [self.__addExpr()]
         ops = []
-        while self.__lookup().value in ["<", "<=", ">", ">="]:
-            ops.append(self.__next().value)
+        while self.__kind() in (LESS, LESSEQ, GREATER, GREATEREQ):
+            ops.append(self.__next())
             addExprs.append(self.__addExpr())
         return CmpExpr(addExprs, ops)
 
@@ -113,8 +202,8 @@ class Parser:
     def __addExpr(self):
         mulExprs = [self.__mulExpr()]
         ops = []
-        while self.__lookup().value in ["+", "-"]:
-            ops.append(self.__next().value)
+        while self.__kind() in (PLUS, MINUS):
+            ops.append(self.__next())
             mulExprs.append(self.__mulExpr())
         return AddExpr(mulExprs, ops)
 
@@ -122,138 +211,138 @@ class Parser:
     def __mulExpr(self):
         unaryExprs = [self.__unaryExpr()]
         ops = []
-        while self.__lookup().value in ["*", "/", "%"]:
-            ops.append(self.__next().value)
+        while self.__kind() in (MUL, DIV, DIVREM):
+            ops.append(self.__next())
             unaryExprs.append(self.__unaryExpr())
         return MulExpr(unaryExprs, ops)
 
 
     def __unaryExpr(self):
         ops = []
-        while self.__lookup().value in ["+", "-", "not"]:
-            ops.append(self.__next().value)
+        while self.__kind() in (PLUS, MINUS, NOT):
+            ops.append(self.__next())
         valueExpr = self.__valueExpr()
         return UnaryExpr(valueExpr, ops)
 
 
     def __valueExpr(self):
-        cur = self.__lookup()
-        if cur.tag == "id":
-            if self.tokens[self.pos + 1].value == "(":
+        kind = self.__kind()
+        if kind == ID:
+            if self.__peekKind() == LPAREN:
                 return ValueExpr(self.__callExpr(), type="call")
             else:
-                return ValueExpr(self.__next().value, type="id")
-        elif cur.tag in ["boolean", "number", "string"] or cur.value == "nil":
+                return ValueExpr(self.__next(), type="id")
+        elif kind in LITERAL_KINDS or kind == NIL:
             return ValueExpr(self.__value(), "value")
-        elif cur.value == "(":
-            self.__consume("(")
+        elif kind == LPAREN:
+            self.__consume(LPAREN)
             value = self.__expr()
-            self.__consume(")")
+            self.__consume(RPAREN)
             return ValueExpr(value, type="expr")
         else:
-            raise ParsingError(token=cur)
+            raise ParsingError(token=self.__token())
 
 
     def __value(self):
-        cur = self.__lookup()
-        if cur.tag in ["boolean", "number", "string"]:
-            return Value(self.__next().value, cur.tag)
-        elif cur.value == "nil":
-            return Value(self.__next().value, cur.value)
+        kind = self.__kind()
+        if kind in LITERAL_KINDS:
+            return Value(self.__next(), kindTags[kind])
+        elif kind == NIL:
+            return Value(self.__next(), "nil")
         else:
-            raise ParsingError(token=cur)
+            raise ParsingError(token=self.__token())
 
 
     def __callExpr(self):
-        if self.__lookup().tag != "id":
-            raise ParsingError(token=self.__lookup())
-        name = self.__next().value
-        self.__consume("(")
+        if self.__kind() != ID:
+            raise ParsingError(token=self.__token())
+        name = self.__next()
+        self.__consume(LPAREN)
         args = []
-        if self.__lookup().value != ")":
+        if self.__kind() != RPAREN:
             args.append(self.__expr())
-            while self.__lookup().value != ")" and not self.__isEOF():
-                self.__consume(",")
+            while self.__kind() != RPAREN and not self.__isEOF():
+                self.__consume(COMMA)
                 args.append(self.__expr())
-        self.__consume(")")
+        self.__consume(RPAREN)
         return CallExpr(name, args)
  
 
     def __ifStatement(self):
-        self.__consume("if")
+        self.__consume(IF)
         cond = self.__expr()
         thenBr = None
         elseBr = StatementList([])
-        self.__consume("then")        
+        self.__consume(THEN)        
         thenBr = self.__statementList()
-        if self.__lookup().value != "end":
-            self.__consume("else")
+        if self.__kind() != END:
+            self.__consume(ELSE)
             elseBr = self.__statementList()
-        self.__consume("end")
+        self.__consume(END)
         return IfStatement(cond, thenBr, elseBr)
 
 
     def __whileStatement(self):
-        self.__consume("while")
+        self.__consume(WHILE)
         cond = self.__expr()
-        self.__consume("do")
+        self.__consume(DO)
         statements = self.__statementList()
-        self.__consume("end")
+        self.__consume(END)
         return WhileStatement(cond, statements)
 
 
     def __reutrnStatement(self):
         result = None
-        self.__consume("return")
-        cur = self.__lookup()
-        if cur.value in ["+", "-", "not", "(", "nil"] or cur.tag in ["id", "boolean", "number", "string"]:
-            if cur.tag != "id": 
+        self.__consume(RETURN)
+        kind = self.__kind()
+        if kind in RETURN_VALUE_KINDS:
+            if kind != ID: 
                 result = self.__expr()
-            elif cur.tag == "id" and self.tokens[self.pos + 1].value != "=":
+            elif self.__peekKind() != ASSIGN:
                 result = self.__expr()
         return ReturnStatement(result)
 
 
     def __breakStatement(self):
-        self.__consume("break")
+        self.__consume(BREAK)
         return BreakStatement()
 
 
     def __declaration(self):
-        if self.__lookup().value == "function":
+        if self.__kind() == FUNCTION:
             return self.__functionDeclaration()
         else:
             return self.__varDeclaration()
 
 
     def __varDeclaration(self):
-        if self.__lookup().tag != "id":
-            raise ParsingError(self.__lookup())
-        name = self.__next().value
-        self.__consume("=")
+        if self.__kind() != ID:
+            raise ParsingError(self.__token())
+        name = self.__next()
+        self.__consume(ASSIGN)
         value = self.__expr()
         return VarDeclaration(name, value)
 
 
 
     def __functionDeclaration(self):
-        self.__consume("function")
-        if self.__lookup().tag != "id":
-            raise ParsingError(self.__lookup())
-        name = self.__next().value
+        self.__consume(FUNCTION)
+        if self.__kind() != ID:
+            raise ParsingError(self.__token())
+        name = self.__next()
         args = []
-        self.__consume("(")
-        if self.__lookup().value != ")":
-            if self.__lookup().tag != "id":
-                raise ParsingError(self.__lookup())
-            args.append(self.__next().value)
-            while self.__lookup().value != ")":
-                self.__consume(",")
-                if self.__lookup().tag != "id":
-                    raise ParsingError(self.__lookup())
-                args.append(self.__next().value)
-        self.__consume(")")
+        self.__consume(LPAREN)
+        if self.__kind() != RPAREN:
+            if self.__kind() != ID:
+                raise ParsingError(self.__token())
+            args.append(self.__next())
+            while self.__kind() != RPAREN:
+                self.__consume(COMMA)
+                if self.__kind() != ID:
+                    raise ParsingError(self.__token())
+                args.append(self.__next())
+        self.__consume(RPAREN)
         body = self.__statementList()
         body.statements.append(ReturnStatement(None))
-        self.__consume("end")
+        self.__consume(END)
         return FunctionDeclaration(name, args, body)
\ No newline at end of file
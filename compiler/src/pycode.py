@@ -0,0 +1,531 @@
+import hashlib
+import marshal
+import sys
+
+from .IR import *
+from .bytecode import determine
+from .folding import call_arguments
+from .liveness import is_temporary, live_temporaries
+from .loops import InvariantHoister, literal_types, result, NUMBER, STRING, BOOLEAN, NIL, ANY
+from .graph_utils import naturalLoops
+from .values import parse_literal
+from .cache import CompileCache
+
+from typing import Dict, List, Optional, Set
+
+
+# Python source translation of TAC. Every function becomes a Python function and the top level
+# becomes main, the variables of a frame become Python locals. Control flow is rebuilt from the
+# natural loops and the dominator tree of every function: a loop is a `while True` left by `break`,
+# a branch is an `if` whose arms run on until the block where they meet again, the child of the
+# branch in the dominator tree with more than one way in. A function whose flow does not fit runs
+# its blocks from a dispatch loop instead.
+# The module runs against a runtime that provides the coercions of the VMs as _number, _truth
+# and _add, and every builtin called with n arguments as _b_<name>_<n>. Operands whose types the
+# forward analysis of loops.py knows to be numbers skip the coercions
+MAGIC = b"# sublua python module\n"
+
+INDENT = "    "
+
+
+def is_python_module(module) -> bool:
+    return bytes(module[:len(MAGIC)]) == MAGIC
+
+
+def load(module, cache: CompileCache = None):
+    """
+    The code object of a module written by tac2python. With a cache, the code object is kept
+    for the running Python version so that a module seen before skips the Python compiler
+    """
+    if cache is None:
+        return compile(bytes(module).decode(), "<sublua>", "exec")
+    digest = hashlib.sha256(sys.version.encode())
+    digest.update(module)
+    key = digest.hexdigest()
+    code = cache.get(key)
+    if code is not None:
+        return marshal.loads(code)
+    code = compile(bytes(module).decode(), "<sublua>", "exec")
+    cache.put(key, marshal.dumps(code))
+    return code
+
+
+def builtin_name(name: str, argc: int) -> str:
+    return f"_b_{name}_{argc}"
+
+
+class Loop:
+    def __init__(self, header: int, body: Set[int]) -> None:
+        self.header = header
+        self.body = body
+        # the block the loop falls out to, None when every way out leaves the frame
+        self.follow: Optional[int] = None
+        # the blocks after an exit that only the loop leads to, they run inside it
+        self.leaves: Set[int] = set()
+        # more than one exit goes on with the frame, which does not map onto while
+        self.tangled = False
+
+
+class Unstructured(Exception):
+    """The control flow of a function does not map onto while and if"""
+
+
+def immediate_dominators(root: int, succs: Dict[int, List[int]]) -> Dict[int, int]:
+    """Cooper, Harvey and Kennedy over an explicit graph, nodes root does not reach are left out"""
+    order = []
+    visited = {root}
+    stack = [(root, iter(succs[root]))]
+    while stack:
+        node, rest = stack[-1]
+        for succ in rest:
+            if succ not in visited:
+                visited.add(succ)
+                stack.append((succ, iter(succs[succ])))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+    position = {node: i for i, node in enumerate(order)}
+    preds = {node: [] for node in order}
+    for node in order:
+        for succ in succs[node]:
+            preds[succ].append(node)
+
+    idom = {root: root}
+    changed = True
+    while changed:
+        changed = False
+        for node in reversed(order):
+            if node == root:
+                continue
+            new = None
+            for pred in preds[node]:
+                if pred not in idom:
+                    continue
+                if new is None:
+                    new = pred
+                    continue
+                a, b = pred, new
+                while a != b:
+                    while position[a] < position[b]:
+                        a = idom[a]
+                    while position[b] < position[a]:
+                        b = idom[b]
+                new = a
+            if idom.get(node) != new:
+                idom[node] = new
+                changed = True
+    return idom
+
+
+class PythonWriter:
+    def __init__(self, code: List[Instruction]) -> None:
+        self.code = code
+        # the type analysis of invariant code motion tells which operands are always numbers
+        hoister = InvariantHoister(code)
+        hoister.infer()
+        self.cfg = hoister.cfg
+        self.edges = hoister.edges
+        self.types = hoister.types
+        self.arguments = call_arguments(code)
+        owners = function_owners(code)
+        # the blocks of every function, -1 for the top level
+        self.blocks: Dict[int, List[int]] = dict()
+        for block in self.cfg:
+            self.blocks.setdefault(owners[block.instructions[0].id], []).append(block.id)
+        self.live = live_temporaries(code)
+        # temporaries assigned once, by the instruction that defines them
+        self.definitions = {ins.lhs: ins for ins in code if type(ins) == AssignmentInstruction
+                            and is_temporary(ins.lhs) and hoister.assignments[ins.lhs] == 1}
+        self.preds: Dict[int, List[int]] = {block.id: [] for block in self.cfg}
+        for block, succs in enumerate(self.edges):
+            for succ in succs:
+                self.preds[succ.id].append(block)
+        self.loops: Dict[int, Loop] = dict()
+        # the innermost loop of every block inside one
+        self.innermost: Dict[int, Loop] = dict()
+        for header, body in naturalLoops(self.cfg, self.edges):
+            loop = Loop(header, body)
+            self.find_exits(loop)
+            self.loops[header] = loop
+            for block in body:
+                self.innermost.setdefault(block, loop)
+        self.functions = {ins.id: f"f_{ins.name}_{ins.id}" for ins in code if type(ins) == FunctionInstruction}
+        self.builtins = set()
+
+    def skip(self, block: int) -> int:
+        """The block control ends up in from block through blocks that only jump"""
+        while len(self.cfg[block].instructions) == 1 and type(self.cfg[block].instructions[0]) == GotoInstruction:
+            block = self.cfg[block].instructions[0].target.block.id
+        return block
+
+    def find_exits(self, loop: Loop) -> None:
+        """
+        An exit whose blocks are only entered from the loop is written inside it, as the arm
+        of a branch that never comes back. The one other exit, if any, is what the loop falls out to
+        """
+        jumps = set()
+        exits = set()
+        for block in loop.body:
+            for succ in self.edges[block]:
+                if succ.id not in loop.body:
+                    exits.add(self.skip(succ.id))
+                    while self.skip(succ.id) != succ.id:
+                        jumps.add(succ.id)
+                        succ = self.cfg[succ.id].instructions[0].target.block
+        if len(exits) == 1:
+            loop.follow = exits.pop()
+            return
+        follows = []
+        leaves = dict()
+        for exit in exits:
+            reached = {exit}
+            stack = [exit]
+            while stack:
+                for succ in self.edges[stack.pop()]:
+                    if succ.id not in reached:
+                        reached.add(succ.id)
+                        stack.append(succ.id)
+            inside = loop.body | jumps | reached
+            if reached & loop.body or any(pred not in inside for block in reached for pred in self.preds[block]):
+                follows.append(exit)
+            else:
+                leaves[exit] = reached
+        if not follows and leaves:
+            # the frame goes on after the loop with the longest of the exits only it leads to
+            follows.append(max(leaves, key=lambda exit: (len(leaves[exit]), exit)))
+            del leaves[follows[0]]
+        loop.tangled = len(follows) > 1
+        if len(follows) == 1:
+            loop.follow = follows[0]
+        for reached in leaves.values():
+            loop.leaves |= reached
+
+    def translate(self) -> str:
+        lines = []
+        for ins in self.code:
+            if type(ins) == FunctionInstruction:
+                lines.extend(self.function(ins))
+                lines.append("")
+        lines.extend(self.function(None))
+        header = [MAGIC.decode().rstrip(), f"BUILTINS = {sorted(self.builtins)!r}", ""]
+        for ins in self.code:
+            ins.__dict__.pop("block", None)
+        return "\n".join(header + lines) + "\n"
+
+    # operands and expressions
+
+    def value(self, value: str) -> str:
+        kind = determine(value)
+        if kind == "str":
+            return repr(value[1: -1])
+        elif kind == "id":
+            # a name this frame never assigns is always nil
+            return self.names.get(value, "None")
+        return repr(parse_literal(value))
+
+    def operand_types(self, ins: Instruction, i: int):
+        args = self.types.get(ins.id)
+        return args[i] if args else ANY
+
+    def number(self, ins: Instruction, i: int, value: str) -> str:
+        if self.operand_types(ins, i) <= NUMBER:
+            return self.value(value)
+        return f"_number({self.value(value)})"
+
+    def truth(self, value: str, types) -> str:
+        # value2bool only differs from Python truthiness on numbers and strings
+        if types <= BOOLEAN | NIL:
+            return self.value(value)
+        return f"_truth({self.value(value)})"
+
+    def condition(self, value: str):
+        """Types a branch condition, known for literals and for temporaries assigned once"""
+        if determine(value) != "id":
+            return literal_types(value)
+        ins = self.definitions.get(value)
+        if ins is None or ins.id not in self.types:
+            return ANY
+        return result(ins.rhs, self.types[ins.id])
+
+    def expression(self, ins: AssignmentInstruction) -> str:
+        rhs = ins.rhs
+        t = type(rhs)
+        if t == SingleValue:
+            return self.value(rhs.value)
+        elif t == UnaryOpValue:
+            if rhs.op == "not":
+                return f"not {self.truth(rhs.value, self.operand_types(ins, 0))}"
+            value = self.number(ins, 0, rhs.value)
+            return value if rhs.op == "+" else f"-{value}"
+        elif t == BinaryOpValue:
+            op = rhs.op
+            if op in ["or", "and"]:
+                return f"{self.value(rhs.value1)} {op} {self.value(rhs.value2)}"
+            elif op in ["==", "~="]:
+                return f"{self.value(rhs.value1)} {'==' if op == '==' else '!='} {self.value(rhs.value2)}"
+            elif op == "+":
+                types1, types2 = self.operand_types(ins, 0), self.operand_types(ins, 1)
+                if (types1 <= NUMBER and types2 <= NUMBER) or (types1 <= STRING and types2 <= STRING):
+                    return f"{self.value(rhs.value1)} + {self.value(rhs.value2)}"
+                return f"_add({self.value(rhs.value1)}, {self.value(rhs.value2)})"
+            return f"{self.number(ins, 0, rhs.value1)} {op} {self.number(ins, 1, rhs.value2)}"
+        return self.call(ins, rhs)
+
+    def args(self, ins: Instruction) -> List[str]:
+        return [f"p{param}" if param in self.captured else self.value(self.code[param].value.value)
+                for param in self.arguments[ins.id]]
+
+    def call(self, ins: Instruction, call: CallInstruction) -> str:
+        args = self.args(ins)
+        if call.target is None:
+            self.builtins.add((call.name, call.argc))
+            return f"{builtin_name(call.name, call.argc)}({', '.join(args)})"
+        return f"{self.functions[call.target.id]}({', '.join(args)})"
+
+    # statements
+
+    def statement(self, ins: Instruction) -> List[str]:
+        t = type(ins)
+        if t == AssignmentInstruction:
+            return [f"{self.names[ins.lhs]} = {self.expression(ins)}"]
+        elif t == CallInstruction:
+            return [self.call(ins, ins)]
+        elif t == ParameterInstruction and ins.id in self.captured:
+            return [f"p{ins.id} = {self.value(ins.value.value)}"]
+        elif t == ReturnInstruction and self.owner < 0:
+            # the top level prints what it returns
+            return [f"print({self.value(ins.value.value)})", "return"]
+        elif t == ReturnInstruction:
+            return [f"return {self.value(ins.value.value)}"]
+        elif t == EndInstruction:
+            return ["return"]
+        return []
+
+    def frame(self, params: List[str], blocks: List[int]) -> None:
+        """Names the variables of the frame and finds the parameters to keep until their call"""
+        names = dict()
+        for name in params:
+            names[name] = f"v_{name}"
+        for block in blocks:
+            for ins in self.cfg[block].instructions:
+                if type(ins) == AssignmentInstruction and ins.lhs not in names:
+                    names[ins.lhs] = f"t{ins.lhs[2:]}" if is_temporary(ins.lhs) else f"v_{ins.lhs}"
+        self.names = names
+        # arguments are read when the call runs, unless their variable changes before that
+        self.captured = set()
+        for block in blocks:
+            for ins in self.cfg[block].instructions:
+                for param in self.arguments.get(ins.id, []):
+                    value = self.code[param].value.value
+                    if any(type(other) == AssignmentInstruction and other.lhs == value
+                           for other in self.code[param + 1: ins.id]):
+                        self.captured.add(param)
+
+    def function(self, fn: Optional[FunctionInstruction]) -> List[str]:
+        self.owner = fn.id if fn else -1
+        entry = fn.block.id if fn else 0
+        blocks = self.blocks.get(self.owner, [])
+        params = fn.args if fn else []
+        self.frame(params, blocks)
+        first = fn.id if fn else 0
+        # every variable of a fresh frame holds nil, temporaries are assigned before they are read
+        fresh = [python for name, python in self.names.items()
+                 if name not in params and (not is_temporary(name) or name in self.live[first])]
+        reset = [" = ".join(fresh) + " = None"] if fresh else []
+        name = self.functions[fn.id] if fn else "main"
+        lines = [f"def {name}({', '.join(self.names[param] for param in params)}):"]
+        self.tail = None
+        if fn and any(self.self_tail_call(ins, fn) for ins in fn_instructions(self.cfg, blocks)):
+            # a call of the function to itself as its last act starts the frame over
+            self.tail = (fn, reset)
+        try:
+            self.emitted = set()
+            body = self.structured(entry, blocks)
+            if self.tail:
+                body = ["while True:"] + indent(reset + body)
+            else:
+                body = reset + body
+        except Unstructured:
+            self.tail = None
+            body = reset + self.dispatch(entry, blocks)
+        return lines + indent(body or ["pass"])
+
+    def self_tail_call(self, ins: Instruction, fn: FunctionInstruction) -> bool:
+        # inside a loop the continue would restart the loop instead of the function
+        return (is_tail_call(self.code, ins) and ins.rhs.target.id == fn.id
+                and ins.block.id not in self.innermost)
+
+    # structured control flow
+
+    def structured(self, entry: int, blocks: List[int]) -> List[str]:
+        self.merges = dict()
+        self.find_merges(entry, set(blocks), None)
+        for header in blocks:
+            loop = self.loops.get(header)
+            if loop is not None:
+                if loop.tangled:
+                    raise Unstructured()
+                self.find_merges(header, loop.body, loop)
+        return self.sequence(entry, None, None)
+
+    def find_merges(self, root: int, region: Set[int], loop: Optional[Loop]) -> None:
+        """
+        The block after the if of every branch whose innermost loop is loop. Within the region,
+        without the edges back to the header of loop and out of it, that is the child of the
+        branch in the dominator tree entered from more than one block, not counting back edges.
+        A branch without one ends where its arms leave, an arm that reaches the block after an
+        enclosing if falls through to it
+        """
+        succs = {block: [succ.id for succ in self.edges[block]
+                         if succ.id in region and not (loop and succ.id == loop.header)] for block in region}
+        idom = immediate_dominators(root, succs)
+        entries = dict.fromkeys(region, 0)
+        for block, targets in succs.items():
+            for target in targets:
+                inner = self.loops.get(target)
+                if inner is None or block not in inner.body:
+                    entries[target] += 1
+        merges = dict()
+        for block, parent in idom.items():
+            if block != root and entries[block] > 1:
+                merges.setdefault(parent, []).append(block)
+        for block in region:
+            if self.innermost.get(block) is loop and type(self.cfg[block].instructions[-1]) == IfGotoInstruction:
+                children = merges.get(block, [])
+                if len(children) > 1:
+                    raise Unstructured()
+                self.merges[block] = children[0] if children else None
+
+    def sequence(self, block: Optional[int], stop: Optional[int], loop: Optional[Loop]) -> List[str]:
+        """The blocks from block on until control reaches stop, inside loop"""
+        lines = []
+        while block is not None and block != stop:
+            if loop is not None and block == loop.header:
+                lines.append("continue")
+                return lines
+            elif loop is not None and block not in loop.body and self.skip(block) == loop.follow:
+                lines.append("break")
+                return lines
+            elif loop is not None and block not in loop.body and self.skip(block) not in loop.leaves:
+                raise Unstructured()
+            inner = self.loops.get(block)
+            if inner is not None:
+                lines.extend(self.loop(inner))
+                block = inner.follow
+            else:
+                block = self.block(block, stop, loop, lines)
+        return lines
+
+    def loop(self, loop: Loop) -> List[str]:
+        body = []
+        body.extend(self.sequence(self.block(loop.header, None, loop, body), None, loop))
+        if body and body[-1] == "continue":
+            body.pop()
+        return ["while True:"] + indent(body or ["pass"])
+
+    def block(self, block: int, stop: Optional[int], loop: Optional[Loop], lines: List[str]) -> Optional[int]:
+        """
+        Writes the block and returns the block control continues with, None when it leaves
+        the frame or falls through to stop
+        """
+        if block in self.emitted:
+            raise Unstructured()
+        self.emitted.add(block)
+        instructions = self.cfg[block].instructions
+        exit = instructions[-1]
+        t = type(exit)
+        for ins in instructions[:-1]:
+            lines.extend(self.statement(ins))
+        # an exit of a loop written inside it keeps the call, a continue there would restart the loop
+        if self.tail and loop is None and t == AssignmentInstruction and self.self_tail_call(exit, self.tail[0]):
+            fn, reset = self.tail
+            if fn.args:
+                lines.append(f"{', '.join(self.names[param] for param in fn.args)} = {', '.join(self.args(exit))}")
+            lines.extend(reset)
+            lines.append("continue")
+            return None
+        if t == GotoInstruction:
+            return exit.target.block.id
+        elif t == IfGotoInstruction:
+            merge = self.merges[block]
+            end = stop if merge is None else merge
+            taken = self.sequence(exit.target.block.id, end, loop)
+            fallen = self.sequence(block + 1, end, loop)
+            cond = self.truth(exit.cond.value, self.condition(exit.cond.value))
+            if leaves(taken) and leaves(fallen) and len(fallen) < len(taken):
+                lines.append(f"if not {cond}:")
+                lines.extend(indent(fallen))
+                lines.extend(taken)
+            elif fallen and leaves(taken):
+                # the other arm needs no else when this one never falls through
+                lines.append(f"if {cond}:")
+                lines.extend(indent(taken))
+                lines.extend(fallen)
+            elif taken and leaves(fallen):
+                lines.append(f"if not {cond}:")
+                lines.extend(indent(fallen))
+                lines.extend(taken)
+            elif taken and fallen:
+                lines.append(f"if {cond}:")
+                lines.extend(indent(taken))
+                lines.append("else:")
+                lines.extend(indent(fallen))
+            elif taken:
+                lines.append(f"if {cond}:")
+                lines.extend(indent(taken))
+            elif fallen:
+                lines.append(f"if not {cond}:")
+                lines.extend(indent(fallen))
+            return merge
+        lines.extend(self.statement(exit))
+        if t in [ReturnInstruction, EndInstruction]:
+            return None
+        return block + 1
+
+    # unstructured control flow
+
+    def dispatch(self, entry: int, blocks: List[int]) -> List[str]:
+        """Every block as a case of a loop over the number of the next block"""
+        lines = [f"block = {entry}", "while True:"]
+        cases = []
+        for i, block in enumerate(blocks):
+            instructions = self.cfg[block].instructions
+            exit = instructions[-1]
+            t = type(exit)
+            case = []
+            for ins in instructions[:-1]:
+                case.extend(self.statement(ins))
+            if t == GotoInstruction:
+                case.append(f"block = {exit.target.block.id}")
+            elif t == IfGotoInstruction:
+                cond = self.truth(exit.cond.value, self.condition(exit.cond.value))
+                case.append(f"block = {exit.target.block.id} if {cond} else {block + 1}")
+            else:
+                case.extend(self.statement(exit))
+                if t not in [ReturnInstruction, EndInstruction]:
+                    case.append(f"block = {block + 1}")
+            cases.append(f"{'if' if i == 0 else 'elif'} block == {block}:")
+            cases.extend(indent(case))
+        return lines + indent(cases)
+
+
+def fn_instructions(cfg: list, blocks: List[int]) -> List[Instruction]:
+    return [ins for block in blocks for ins in cfg[block].instructions]
+
+
+def leaves(lines: List[str]) -> bool:
+    """Whether control never runs past the end of lines"""
+    return bool(lines) and (lines[-1] in ["break", "continue", "return"] or lines[-1].startswith("return "))
+
+
+def indent(lines: List[str]) -> List[str]:
+    return [INDENT + line for line in lines]
+
+
+def tac2python(tac: List[Instruction]) -> str:
+    """
+    Translates enumerated TAC into the source of a Python module defining main and one function
+    per TAC function, see MAGIC for the runtime it expects
+    """
+    return PythonWriter(tac).translate()
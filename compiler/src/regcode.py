@@ -0,0 +1,191 @@
+from .IR import *
+from .bytecode import determine, assign_slots, frame_size
+from .values import parse_literal
+from .binary import ConstantPool, write_module, KIND_REGISTER
+
+from typing import Dict, List
+
+
+# Register machine opcodes. Operands are register indices (>= 0)
+# or constants encoded as -(index + 1) into the program constant pool
+MOVE = 0
+UPLUS = 1
+UMINUS = 2
+UNOT = 3
+OR = 4
+AND = 5
+EQ = 6
+NEQ = 7
+LESS = 8
+LESSEQ = 9
+GREATER = 10
+GREATEREQ = 11
+ADD = 12
+SUB = 13
+MUL = 14
+DIV = 15
+DIVREM = 16
+PARAM = 17
+CALL = 18
+CALLB = 19
+RET = 20
+JMP = 21
+CJMP = 22
+ENTER = 23
+HALT = 24
+TAILCALL = 25
+
+regOpNames = [
+    "MOVE", "UPLUS", "UMINUS", "UNOT",
+    "OR", "AND", "EQ", "NEQ", "LESS", "LESSEQ", "GR", "GREQ",
+    "ADD", "SUB", "MUL", "DIV", "DIVREM",
+    "PARAM", "CALL", "CALLB", "RET", "JMP", "CJMP", "ENTER", "HALT", "TAILCALL"
+]
+
+unOp2reg = {
+    "+": UPLUS,
+    "-": UMINUS,
+    "not": UNOT,
+}
+
+biOp2reg = {
+    "or": OR,
+    "and": AND,
+    "==": EQ,
+    "~=": NEQ,
+    "<": LESS,
+    "<=": LESSEQ,
+    ">": GREATER,
+    ">=": GREATEREQ,
+    "+": ADD,
+    "-": SUB,
+    "*": MUL,
+    "/": DIV,
+    "%": DIVREM,
+}
+
+
+class RegInstruction:
+    def __init__(self, opcode: int, a: int = 0, b: int = 0, c: int = 0) -> None:
+        self.id = -1
+        self.opcode = opcode
+        self.a = a
+        self.b = b
+        self.c = c
+
+    def __str__(self) -> str:
+        def reg(operand: int) -> str:
+            return f"r{operand}" if operand >= 0 else f"k{-operand - 1}"
+
+        op = self.opcode
+        name = regOpNames[op]
+        if op in [MOVE, UPLUS, UMINUS, UNOT]:
+            return f"{self.id}: {name} {reg(self.a)}, {reg(self.b)}"
+        elif OR <= op <= DIVREM:
+            return f"{self.id}: {name} {reg(self.a)}, {reg(self.b)}, {reg(self.c)}"
+        elif op in [PARAM, RET]:
+            return f"{self.id}: {name} {reg(self.a)}"
+        elif op in [CALL, CALLB]:
+            dst = reg(self.a) if self.a >= 0 else "_"
+            return f"{self.id}: {name} {dst}, {self.b if op == CALL else reg(self.b)}, {self.c}"
+        elif op == TAILCALL:
+            return f"{self.id}: {name} {self.b}, {self.c}"
+        elif op == CJMP:
+            return f"{self.id}: {name} {reg(self.a)}, {self.b}"
+        elif op in [JMP, ENTER]:
+            return f"{self.id}: {name} {self.a}"
+        return f"{self.id}: {name}"
+
+
+class RegProgram:
+    def __init__(self) -> None:
+        self.code: List[RegInstruction] = []
+        self.pool = ConstantPool()
+
+    def constant(self, value) -> int:
+        return -self.pool.add(value) - 1
+
+    def __str__(self) -> str:
+        return "\n".join(map(str, self.code))
+
+    def to_binary(self) -> bytearray:
+        records = [(line.opcode, line.a, line.b, line.c) for line in self.code]
+        return write_module(KIND_REGISTER, self.pool, records)
+
+
+def tac2regcode(tac: List[Instruction], share_temps: bool = True) -> RegProgram:
+    """
+    Lowers every TAC instruction into exactly one register instruction.
+    Registers are the frame slots from assign_slots, literals go to the constant pool
+    """
+    owners, slots = assign_slots(tac, share_temps)
+    program = RegProgram()
+    code = program.code
+    mapping = {}
+    toresolve = []
+
+    def operand(regs: Dict[str, int], value: str) -> int:
+        kind = determine(value)
+        if kind == "id":
+            if value in regs:
+                return regs[value]
+            return program.constant(None)
+        elif kind == "str":
+            return program.constant(value[1: -1])
+        return program.constant(parse_literal(value))
+
+    def call(dst: int, rhs: CallInstruction) -> RegInstruction:
+        if rhs.target is None:
+            return RegInstruction(CALLB, dst, program.constant(rhs.name), rhs.argc)
+        line = RegInstruction(CALL, dst, -1, rhs.argc)
+        toresolve.append((line, "b", rhs.target.id))
+        return line
+
+    code.append(RegInstruction(ENTER, frame_size(slots[-1])))
+    for ins in tac:
+        regs = slots[owners[ins.id]]
+        t = type(ins)
+        if t == GotoInstruction:
+            line = RegInstruction(JMP, -1)
+            toresolve.append((line, "a", ins.target.id))
+        elif t == IfGotoInstruction:
+            line = RegInstruction(CJMP, operand(regs, ins.cond.value), -1)
+            toresolve.append((line, "b", ins.target.id))
+        elif t == AssignmentInstruction and owners[ins.id] >= 0 and is_tail_call(tac, ins):
+            # the return after it is never reached, the callee returns to this frame's caller
+            line = RegInstruction(TAILCALL, -1, -1, ins.rhs.argc)
+            toresolve.append((line, "b", ins.rhs.target.id))
+        elif t == AssignmentInstruction:
+            dst = regs[ins.lhs]
+            rhs = ins.rhs
+            rhst = type(rhs)
+            if rhst == SingleValue:
+                line = RegInstruction(MOVE, dst, operand(regs, rhs.value))
+            elif rhst == UnaryOpValue:
+                line = RegInstruction(unOp2reg[rhs.op], dst, operand(regs, rhs.value))
+            elif rhst == BinaryOpValue:
+                line = RegInstruction(biOp2reg[rhs.op], dst, operand(regs, rhs.value1), operand(regs, rhs.value2))
+            else:
+                line = call(dst, rhs)
+        elif t == CallInstruction:
+            line = call(-1, ins)
+        elif t == ParameterInstruction:
+            line = RegInstruction(PARAM, operand(regs, ins.value.value))
+        elif t == ReturnInstruction:
+            line = RegInstruction(RET, operand(regs, ins.value.value))
+        elif t == FunctionInstruction:
+            line = RegInstruction(ENTER, frame_size(regs))
+        elif t == EndInstruction:
+            line = RegInstruction(HALT)
+        else:
+            raise Exception(f"Unsupported instruction: {ins}")
+        mapping[ins.id] = len(code)
+        code.append(line)
+
+    for i, line in enumerate(code):
+        line.id = i
+
+    for line, field, ins_id in toresolve:
+        setattr(line, field, mapping[ins_id])
+
+    return program
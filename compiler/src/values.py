@@ -0,0 +1,116 @@
+import operator
+import re
+
+from typing import Callable, Dict, Union
+
+
+NUMBER = re.compile(r'\d*\.\d+|\d+')
+
+
+def parse_literal(value: str) -> Union[int, float, str, bool, None]:
+    """
+    Types a non-string TAC literal the way the VM sees it:
+    nil, booleans and numbers, with integral numbers stored as int
+    """
+    if value == "nil":
+        return None
+    elif value == "true":
+        return True
+    elif value == "false":
+        return False
+    elif NUMBER.fullmatch(value):
+        number = float(value)
+        if number.is_integer():
+            return int(number)
+        return number
+    return value
+
+
+def format_literal(value: Union[int, float, str, bool, None]) -> str:
+    if value is None:
+        return "nil"
+    elif value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    return str(value)
+
+
+# Coercions and operators exactly as the virtual machines apply them at runtime,
+# shared with the compiler so that folded constants always match execution
+def value2bool(value) -> bool:
+    if type(value) == bool:
+        return value
+    if value is None:
+        return False
+    return True
+
+
+def value2number(value) -> float:
+    if type(value) in [float, int]:
+        return value
+    if type(value) == str:
+        return float(value)
+    raise Exception("Can't cast type to number")
+
+
+def value2string(value) -> str:
+    if value == True:
+        return "true"
+    if value == False:
+        return "false"
+    if value is None:
+        return "nil"
+    return str(value)
+
+
+def tostring(*args) -> str:
+    if not args:
+        return ""
+    return value2string(args[0])
+
+
+def tonumber(*args) -> float:
+    if not args:
+        return 0
+    return value2number(args[0])
+
+
+def add(arg1, arg2):
+    if type(arg1) != str or type(arg2) != str:
+        arg1 = value2number(arg1)
+        arg2 = value2number(arg2)
+    return arg1 + arg2
+
+
+def numeric(fn: Callable) -> Callable:
+    return lambda arg1, arg2: fn(value2number(arg1), value2number(arg2))
+
+
+UNARY_OPS: Dict[str, Callable] = {
+    "+": value2number,
+    "-": lambda arg: -value2number(arg),
+    "not": lambda arg: not value2bool(arg),
+}
+
+BINARY_OPS: Dict[str, Callable] = {
+    "or": lambda arg1, arg2: arg1 or arg2,
+    "and": lambda arg1, arg2: arg1 and arg2,
+    "==": operator.eq,
+    "~=": operator.ne,
+    "<": numeric(operator.lt),
+    "<=": numeric(operator.le),
+    ">": numeric(operator.gt),
+    ">=": numeric(operator.ge),
+    "+": add,
+    "-": numeric(operator.sub),
+    "*": numeric(operator.mul),
+    "/": numeric(operator.truediv),
+    "%": numeric(operator.mod),
+}
+
+# builtins without side effects, a call with constant arguments can be evaluated while compiling
+PURE_BUILTINS: Dict[str, Callable] = {
+    "tostring": tostring,
+    "tonumber": tonumber,
+}
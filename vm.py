@@ -1,197 +1,743 @@
 import argparse
-from pydoc import resolve
-from typing import Dict
-from xmlrpc.client import Boolean
+import bisect
+import mmap
+import operator
+import sys
+import time
+from functools import partial
+from typing import Dict, Tuple
 
 
-from compiler.compiler import compile
+from compiler.compiler import compile, enabled_passes, BACKENDS
+from compiler.src.optimize import PASSES
+from compiler.src.cache import CompileCache
 from compiler.src.bytecode import *
+from compiler.src import regcode, binary, values, pycode
+from compiler.src.closures import LoopCompiler, NotCompilable, value_type, join
 
-class Frame:
-    def __init__(self) -> None:
-        self.stack = []
-        self.values = {}
+# Default memory budget for the frames of a run, deep recursion fails once they outgrow it
+DEFAULT_MEMORY = 64 * 2 ** 20
 
-    def push(self, value):
-        self.stack.append(value)
+# Backward jumps a loop takes before the table engine compiles it into a closure
+HOT_LOOP = 100
 
-    def pop(self):
-        if not self.stack:
-            raise Exception("Stack is empty")
-        value = self.stack[-1]
-        self.stack.pop()
-        return value
-    
-    def top(self):
-        if not self.stack:
-            raise Exception("Stack is empty")
-        return self.stack[-1]
 
-    def is_defined(self, name):
-        return name in self.values.keys()
+class FrameStore:
+    """
+    Every frame of a run in one contiguous list of cells: a frame is its slots followed by
+    its operands, base is where the slots of the running frame start. A call turns the
+    arguments on top of the caller's operands into the first slots of the callee, so they
+    are never copied. Return records are kept in a pool indexed by call depth and reused
+    by later calls. Recursion is bounded by the memory the cells and records take,
+    not by a frame count
+    """
+    __slots__ = ("cells", "base", "depth", "records", "memory")
 
-    def set(self, name, value):
-        self.values[name] = value
-    
-    def get(self, name):
-        return self.values.get(name, None)
+    # bytes of a list cell and of a return record with its reference from the pool
+    CELL_BYTES = 8
+    RECORD_BYTES = sys.getsizeof([0, 0, 0]) + 8
+
+    def __init__(self, size: int, memory: int = DEFAULT_MEMORY) -> None:
+        self.cells = [None] * size
+        self.base = 0
+        self.depth = 0
+        # [return address, caller base, result slot or None] for every active call
+        self.records = []
+        self.memory = memory
+
+    def used(self) -> int:
+        """Bytes taken by the cells and the records of the active calls"""
+        return len(self.cells) * self.CELL_BYTES + self.depth * self.RECORD_BYTES
+
+    def call(self, size: int, argc: int, ret_addr: int, slot) -> int:
+        """Enters a frame of size slots whose arguments are the top argc operands, returns its base"""
+        cells = self.cells
+        base = len(cells) - argc
+        if (base + size) * self.CELL_BYTES + (self.depth + 1) * self.RECORD_BYTES > self.memory:
+            raise Exception("Stack overflow")
+        cells.extend([None] * (size - argc))
+        depth = self.depth
+        if depth == len(self.records):
+            self.records.append([ret_addr, self.base, slot])
+        else:
+            record = self.records[depth]
+            record[0] = ret_addr
+            record[1] = self.base
+            record[2] = slot
+        self.depth = depth + 1
+        self.base = base
+        return base
+
+    def tail_call(self, size: int, argc: int) -> None:
+        """Replaces the running frame by a frame of size slots for the top argc operands"""
+        cells = self.cells
+        base = self.base
+        if (base + size) * self.CELL_BYTES + self.depth * self.RECORD_BYTES > self.memory:
+            raise Exception("Stack overflow")
+        if argc:
+            cells[base: base + argc] = cells[-argc:]
+        del cells[base + argc:]
+        cells.extend([None] * (size - argc))
+
+    def ret(self, value) -> int:
+        """
+        Leaves the running frame and pushes value, after the result slot of an assigned call,
+        onto the caller's operands. Returns the return address, -1 when leaving the top level
+        """
+        depth = self.depth
+        if not depth:
+            return -1
+        ret_addr, base, slot = self.records[depth - 1]
+        cells = self.cells
+        del cells[self.base:]
+        if slot is not None:
+            cells.append(slot)
+        cells.append(value)
+        self.base = base
+        self.depth = depth - 1
+        return ret_addr
+
+
+class Unloaded:
+    """Stands in for the first body instruction of a function whose body has not been decoded yet"""
+    __slots__ = ("entry", "id")
+
+    def __init__(self, entry: int) -> None:
+        self.entry = entry
+        self.id = entry + 1
+
+
+class CountingCode:
+    """The decoded program as the switch engine sees it with stats on, counts every instruction fetched"""
+    __slots__ = ("code", "fetched")
+
+    def __init__(self, code: list) -> None:
+        self.code = code
+        self.fetched = 0
+
+    def __getitem__(self, pos: int):
+        self.fetched += 1
+        return self.code[pos]
+
+
+def _print(*args):
+    for arg in args:
+        print(arg)
+
+
+def _read(*args):
+    text = input()
+    return text
 
 
 class VM:
-    def __init__(self) -> None:
+    ENGINES = ["table", "switch"]
+
+    # the builtins are the same for every VM, a program's calls to them are resolved
+    # to positions in builtin_table when it is loaded
+    builtins = {
+        "print": _print,
+        "tostring": values.tostring,
+        "tonumber": values.tonumber,
+        "read": _read
+    }
+    builtin_table = list(builtins.values())
+    builtin_ids = {name: i for i, name in enumerate(builtins)}
+    # the same builtins for the argument counts they are nearly always called with,
+    # they take their arguments directly instead of packed into a tuple
+    fixed_builtins = {
+        ("print", 1): print,
+        ("tostring", 1): values.value2string,
+        ("tonumber", 1): values.value2number,
+        ("read", 0): input,
+    }
+
+    def __init__(self, engine: str = "table", stats: bool = False, lazy: bool = True,
+                 memory: int = DEFAULT_MEMORY, hot: int = HOT_LOOP) -> None:
+        """hot is the number of backward jumps after which a loop is compiled, 0 never compiles one"""
         self.bytecode = []
         self.pos = 0
-        self.frames = []
-        self.STACK_LIMIT = 999
+        self.memory = memory
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        self.stats = stats
+        self.lazy = lazy
+        self.hot = hot
+        self.dispatched = 0
+        self._reset_tiers()
+
+    def _reset_tiers(self) -> None:
+        # loops compiled, compiled again after a guard failed, and left to the interpreter
+        self.promoted = 0
+        self.recompiled = 0
+        self.rejected = 0
+        # seconds spent compiling loops and running their closures, with stats only
+        self.compile_time = 0.0
+        self.compiled_time = 0.0
 
     def init(self, bytecode: bytearray):
         self.pos = 0
-        self.frames: List[Frame]  = [Frame()]
-        self.builtins: Dict[str, function] = {}
         self.bytecode = bytecode
         self.bytecode = self._decode_bytecode()
-        self._init_builtins()
-        
+        self.store = FrameStore(self._frame_size(0), self.memory)
 
-    def run(self): 
+    def run(self):
+        if self.engine == "switch":
+            self.run_switch()
+        else:
+            self.run_table()
+
+    def run_switch(self):
         self.pos = 0
+        self.dispatched = 0
+        store = self.store
+        cells = store.cells
+        push = cells.append
+        pop = cells.pop
+        builtins = self.builtin_table
+        binary_ops = {cls: values.BINARY_OPS[op] for op, cls in biOp2cls.items()}
+
+        # only a run with stats counts, through the fetches, the plain loop does no bookkeeping
+        code = CountingCode(self.bytecode) if self.stats else self.bytecode
+
+        def operand(value):
+            return cells[store.base + value.name] if type(value) == Pushv else value.value
+
         while self.pos < len(self.bytecode):
-            line = self.bytecode[self.pos]
-          
+            line = code[self.pos]
             self.pos += 1
             t = type(line)
             if t == OrOp:
-                arg1 = self.frames[-1].pop()
-                arg2 = self.frames[-1].pop()
-                self.frames[-1].push(arg1 or arg2)
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 or arg2)
             elif t == AndOp:
-                arg1 = self.frames[-1].pop()
-                arg2 = self.frames[-1].pop()
-                self.frames[-1].push(arg1 and arg2)
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 and arg2)
             elif t == EqOp:
-                arg1 = self.frames[-1].pop()
-                arg2 = self.frames[-1].pop()
-                self.frames[-1].push(arg1 == arg2)
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 == arg2)
             elif t == NeqOp:
-                arg1 = self.frames[-1].pop()
-                arg2 = self.frames[-1].pop()
-                self.frames[-1].push(arg1 != arg2)
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 != arg2)
             elif t == LessOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 < arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 < arg2)
             elif t == LessEqOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 <= arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 <= arg2)
             elif t == GreaterOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 > arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 > arg2)
             elif t == GreaterEqOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 >= arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 >= arg2)
             elif t == AddOp:
-                arg1 = self.frames[-1].pop()
-                arg2 = self.frames[-1].pop()
+                arg1 = pop()
+                arg2 = pop()
                 if type(arg1) != str or type(arg2) != str:
                     arg1 = self._value2number(arg1)
                     arg2 = self._value2number(arg2)
-                self.frames[-1].push(arg1 + arg2)
+                push(arg1 + arg2)
             elif t == SubOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 - arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 - arg2)
             elif t == MulOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 * arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 * arg2)
             elif t == DivOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 / arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 / arg2)
             elif t == DivRemOp:
-                arg1 = self._value2number(self.frames[-1].pop())
-                arg2 = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg1 % arg2)
+                arg1 = self._value2number(pop())
+                arg2 = self._value2number(pop())
+                push(arg1 % arg2)
             elif t == UnaryPlus:
-                arg = self._value2number(self.frames[-1].pop())
-                self.frames[-1].push(arg)
+                arg = self._value2number(pop())
+                push(arg)
             elif t == UnaryMinus:
-               arg = self._value2number(self.frames[-1].pop())
-               self.frames[-1].push(-arg)
+               arg = self._value2number(pop())
+               push(-arg)
             elif t == UnaryNot:
-                arg = self._value2bool(self.frames[-1].pop())
-                self.frames[-1].push(not arg)
+                arg = self._value2bool(pop())
+                push(not arg)
             elif t == Pushv:
-                name = line.name
-                value = self._resolve_frame(name)
-                self.frames[-1].push(value)
+                push(cells[store.base + line.name])
             elif t == Pushl:
-                self.frames[-1].push(line.value)
+                push(line.value)
             elif t == Pop:
-                self.frames[-1].pop()
+                pop()
             elif t == Load:
-                value = self.frames[-1].pop()
-                var_id = self.frames[-1].pop()
-                self.frames[-1].set(var_id, value)
+                value = pop()
+                cells[store.base + pop()] = value
             elif t == Jmp:
-                address = self.frames[-1].pop()
-                self.pos = address
+                self.pos = line.target
             elif t == CJmp:
-                cond = self._value2bool(self.frames[-1].pop())
-                address = self.frames[-1].pop()
+                cond = self._value2bool(pop())
                 if cond:
-                    self.pos = address
+                    self.pos = line.target
             elif t == Call:
-                if len(self.frames) == self.STACK_LIMIT:
-                    raise Exception("Stack overflow")
-                argc = self.frames[-1].pop()
-                addr = self.frames[-1].pop()
-                is_assigned = self.frames[-1].pop()
-                tmp_addr = None
-                if is_assigned:
-                    tmp_addr = self.frames[-1].pop()
-                frame = Frame()
-                frame.push(self.pos)
-                for i in range(argc):
-                    value = self.frames[-1].pop()
-                    name = self.frames[-1].pop()
-                    frame.set(name, value)
-                if tmp_addr:
-                    self.frames[-1].push(tmp_addr)
-                self.frames.append(frame)
-                self.pos = addr
+                slot = pop() if line.is_assigned else None
+                store.call(self._frame_size(line.target), line.argc, self.pos, slot)
+                self.pos = line.target + 1
+            elif t == TailCall:
+                store.tail_call(self._frame_size(line.target), line.argc)
+                self.pos = line.target + 1
             elif t == Callb:
-                if len(self.frames) == self.STACK_LIMIT:
-                    raise Exception("Stack overflow")
-                argc = self.frames[-1].pop()
-                name = self.frames[-1].pop()
-                is_assigned = self.frames[-1].pop()
-                tmp_addr = None
-                if is_assigned:
-                    tmp_addr = self.frames[-1].pop()
-                values = []
-                for i in range(argc):
-                    values.append(self.frames[-1].pop())
-                    self.frames[-1].pop()
-                if tmp_addr:
-                    self.frames[-1].push(tmp_addr)
-                self.frames[-1].push(self.builtins[name](*reversed(values)))
+                # the slot id of an assigned call lies above the arguments, it goes back under the result
+                slot = None
+                if line.is_assigned:
+                    slot = pop()
+                args = cells[len(cells) - line.argc:]
+                for i in range(line.argc):
+                    pop()
+                result = builtins[line.index](*args)
+                if line.is_assigned:
+                    push(slot)
+                push(result)
             elif t == Return:
-                value = self.frames[-1].pop()
-                ret_addr = self.frames[-1].pop()
-                self.frames.pop()
-                if not self.frames:
+                value = pop()
+                ret_addr = store.ret(value)
+                if ret_addr < 0:
                     print(value)
                     break
-                self.frames[-1].push(value)
                 self.pos = ret_addr
             elif t == Hault:
                 break
+            elif t == Enter:
+                pass
+            elif t == Move:
+                cells[store.base + line.dst] = operand(line.value)
+            elif t == Compute:
+                cells[store.base + line.dst] = binary_ops[line.op](operand(line.value1), operand(line.value2))
+            elif t == CJmpv:
+                if self._value2bool(cells[store.base + line.cond]):
+                    self.pos = line.target
+            elif t == Unloaded:
+                self._load_function(line.entry)
+                self.pos -= 1
             else:
                 raise Exception("Unknown bytecode operation")
+        if self.stats:
+            self.dispatched = code.fetched
+
+    def run_table(self):
+        self._reset_tiers()
+        code = self._build_table()
+        end = len(code)
+        pc = 0
+        if self.stats:
+            dispatched = 0
+            while pc < end:
+                dispatched += 1
+                pc = code[pc]()
+            self.dispatched = dispatched
+        else:
+            while pc < end:
+                pc = code[pc]()
+
+    def _build_table(self) -> list:
+        """
+        Decodes the program once into integer opcodes and binds every instruction
+        to a closure from the handler table. A closure executes its instruction
+        and returns the address of the next one, so dispatch is a single indexed call
+        """
+        store = self.store
+        cells = store.cells
+        push = cells.append
+        pop = cells.pop
+        base = store.base
+        enter = store.call
+        leave = store.ret
+        end = len(self.bytecode)
+        builtins = self.builtin_table
+        fixed_builtins = self.fixed_builtins
+        to_number = self._value2number
+        to_bool = self._value2bool
+        hot = self.hot
+        binary_ops = {cls: values.BINARY_OPS[op] for op, cls in biOp2cls.items()}
+
+        def op_or(line, nxt):
+            def run():
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 or arg2)
+                return nxt
+            return run
+
+        def op_and(line, nxt):
+            def run():
+                arg1 = pop()
+                arg2 = pop()
+                push(arg1 and arg2)
+                return nxt
+            return run
+
+        def op_compare(fn):
+            def factory(line, nxt):
+                def run():
+                    arg1 = pop()
+                    arg2 = pop()
+                    push(fn(arg1, arg2))
+                    return nxt
+                return run
+            return factory
+
+        def op_arithmetic(fn):
+            def factory(line, nxt):
+                def run():
+                    arg1 = to_number(pop())
+                    arg2 = to_number(pop())
+                    push(fn(arg1, arg2))
+                    return nxt
+                return run
+            return factory
+
+        def op_add(line, nxt):
+            def run():
+                arg1 = pop()
+                arg2 = pop()
+                if type(arg1) != str or type(arg2) != str:
+                    arg1 = to_number(arg1)
+                    arg2 = to_number(arg2)
+                push(arg1 + arg2)
+                return nxt
+            return run
+
+        def op_uplus(line, nxt):
+            def run():
+                push(to_number(pop()))
+                return nxt
+            return run
+
+        def op_uminus(line, nxt):
+            def run():
+                push(-to_number(pop()))
+                return nxt
+            return run
+
+        def op_unot(line, nxt):
+            def run():
+                push(not to_bool(pop()))
+                return nxt
+            return run
+
+        def op_pushv(line, nxt):
+            slot = line.name
+            def run():
+                push(cells[base + slot])
+                return nxt
+            return run
+
+        def op_pushl(line, nxt):
+            value = line.value
+            def run():
+                push(value)
+                return nxt
+            return run
+
+        def op_pop(line, nxt):
+            def run():
+                pop()
+                return nxt
+            return run
+
+        def op_load(line, nxt):
+            def run():
+                value = pop()
+                cells[base + pop()] = value
+                return nxt
+            return run
+
+        def op_jmp(line, nxt):
+            target = line.target
+            if hot and target < nxt:
+                return op_backward(line, nxt)
+            def run():
+                return target
+            return run
+
+        def op_cjmp(line, nxt):
+            target = line.target
+            if hot and target < nxt:
+                return op_backward(line, nxt)
+            def run():
+                if to_bool(pop()):
+                    return target
+                return nxt
+            return run
+
+        def op_move(line, nxt):
+            dst = line.dst
+            if type(line.value) == Pushv:
+                src = line.value.name
+                def run():
+                    cells[base + dst] = cells[base + src]
+                    return nxt
+            else:
+                value = line.value.value
+                def run():
+                    cells[base + dst] = value
+                    return nxt
+            return run
+
+        def op_compute(op):
+            fn = binary_ops[op]
+            def factory(line, nxt):
+                dst = line.dst
+                value1 = line.value1
+                value2 = line.value2
+                if type(value1) == Pushv and type(value2) == Pushv:
+                    a = value1.name
+                    b = value2.name
+                    def run():
+                        cells[base + dst] = fn(cells[base + a], cells[base + b])
+                        return nxt
+                elif type(value1) == Pushv:
+                    a = value1.name
+                    value2 = value2.value
+                    def run():
+                        cells[base + dst] = fn(cells[base + a], value2)
+                        return nxt
+                elif type(value2) == Pushv:
+                    value1 = value1.value
+                    b = value2.name
+                    def run():
+                        cells[base + dst] = fn(value1, cells[base + b])
+                        return nxt
+                else:
+                    value1 = value1.value
+                    value2 = value2.value
+                    def run():
+                        cells[base + dst] = fn(value1, value2)
+                        return nxt
+                return run
+            return factory
+
+        def op_cjmpv(line, nxt):
+            target = line.target
+            if hot and target < nxt:
+                return op_backward(line, nxt)
+            cond = line.cond
+            def run():
+                value = cells[base + cond]
+                # to_bool inlined: only false and nil are false
+                if value is not False and value is not None:
+                    return target
+                return nxt
+            return run
+
+        def exit_test(line):
+            """Whether a backward jump falls through this time, None when it always jumps"""
+            if type(line) == CJmp:
+                return lambda: not to_bool(pop())
+            elif type(line) == CJmpv:
+                cond = line.cond
+                return lambda: not to_bool(cells[base + cond])
+            return None
+
+        def op_backward(line, nxt):
+            """Counts the iterations of the loop the jump closes, until it is hot enough to compile"""
+            target = line.target
+            falls = exit_test(line)
+            count = 0
+            def run():
+                nonlocal count
+                if falls is not None and falls():
+                    return nxt
+                count += 1
+                if count >= hot:
+                    code[nxt - 1] = op_compiled(line, nxt, None, None)
+                return target
+            return run
+
+        def op_compiled(line, nxt, compiler, previous):
+            """
+            Runs the loop as a closure from now on. When its guard fails the interpreter takes
+            this iteration and the loop is compiled again without the types that changed
+            """
+            target = line.target
+            falls = exit_test(line)
+            start = time.perf_counter()
+            try:
+                if compiler is None:
+                    compiler = LoopCompiler(bytecode, target, nxt - 1, builtins, fixed_builtins)
+                assumed = {slot: value_type(cells[base + slot]) for slot in compiler.read}
+                if previous is not None:
+                    assumed = {slot: join(t, previous.get(slot)) for slot, t in assumed.items()}
+                source, guarded = compiler.compile(assumed)
+                namespace = dict(compiler.namespace, cells=cells, _number=to_number, _truth=to_bool,
+                                 _add=values.add, _NUM=(int, float))
+                exec(source, namespace)
+            except (NotCompilable, SyntaxError, RecursionError):
+                self.rejected += 1
+                def run():
+                    if falls is not None and falls():
+                        return nxt
+                    return target
+                return run
+            finally:
+                self.compile_time += time.perf_counter() - start
+            loop = namespace["loop"]
+            if previous is None:
+                self.promoted += 1
+            else:
+                self.recompiled += 1
+            def run():
+                if falls is not None and falls():
+                    return nxt
+                pc = loop(base)
+                if pc is None:
+                    code[nxt - 1] = op_compiled(line, nxt, compiler, guarded)
+                    return target
+                return pc
+            if not self.stats:
+                return run
+            def timed():
+                start = time.perf_counter()
+                pc = run()
+                self.compiled_time += time.perf_counter() - start
+                return pc
+            return timed
+
+        def op_call(line, nxt):
+            size = sizes[line.target]
+            entry = line.target + 1
+            argc = line.argc
+            is_assigned = line.is_assigned
+            def run():
+                nonlocal base
+                slot = pop() if is_assigned else None
+                base = enter(size, argc, nxt, slot)
+                return entry
+            return run
+
+        def op_tailcall(line, nxt):
+            size = sizes[line.target]
+            entry = line.target + 1
+            argc = line.argc
+            tail_call = store.tail_call
+            def run():
+                tail_call(size, argc)
+                return entry
+            return run
+
+        def op_callb(line, nxt):
+            argc = line.argc
+            is_assigned = line.is_assigned
+            fixed = fixed_builtins.get((line.name, argc))
+            if fixed is not None and argc == 0:
+                def run():
+                    push(fixed())
+                    return nxt
+            elif fixed is not None and is_assigned:
+                def run():
+                    # the argument lies under the slot id, the result goes above it
+                    value = cells[-2]
+                    cells[-2] = cells[-1]
+                    cells[-1] = fixed(value)
+                    return nxt
+            elif fixed is not None:
+                def run():
+                    cells[-1] = fixed(cells[-1])
+                    return nxt
+            else:
+                fn = builtins[line.index]
+                def run():
+                    stop = len(cells) - is_assigned
+                    start = stop - argc
+                    args = cells[start:stop]
+                    del cells[start:stop]
+                    push(fn(*args))
+                    return nxt
+            return run
+
+        def op_return(line, nxt):
+            def run():
+                nonlocal base
+                value = pop()
+                ret_addr = leave(value)
+                if ret_addr < 0:
+                    print(value)
+                    return end
+                base = store.base
+                return ret_addr
+            return run
+
+        def op_hault(line, nxt):
+            def run():
+                return end
+            return run
+
+        def op_enter(line, nxt):
+            def run():
+                return nxt
+            return run
+
+        def op_unloaded(line):
+            entry = line.entry
+            def run():
+                for start, stop in self._load_function(entry):
+                    for i in range(start, stop):
+                        code[i] = make(bytecode[i], i)
+                return entry + 1
+            return run
+
+        def make(line, i):
+            if line is None:
+                return None
+            if type(line) == Unloaded:
+                return op_unloaded(line)
+            return handlers[line.opcode()](line, i + 1)
+
+        handlers = [
+            op_or,
+            op_and,
+            op_compare(operator.eq),
+            op_compare(operator.ne),
+            op_arithmetic(operator.lt),
+            op_arithmetic(operator.le),
+            op_arithmetic(operator.gt),
+            op_arithmetic(operator.ge),
+            op_add,
+            op_arithmetic(operator.sub),
+            op_arithmetic(operator.mul),
+            op_arithmetic(operator.truediv),
+            op_arithmetic(operator.mod),
+            op_uplus,
+            op_uminus,
+            op_unot,
+            op_pushv,
+            op_pushl,
+            op_pop,
+            op_load,
+            op_jmp,
+            op_cjmp,
+            op_call,
+            op_callb,
+            op_return,
+            op_hault,
+            op_enter,
+            op_tailcall,
+            op_move,
+            op_cjmpv
+        ]
+        handlers += [op_compute(op) for op in sorted(binary_ops, key=cls2opcode.get)]
+        bytecode = self.bytecode
+        sizes = {line.id: line.size for line in bytecode if type(line) == Enter}
+        code = [make(line, i) for i, line in enumerate(bytecode)]
+        return code
 
 
     def _read(self, n: int) -> bytearray:
@@ -201,7 +747,108 @@ class VM:
         self.pos += n
         return self.bytecode[start: self.pos]
 
+    def _read_operand(self) -> str:
+        size1, size2 = self._read(2)
+        size = 256 * size1 + size2
+        return self._bytes2string(self._read(size))
+
     def _decode_bytecode(self) -> List[Bytecode]:
+        if binary.is_module(self.bytecode):
+            return self._decode_module()
+        return self._decode_bytecode_v0()
+
+    def _decode_module(self) -> List[Bytecode]:
+        """
+        Without lazy decoding every record is decoded up front. Otherwise only the
+        top level and the ENTER records are, function bodies wait for their first call
+        """
+        kind, constants, code = binary.read_sections(self.bytecode)
+        if kind != binary.KIND_STACK:
+            raise binary.BinaryFormatError("Not a stack machine module")
+        self._code = code
+        self._decoders = self._record_decoders(constants)
+        self._functions = []
+        self._pending = {}
+        size = binary.INSTRUCTION.size
+        count = len(code) // size
+        # records are fixed-width, so the opcode column is every size-th byte
+        opcodes = code[::size].tobytes()
+        if opcodes and max(opcodes) >= len(self._decoders):
+            raise binary.BinaryFormatError(f"Unknown opcode {max(opcodes)}")
+        decoded = [None] * count
+        if not self.lazy:
+            self._decode_range(decoded, 0, count)
+            return decoded
+
+        # bodies wait for their first call, the builtins they call are checked now all the same
+        callb = cls2opcode[Callb]
+        pos = opcodes.find(callb)
+        while pos != -1:
+            self._resolve_builtin(constants[binary.INSTRUCTION.unpack_from(code, pos * size)[1]])
+            pos = opcodes.find(callb, pos + 1)
+        enter = cls2opcode[Enter]
+        pos = opcodes.find(enter)
+        while pos != -1:
+            self._decode_range(decoded, pos, pos + 1)
+            if pos:
+                self._functions.append((pos, decoded[pos].end))
+                self._pending[pos] = decoded[pos].end
+                decoded[pos + 1] = Unloaded(pos)
+            pos = opcodes.find(enter, pos + 1)
+        self._entries = [entry for entry, end in self._functions]
+        for start, stop in self._pieces(1, count):
+            self._decode_range(decoded, start, stop)
+        return decoded
+
+    def _pieces(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """Splits [start, stop) into the ranges that are not bodies of functions declared inside it"""
+        pieces = []
+        pos = start
+        i = bisect.bisect_right(self._entries, start)
+        while i < len(self._functions) and self._functions[i][0] < stop:
+            entry, end = self._functions[i]
+            if entry >= pos:
+                pieces.append((pos, entry))
+                pos = end
+            i += 1
+        pieces.append((pos, stop))
+        return pieces
+
+    def _decode_range(self, decoded: list, start: int, stop: int) -> None:
+        size = binary.INSTRUCTION.size
+        decoders = self._decoders
+        records = binary.INSTRUCTION.iter_unpack(self._code[start * size: stop * size])
+        for i, (opcode, a, b, c) in enumerate(records, start):
+            line = decoders[opcode](a, b, c)
+            line.id = i
+            decoded[i] = line
+
+    def _load_function(self, entry: int) -> List[Tuple[int, int]]:
+        """Decodes the body of the function at entry and returns the decoded address ranges"""
+        pieces = self._pieces(entry + 1, self._pending.pop(entry))
+        for start, stop in pieces:
+            self._decode_range(self.bytecode, start, stop)
+        return pieces
+
+    def _record_decoders(self, constants: list) -> list:
+        decoders = {opcode: (lambda a, b, c, cls=cls: cls()) for cls, opcode in cls2opcode.items()}
+        decoders[cls2opcode[Pushv]] = lambda a, b, c: Pushv(a)
+        decoders[cls2opcode[Pushl]] = lambda a, b, c: Pushl(constants[a])
+        decoders[cls2opcode[Jmp]] = lambda a, b, c: Jmp(a)
+        decoders[cls2opcode[CJmp]] = lambda a, b, c: CJmp(a)
+        decoders[cls2opcode[Call]] = lambda a, b, c: Call(a, b, bool(c))
+        decoders[cls2opcode[Callb]] = lambda a, b, c: self._builtin_call(constants[a], b, bool(c))
+        decoders[cls2opcode[Enter]] = lambda a, b, c: Enter(a, b)
+        decoders[cls2opcode[TailCall]] = lambda a, b, c: TailCall(a, b)
+        value = lambda operand: Pushv(operand) if operand >= 0 else Pushl(constants[-operand - 1])
+        decoders[cls2opcode[Move]] = lambda a, b, c: Move(a, value(b))
+        decoders[cls2opcode[CJmpv]] = lambda a, b, c: CJmpv(a, b)
+        for op in biOp2cls.values():
+            decoders[cls2opcode[Compute] + cls2opcode[op]] = \
+                lambda a, b, c, op=op: Compute(op, a, value(b), value(c))
+        return [decoders[opcode] for opcode in range(len(decoders))]
+
+    def _decode_bytecode_v0(self) -> List[Bytecode]:
         decoded = []
         opcode = self._read(1)
         while opcode:
@@ -209,14 +856,10 @@ class VM:
             if opcode in range(16):
                 decoded.append(opcode2cls[opcode]())
             elif opcode == 16:
-                    size1, size2 = self._read(2)
-                    size = 256 * size1 + size2
-                    name = int(self._bytes2string(self._read(size)))
+                    name = int(self._read_operand())
                     decoded.append(Pushv(name))
             elif opcode == 17:
-                    size1, size2 = self._read(2)
-                    size = 256 * size1 + size2
-                    value = self._bytes2string(self._read(size))
+                    value = self._read_operand()
                     value= self._parse_value(value)
                     decoded.append(Pushl(value))
             elif opcode == 18:
@@ -224,35 +867,61 @@ class VM:
             elif opcode == 19:
                     decoded.append(Load())
             elif opcode == 20:
-                    decoded.append(Jmp())
+                    decoded.append(Jmp(int(self._read_operand())))
             elif opcode == 21:
-                    decoded.append(CJmp())
+                    decoded.append(CJmp(int(self._read_operand())))
             elif opcode == 22:
-                    decoded.append(Call())
+                    target = int(self._read_operand())
+                    argc = int(self._read_operand())
+                    is_assigned = self._read_operand() == "1"
+                    decoded.append(Call(target, argc, is_assigned))
             elif opcode == 23:
-                    decoded.append(Callb())
+                    name = self._read_operand()
+                    argc = int(self._read_operand())
+                    is_assigned = self._read_operand() == "1"
+                    decoded.append(self._builtin_call(name, argc, is_assigned))
             elif opcode == 24:
                     decoded.append(Return())
             elif opcode == 25:
                     decoded.append(Hault())
+            elif opcode == 26:
+                    decoded.append(Enter(int(self._read_operand())))
+            elif opcode == 27:
+                    target = int(self._read_operand())
+                    argc = int(self._read_operand())
+                    decoded.append(TailCall(target, argc))
             opcode = self._read(1)
 
         for i, line in enumerate(decoded):
             line.id = i
         return decoded
 
-    def _resolve_frame(self, name):
-     
-        return self.frames[-1].values.get(name, None)
+    def _builtin_call(self, name: str, argc: int, is_assigned: bool) -> Callb:
+        line = Callb(name, argc, is_assigned)
+        line.index = self._resolve_builtin(name)
+        return line
+
+    def _resolve_builtin(self, name: str) -> int:
+        """Position of a builtin in builtin_table, a program calling one that does not exist fails to load"""
+        index = self.builtin_ids.get(name)
+        if index is None:
+            raise Exception(f"Unknown builtin: {name}")
+        return index
 
-    def _parse_value(self, value: str) -> Union[float, str, Boolean, None]:
+    def _frame_size(self, address: int) -> int:
+        line = self.bytecode[address]
+        if type(line) != Enter:
+            raise Exception(f"No function entry at address {address}")
+        return line.size
+
+    def _parse_value(self, value: str) -> Union[float, str, bool, None]:
         if value == "nil":
             return None
         elif value == "true":
             return True
         elif value == "false":
             return False
-        elif value[0].isdigit():
+        elif value[:1].isdigit():
             value: float = float(value)
             if value.is_integer():
                 return int(value)
@@ -260,63 +929,304 @@ class VM:
         else:
             return value
         
-    def _value2bool(self, value) -> bool:
-        if type(value) == bool:
-            return value 
-        if value is None:
-            return False
-        return True
-    
-    def _value2number(self, value) -> float:
-        if type(value) in [float, int]:
-            return value
-        if type(value) == str:
-            return float(value)
-        raise Exception("Can't cast type to number")
-
-    def _value2string(self, value) -> str:
-        if value == True:
-            return "true"
-        if value == False:
-            return "false"
-        if value is None:
-            return "nil"
-        return str(value)
+    _value2bool = staticmethod(values.value2bool)
+    _value2number = staticmethod(values.value2number)
+    _value2string = staticmethod(values.value2string)
 
     def _bytes2string(self, bytes: bytearray) -> str:
         return bytes.decode(encoding="ASCII")
 
-    
-    def _init_builtins(self):
-        def _print(*args):
-            for arg in args:
-                print(arg)
-
-        def _tostring(*args):
-            if not args:
-                return ""
-            return self._value2string(args[0])
-
-        def _tonumber(*args):
-            if not args:
-                return 0
-            return self._value2number(args[0])
-
-        def _read(*args):
-            text = input()
-            return text
-
-        self.builtins = {
-            "print": _print,
-            "tostring": _tostring,
-            "tonumber": _tonumber,
-            "read": _read
+
+class RegisterVM(VM):
+    """Interpreter for the register machine code produced by tac2regcode"""
+
+    # bytes of a register list besides its cells and of the record of a call
+    FRAME_BYTES = sys.getsizeof([]) + sys.getsizeof((0, 0, 0, 0)) + 8
+
+    def init(self, module: bytearray):
+        kind, self.constants, self.code = binary.read_module(module)
+        if kind != binary.KIND_REGISTER:
+            raise binary.BinaryFormatError("Not a register machine module")
+        for op, dst, name, argc in self.code:
+            if op > regcode.TAILCALL:
+                raise binary.BinaryFormatError(f"Unknown opcode {op}")
+            if op == regcode.CALLB:
+                self._resolve_builtin(self.constants[-name - 1])
+
+    def run(self):
+        code = self._build_table()
+        end = len(code)
+        pc = 0
+        if self.stats:
+            dispatched = 0
+            while pc < end:
+                dispatched += 1
+                pc = code[pc]()
+            self.dispatched = dispatched
+        else:
+            while pc < end:
+                pc = code[pc]()
+
+    def _build_table(self) -> list:
+        consts = self.constants
+        sizes = {i: line[1] for i, line in enumerate(self.code) if line[0] == regcode.ENTER}
+        regs = [None] * sizes[0]
+        # (return address, caller registers, result register, bytes) of every active call
+        self.frames = frames = []
+        args = []
+        end = len(self.code)
+        builtins = self.builtin_table
+        fixed_builtins = self.fixed_builtins
+        memory = self.memory
+        # bytes taken by the registers and records of the active calls, bounded by the memory budget
+        used = sizes[0] * FrameStore.CELL_BYTES
+        to_bool = self._value2bool
+        unary_ops = {regcode.unOp2reg[op]: fn for op, fn in values.UNARY_OPS.items()}
+        binary_ops = {regcode.biOp2reg[op]: fn for op, fn in values.BINARY_OPS.items()}
+
+        def op_move(dst, src, _, nxt):
+            if src < 0:
+                value = consts[-src - 1]
+                def run():
+                    regs[dst] = value
+                    return nxt
+            else:
+                def run():
+                    regs[dst] = regs[src]
+                    return nxt
+            return run
+
+        def op_unary(op, dst, src, _, nxt):
+            fn = unary_ops[op]
+            if src < 0:
+                value = consts[-src - 1]
+                def run():
+                    regs[dst] = fn(value)
+                    return nxt
+            else:
+                def run():
+                    regs[dst] = fn(regs[src])
+                    return nxt
+            return run
+
+        def op_binary(op, dst, a, b, nxt):
+            fn = binary_ops[op]
+            if a >= 0 and b >= 0:
+                def run():
+                    regs[dst] = fn(regs[a], regs[b])
+                    return nxt
+            elif a >= 0:
+                value2 = consts[-b - 1]
+                def run():
+                    regs[dst] = fn(regs[a], value2)
+                    return nxt
+            elif b >= 0:
+                value1 = consts[-a - 1]
+                def run():
+                    regs[dst] = fn(value1, regs[b])
+                    return nxt
+            else:
+                value1 = consts[-a - 1]
+                value2 = consts[-b - 1]
+                def run():
+                    regs[dst] = fn(value1, value2)
+                    return nxt
+            return run
+
+        def op_param(src, _, __, nxt):
+            if src < 0:
+                value = consts[-src - 1]
+                def run():
+                    args.append(value)
+                    return nxt
+            else:
+                def run():
+                    args.append(regs[src])
+                    return nxt
+            return run
+
+        def op_call(dst, target, argc, nxt):
+            size = sizes[target]
+            entry = target + 1
+            cost = size * FrameStore.CELL_BYTES + self.FRAME_BYTES
+            def run():
+                nonlocal regs, used
+                if used + cost > memory:
+                    raise Exception("Stack overflow")
+                used += cost
+                callee = [None] * size
+                if argc:
+                    callee[:argc] = args[-argc:]
+                    del args[-argc:]
+                frames.append((nxt, regs, dst, cost))
+                regs = callee
+                return entry
+            return run
+
+        def op_tailcall(_, target, argc, nxt):
+            size = sizes[target]
+            entry = target + 1
+            def run():
+                nonlocal regs, used
+                delta = (size - len(regs)) * FrameStore.CELL_BYTES
+                if used + delta > memory:
+                    raise Exception("Stack overflow")
+                used += delta
+                callee = [None] * size
+                if argc:
+                    callee[:argc] = args[-argc:]
+                    del args[-argc:]
+                # no frame is pushed, the callee returns straight to our caller
+                # through our record, which now accounts for the callee's registers
+                if frames:
+                    ret_addr, caller, dst, cost = frames[-1]
+                    frames[-1] = (ret_addr, caller, dst, cost + delta)
+                regs = callee
+                return entry
+            return run
+
+        def op_callb(dst, name, argc, nxt):
+            name = consts[-name - 1]
+            fixed = fixed_builtins.get((name, argc))
+            if fixed is not None and argc == 0:
+                def run():
+                    value = fixed()
+                    if dst >= 0:
+                        regs[dst] = value
+                    return nxt
+            elif fixed is not None and dst >= 0:
+                def run():
+                    regs[dst] = fixed(args.pop())
+                    return nxt
+            elif fixed is not None:
+                def run():
+                    fixed(args.pop())
+                    return nxt
+            else:
+                fn = builtins[self._resolve_builtin(name)]
+                def run():
+                    values = args[len(args) - argc:]
+                    del args[len(args) - argc:]
+                    value = fn(*values)
+                    if dst >= 0:
+                        regs[dst] = value
+                    return nxt
+            return run
+
+        def op_ret(src, _, __, nxt):
+            def run():
+                nonlocal regs, used
+                value = consts[-src - 1] if src < 0 else regs[src]
+                if not frames:
+                    print(value)
+                    return end
+                ret_addr, regs, dst, cost = frames.pop()
+                used -= cost
+                if dst >= 0:
+                    regs[dst] = value
+                return ret_addr
+            return run
+
+        def op_jmp(target, _, __, nxt):
+            def run():
+                return target
+            return run
+
+        def op_cjmp(cond, target, _, nxt):
+            if cond < 0:
+                # a constant condition always goes the same way
+                taken = target if to_bool(consts[-cond - 1]) else nxt
+                def run():
+                    return taken
+                return run
+            def run():
+                if to_bool(regs[cond]):
+                    return target
+                return nxt
+            return run
+
+        def op_enter(size, _, __, nxt):
+            def run():
+                return nxt
+            return run
+
+        def op_halt(_, __, ___, nxt):
+            def run():
+                return end
+            return run
+
+        handlers = {
+            regcode.MOVE: op_move,
+            regcode.PARAM: op_param,
+            regcode.CALL: op_call,
+            regcode.TAILCALL: op_tailcall,
+            regcode.CALLB: op_callb,
+            regcode.RET: op_ret,
+            regcode.JMP: op_jmp,
+            regcode.CJMP: op_cjmp,
+            regcode.ENTER: op_enter,
+            regcode.HALT: op_halt,
         }
+        for op in unary_ops:
+            handlers[op] = partial(op_unary, op)
+        for op in binary_ops:
+            handlers[op] = partial(op_binary, op)
+        return [handlers[op](a, b, c, i + 1) for i, (op, a, b, c) in enumerate(self.code)]
+
+class PythonVM(VM):
+    """Runs the Python module produced by tac2python, every Lua function is a Python function"""
+
+    # bytes a Python frame of a translated function takes, the recursion limit follows from the memory budget
+    FRAME_BYTES = 256
+
+    def __init__(self, stats: bool = False, memory: int = DEFAULT_MEMORY, cache: CompileCache = None) -> None:
+        super().__init__(stats=stats, memory=memory)
+        self.cache = cache
+
+    def init(self, module: bytearray):
+        if not pycode.is_python_module(module):
+            raise binary.BinaryFormatError("Not a python module")
+        namespace = {
+            "_number": values.value2number,
+            "_truth": values.value2bool,
+            "_add": values.add,
+        }
+        exec(pycode.load(module, self.cache), namespace)
+        for name, argc in namespace["BUILTINS"]:
+            fn = self.fixed_builtins.get((name, argc))
+            if fn is None:
+                fn = self.builtin_table[self._resolve_builtin(name)]
+            namespace[pycode.builtin_name(name, argc)] = fn
+        self.main = namespace["main"]
+
+    def run(self):
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, self.memory // self.FRAME_BYTES))
+        try:
+            self.main()
+        except RecursionError:
+            raise Exception("Stack overflow")
+        finally:
+            sys.setrecursionlimit(limit)
+
 
 def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', action='store_true', help='target file is bytecode')
+    parser.add_argument('--backend', choices=BACKENDS, default="stack", help='virtual machine to compile the target file for')
+    parser.add_argument('--engine', choices=VM.ENGINES, default="table", help='instruction dispatch engine')
+    parser.add_argument('--eager', action='store_true', help='decode every function up front instead of on first call')
+    parser.add_argument('--hot', type=int, default=HOT_LOOP,
+                        help='iterations after which the table engine compiles a loop into a closure, 0 never does')
+    parser.add_argument('--no-cache', action='store_true', help='always compile the target file instead of reusing a cached binary')
+    parser.add_argument('--no-opt', dest='disabled', action='append', default=[], choices=list(PASSES) + ["all"],
+                        help='skip an optimisation pass when compiling the target file, repeatable')
+    parser.add_argument('--no-super', dest='superinstructions', action='store_false',
+                        help='compile the target file without stack machine superinstructions')
+    parser.add_argument('--stats', action='store_true', help='print executed instruction count and run time to stderr')
+    parser.add_argument('--memory', type=int, default=DEFAULT_MEMORY // 2 ** 20,
+                        help='megabytes the frames of a run may take, deeper recursion fails with a stack overflow')
     parser.add_argument("file")
     args = parser.parse_args()
     file = args.file
@@ -324,14 +1234,31 @@ def main():
     bytecode = None
     if args.b:
         with open(file, "rb") as f:
-            bytecode = bytearray(f.read())
+            bytecode = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     else:
-        bytecode = compile(file)
+        bytecode = compile(file, backend=args.backend, cache=None if args.no_cache else CompileCache(),
+                           passes=enabled_passes(args.disabled), superinstructions=args.superinstructions)
 
-    
-    vm = VM()
+    if pycode.is_python_module(bytecode):
+        vm = PythonVM(stats=args.stats, memory=args.memory * 2 ** 20, cache=None if args.no_cache else CompileCache())
+    elif binary.is_module(bytecode) and binary.read_header(memoryview(bytecode))[0] == binary.KIND_REGISTER:
+        vm = RegisterVM(stats=args.stats, memory=args.memory * 2 ** 20)
+    else:
+        vm = VM(engine=args.engine, stats=args.stats, lazy=not args.eager, memory=args.memory * 2 ** 20, hot=args.hot)
     vm.init(bytecode)
+    start = time.perf_counter()
     vm.run()
+    elapsed = time.perf_counter() - start
+    if args.stats and type(vm) == PythonVM:
+        # translated code runs without an instruction loop to count
+        print(f"ran in {elapsed:.4f}s", file=sys.stderr)
+    elif args.stats:
+        print(f"{vm.dispatched} instructions in {elapsed:.4f}s ({vm.dispatched / max(elapsed, 1e-9):.0f} instr/s)", file=sys.stderr)
+    if args.stats and type(vm) == VM and vm.promoted + vm.rejected:
+        interpreted = elapsed - vm.compiled_time - vm.compile_time
+        print(f"{vm.promoted} loops compiled, {vm.recompiled} recompiled, {vm.rejected} left interpreted: "
+              f"{interpreted:.4f}s interpreted, {vm.compiled_time:.4f}s compiled, {vm.compile_time:.4f}s compiling",
+              file=sys.stderr)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file